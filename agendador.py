@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Agendador de tarefas recorrentes dentro da aplicação.
+
+Substitui os crons externos que chamavam as rotas HTTP:
+
+- cada tarefa tem uma expressão cron de 5 campos (``min hora dia mês semana``),
+  no fuso ``AGENDADOR_FUSO``, e um atraso aleatório de até ``jitter`` segundos;
+- com vários workers, só quem obtiver o lock ``tarefa:<nome>`` no estado
+  compartilhado executa; o horário executado é registrado para que os demais
+  não repitam a mesma execução;
+- uma tarefa nunca se sobrepõe a si mesma (nem à rota manual equivalente,
+  que usa o mesmo lock);
+- as tarefas rodam em um executor próprio, fora das threads das requisições.
+
+Expressões vazias desativam a tarefa correspondente.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable
+
+from fastapi import APIRouter
+
+import estado
+
+try:
+    from zoneinfo import ZoneInfo
+
+    FUSO = ZoneInfo(os.getenv("AGENDADOR_FUSO", "America/Sao_Paulo"))
+except Exception:  # pragma: no cover - base de fusos ausente
+    FUSO = None
+
+router = APIRouter(prefix="/agendador", tags=["Agendador"])
+
+AGENDADOR_ATIVO = os.getenv("AGENDADOR_ATIVO", "1") == "1"
+AGENDADOR_THREADS = int(os.getenv("AGENDADOR_THREADS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+# ──────────────────────────────────────────────────────────
+# Expressões cron
+# ──────────────────────────────────────────────────────────
+_LIMITES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _campo(expr: str, minimo: int, maximo: int) -> frozenset[int]:
+    valores: set[int] = set()
+    for parte in expr.split(","):
+        faixa, _, passo = parte.partition("/")
+        if faixa == "*":
+            inicio, fim = minimo, maximo
+        elif "-" in faixa:
+            inicio, fim = (int(x) for x in faixa.split("-"))
+        else:
+            inicio = fim = int(faixa)
+        if inicio < minimo or fim > maximo or inicio > fim:
+            raise ValueError(f"Campo cron fora do intervalo: {parte}")
+        valores.update(range(inicio, fim + 1, int(passo) if passo else 1))
+    return frozenset(valores)
+
+
+class Cron:
+    """Expressão cron de 5 campos; dia da semana com 0 = domingo."""
+
+    def __init__(self, expressao: str):
+        campos = expressao.split()
+        if len(campos) != 5:
+            raise ValueError(f"Expressão cron inválida: {expressao!r}")
+        self.expressao = expressao
+        (self.minutos, self.horas, self.dias, self.meses, self.semana) = (
+            _campo(c, *limites) for c, limites in zip(campos, _LIMITES)
+        )
+        self._dia_livre = campos[2] == "*"
+        self._semana_livre = campos[4] == "*"
+
+    def _dia_ok(self, dt: datetime) -> bool:
+        dia = dt.day in self.dias
+        semana = (dt.isoweekday() % 7) in self.semana
+        # Como no cron: com os dois campos restritos, basta um deles casar
+        if self._dia_livre or self._semana_livre:
+            return dia and semana
+        return dia or semana
+
+    def proximo(self, depois: datetime) -> datetime:
+        """Primeiro horário após ``depois`` que satisfaz a expressão."""
+        dt = depois.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = dt + timedelta(days=366 * 4)
+        while dt < limite:
+            if dt.month not in self.meses:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._dia_ok(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.horas:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutos:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Expressão cron sem ocorrências: {self.expressao!r}")
+
+
+# ──────────────────────────────────────────────────────────
+# Tarefas
+# ──────────────────────────────────────────────────────────
+@dataclass
+class Tarefa:
+    nome: str
+    cron: Cron
+    funcao: Callable[[], object]
+    jitter: float = 30.0
+    # Tempo máximo esperado de execução (validade do lock entre workers)
+    duracao_max: float = 3600.0
+    executando: bool = False
+    proxima: datetime | None = None
+    ultima: dict = field(default_factory=dict)
+
+
+_tarefas: dict[str, Tarefa] = {}
+_executor = ThreadPoolExecutor(max_workers=AGENDADOR_THREADS, thread_name_prefix="agendador")
+_loops: list[asyncio.Task] = []
+
+
+def agora() -> datetime:
+    return datetime.now(FUSO)
+
+
+def registrar(
+    nome: str, expressao: str, funcao: Callable[[], object], jitter: float = 30.0,
+    duracao_max: float = 3600.0,
+) -> Tarefa | None:
+    """Cadastra uma tarefa; expressão vazia a desativa."""
+    if not expressao.strip():
+        logger.info("Tarefa %s desativada", nome)
+        return None
+    tarefa = Tarefa(nome, Cron(expressao), funcao, jitter, duracao_max)
+    _tarefas[nome] = tarefa
+    return tarefa
+
+
+def _executar(tarefa: Tarefa, horario: datetime) -> dict:
+    """Executa ``tarefa`` sob o lock entre workers, uma vez por horário."""
+    chave = f"agendador:{tarefa.nome}:ultimo_horario"
+    try:
+        with estado.lock(f"tarefa:{tarefa.nome}", ttl=tarefa.duracao_max, espera=0):
+            if estado.get(chave, "") >= horario.isoformat():
+                return {"situacao": "executada_por_outro_worker"}
+            inicio = time.perf_counter()
+            try:
+                resultado = tarefa.funcao()
+                situacao = "ok"
+            except Exception as e:
+                logger.exception("Tarefa %s falhou", tarefa.nome)
+                resultado, situacao = str(e), "erro"
+            estado.set(chave, horario.isoformat())
+    except TimeoutError:
+        return {"situacao": "em_execucao_em_outro_worker"}
+    return {
+        "situacao": situacao,
+        "duracao_s": round(time.perf_counter() - inicio, 3),
+        "resultado": resultado if situacao == "erro" else None,
+    }
+
+
+async def _laco(tarefa: Tarefa) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        tarefa.proxima = tarefa.cron.proximo(agora())
+        espera = (tarefa.proxima - agora()).total_seconds() + random.uniform(0, tarefa.jitter)
+        await asyncio.sleep(max(0.0, espera))
+        tarefa.executando = True
+        try:
+            resultado = await loop.run_in_executor(_executor, _executar, tarefa, tarefa.proxima)
+        except Exception as e:
+            # Falha fora da tarefa (ex.: estado compartilhado indisponível):
+            # registra e segue para o próximo horário, sem encerrar o laço
+            logger.exception("Agendador falhou ao executar %s", tarefa.nome)
+            resultado = {"situacao": "erro", "resultado": str(e)}
+        finally:
+            tarefa.executando = False
+        tarefa.ultima = {"horario": tarefa.proxima.isoformat(), **resultado}
+        logger.info("Tarefa %s: %s", tarefa.nome, tarefa.ultima)
+
+
+def _registrar_tarefas() -> None:
+    import kiwify
+    import mensagemdecobranca
+    import pagamentos
+    import relatorios
+
+    # Opt-in: enquanto um cron externo ainda chamar POST /mensagem-cobranca,
+    # ativar as duas cobraria os clientes em dobro
+    registrar(
+        "cobranca",
+        os.getenv("AGENDADOR_COBRANCA", ""),
+        mensagemdecobranca.executar_cobranca,
+        jitter=60,
+    )
+    registrar(
+        "atualizar_token_cursos",
+        os.getenv("AGENDADOR_ATUALIZAR_OM", "0 */6 * * *"),
+        kiwify.atualizar_token_e_cursos,
+        duracao_max=600,
+    )
+    registrar(
+        "reconciliar_pagamentos",
+        os.getenv("AGENDADOR_RECONCILIACAO", "30 */6 * * *"),
+        pagamentos.reconciliar,
+        jitter=120,
+        duracao_max=1800,
+    )
+    registrar(
+        "ingerir_relatorios",
+        os.getenv("AGENDADOR_RELATORIOS", "15 */3 * * *"),
+        relatorios.ingerir_todos,
+        jitter=120,
+        duracao_max=1800,
+    )
+
+
+@router.on_event("startup")
+async def _iniciar():
+    if not AGENDADOR_ATIVO:
+        return
+    _registrar_tarefas()
+    for tarefa in _tarefas.values():
+        _loops.append(asyncio.get_running_loop().create_task(_laco(tarefa)))
+
+
+@router.on_event("shutdown")
+async def _encerrar():
+    for laco in _loops:
+        laco.cancel()
+    # Tarefas já iniciadas terminam antes do worker sair
+    await asyncio.to_thread(_executor.shutdown, True)
+
+
+@router.get("", summary="Tarefas agendadas")
+def listar_tarefas():
+    return {
+        nome: {
+            "cron": t.cron.expressao,
+            "proxima": t.proxima.isoformat() if t.proxima else None,
+            "executando": t.executando,
+            "ultima": t.ultima or None,
+            "ultimo_horario_global": estado.get(f"agendador:{nome}:ultimo_horario"),
+        }
+        for nome, t in _tarefas.items()
+    }
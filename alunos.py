@@ -1,44 +1,449 @@
+"""Lista de alunos das unidades na OM.
+
+``GET /alunos/`` é servido de um retrato em memória da lista de cada unidade,
+recarregado em segundo plano a cada ``ALUNOS_RETRATO_INTERVALO`` segundos e
+logo após as alterações feitas pela própria API (cadastro, bloqueio, exclusão),
+que chamam ``invalidar()``. A invalidação é um contador por unidade no estado
+compartilhado, então vale para todos os workers. Um retrato invalidado
+continua sendo servido (o cabeçalho de idade mostra o atraso) enquanto a
+recarga roda em segundo plano; só a primeira carga espera pela OM.
+
+Sem ``unidade`` na consulta, os retratos de todas as unidades são obtidos em
+paralelo e combinados; o retrato combinado só é refeito quando algum deles muda.
+Cada aluno traz o campo ``id_unidade``.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import itertools
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterator
+
+import orjson
 import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+import cursosom
+import estado
+import unidades
+from cache import Singleflight
+from cursos import obter_nomes_por_ids
+from indice_alunos import IndiceAlunos
+from serializacao import dumps, exportar, ler_colunas
 
 router = APIRouter()
 
 OM_BASE = os.getenv("OM_BASE")
 BASIC_B64 = os.getenv("BASIC_B64")
-UNIDADE_ID = os.getenv("UNIDADE_ID")
 
+# Intervalo de recarga do retrato em segundos (0 desativa a recarga periódica)
+ALUNOS_RETRATO_INTERVALO = float(os.getenv("ALUNOS_RETRATO_INTERVALO", "300"))
+# Segundos desde a última recarga bem-sucedida do retrato
+CABECALHO_IDADE = "X-Retrato-Idade"
+VERSAO_CHAVE = "alunos:versao"
+
+# Cache do progresso por aluno (segundos) e consultas simultâneas à OM
+ALUNOS_PROGRESSO_TTL = float(os.getenv("ALUNOS_PROGRESSO_TTL", "300"))
+ALUNOS_PROGRESSO_THREADS = int(os.getenv("ALUNOS_PROGRESSO_THREADS", "8"))
 
-def _listar_alunos(page: int = 1, size: int = 1000) -> dict:
-    if not OM_BASE or not BASIC_B64 or not UNIDADE_ID:
+logger = logging.getLogger(__name__)
+
+# Colunas do CSV quando ``colunas`` não é informado
+COLUNAS_EXPORTACAO = [
+    "id", "nome", "usuario", "situacao", "email", "cpf", "telefone", "celular", "bloqueado",
+]
+
+
+def _listar_alunos(page: int = 1, size: int = 1000, unidade: str | None = None) -> dict:
+    if not OM_BASE or not BASIC_B64:
         raise RuntimeError("Variáveis de ambiente OM não configuradas.")
-    url = f"{OM_BASE}/alunos?page={page}&size={size}&id_unidade={UNIDADE_ID}"
+    unidade = unidades.resolver(unidade)
+    url = f"{OM_BASE}/alunos?page={page}&size={size}&id_unidade={unidade}"
     r = requests.get(url, headers={"Authorization": f"Basic {BASIC_B64}"}, timeout=10)
-    if r.ok and r.json().get("status") == "true":
-        return r.json()
+    if r.ok:
+        dados = orjson.loads(r.content)
+        if dados.get("status") == "true":
+            return dados
     raise RuntimeError(f"Falha ao obter lista de alunos: HTTP {r.status_code}")
 
 
-def _obter_todos_alunos() -> list:
-    alunos = []
+def _iterar_alunos(unidade: str | None = None) -> Iterator[dict]:
+    """Percorre os alunos da unidade página a página, sob demanda."""
+    unidade = unidades.resolver(unidade)
     page = 1
     while True:
-        dados = _listar_alunos(page=page)
-        for item in dados.get("data", []):
-            alunos.append(item)
+        dados = _listar_alunos(page=page, unidade=unidade)
+        for aluno in dados.get("data", []):
+            aluno.setdefault("id_unidade", unidade)
+            yield aluno
         pagina = dados.get("pagina", {})
         total = int(pagina.get("total", 0))
         size = int(pagina.get("size", 1000))
         if page * size >= total:
             break
         page += 1
-    return alunos
 
 
-@router.get("/", summary="Lista todos os alunos da unidade")
-def listar_alunos_endpoint():
+def _obter_todos_alunos(unidade: str | None = None) -> list:
+    return list(_iterar_alunos(unidade))
+
+
+# ──────────────────────────────────────────────────────────
+# Retrato em memória
+# ──────────────────────────────────────────────────────────
+@dataclass(frozen=True)
+class Retrato:
+    alunos: list
+    # Resposta de ``GET /alunos/`` já serializada
+    corpo: bytes
+    etag: str
+    # Quando o conteúdo mudou pela última vez / quando foi recarregado
+    modificado_em: float
+    atualizado_em: float
+    # Contador de invalidações lido antes da carga
+    versao: int
+    # Índice usado por ``GET /alunos/busca``
+    indice: IndiceAlunos
+    # Unidade do retrato (``unidades.TODAS`` no retrato combinado)
+    unidade: str
+
+
+_retratos: dict[str, Retrato] = {}
+_retrato_locks: dict[str, threading.Lock] = {}
+_combinado: Retrato | None = None
+_combinado_lock = threading.Lock()
+_laco: asyncio.Task | None = None
+
+
+def _chave_versao(unidade: str) -> str:
+    return f"{VERSAO_CHAVE}:{unidade}"
+
+
+def _etag(dados: bytes) -> str:
+    return '"' + hashlib.blake2b(dados, digest_size=16).hexdigest() + '"'
+
+
+def invalidar(unidade: str | None = None) -> None:
+    """Marca o retrato da unidade (sem ``unidade``, de todas) como desatualizado."""
+    for u in [unidade] if unidade else unidades.UNIDADES:
+        estado.incr(_chave_versao(u))
+
+
+def _recarregar(unidade: str, versao: int) -> Retrato:
+    lista = _obter_todos_alunos(unidade)
+    corpo = dumps({"alunos": lista})
+    etag = _etag(corpo)
+    agora = time.time()
+    anterior = _retratos.get(unidade)
+    if anterior and anterior.etag == etag:
+        modificado_em, indice = anterior.modificado_em, anterior.indice
+    else:
+        modificado_em, indice = agora, IndiceAlunos(lista)
+    retrato = Retrato(lista, corpo, etag, modificado_em, agora, versao, indice, unidade)
+    _retratos[unidade] = retrato
+    return retrato
+
+
+def _recarregar_em_segundo_plano(unidade: str) -> None:
+    """Dispara a recarga da unidade, a menos que uma já esteja em andamento."""
+    lock = _retrato_locks.setdefault(unidade, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return
+
+    def _executar():
+        try:
+            _recarregar(unidade, estado.contador(_chave_versao(unidade)))
+        except Exception as e:
+            logger.warning("Falha ao recarregar o retrato de alunos (%s): %s", unidade, e)
+        finally:
+            lock.release()
+
+    threading.Thread(target=_executar, name=f"retrato-{unidade}", daemon=True).start()
+
+
+def _retrato_unidade(unidade: str) -> Retrato:
+    versao = estado.contador(_chave_versao(unidade))
+    atual = _retratos.get(unidade)
+    if atual is not None:
+        if atual.versao < versao:
+            _recarregar_em_segundo_plano(unidade)
+        return atual
+    # Primeira carga: não há o que servir enquanto a OM responde
+    with _retrato_locks.setdefault(unidade, threading.Lock()):
+        # Outra thread pode ter carregado enquanto esperávamos
+        atual = _retratos.get(unidade)
+        if atual is not None:
+            return atual
+        return _recarregar(unidade, versao)
+
+
+def _combinar(retratos: list[Retrato]) -> Retrato:
+    """Retrato de várias unidades; refeito só quando alguma delas muda."""
+    global _combinado
+    etag = _etag("".join(r.etag for r in retratos).encode())
+    atualizado_em = min(r.atualizado_em for r in retratos)
+    with _combinado_lock:
+        atual = _combinado
+        if atual is None or atual.etag != etag:
+            lista = [a for r in retratos for a in r.alunos]
+            atual = _combinado = Retrato(
+                lista,
+                dumps({"alunos": lista}),
+                etag,
+                max(r.modificado_em for r in retratos),
+                atualizado_em,
+                0,
+                IndiceAlunos(lista),
+                unidades.TODAS,
+            )
+    # A idade é a da unidade recarregada há mais tempo
+    return replace(atual, atualizado_em=atualizado_em)
+
+
+def obter_retrato(unidade: str | None = None) -> Retrato:
+    """Retrato atual da unidade; carrega da OM se ainda não existe.
+
+    Se foi invalidado, devolve o retrato atual e recarrega em segundo plano.
+
+    Sem ``unidade``, combina os retratos de todas as unidades, obtidos em paralelo.
+    """
+    selecionadas = unidades.selecionar(unidade)
+    if len(selecionadas) == 1:
+        return _retrato_unidade(selecionadas[0])
+    return _combinar(list(unidades.em_paralelo(_retrato_unidade, selecionadas).values()))
+
+
+def atualizar_retrato(unidade: str | None = None) -> Retrato:
+    unidade = unidades.resolver(unidade)
+    with _retrato_locks.setdefault(unidade, threading.Lock()):
+        return _recarregar(unidade, estado.contador(_chave_versao(unidade)))
+
+
+async def _recarregar_periodicamente() -> None:
+    while True:
+        try:
+            # Todas as unidades em paralelo; a falha de uma não impede as demais
+            await asyncio.to_thread(unidades.em_paralelo, atualizar_retrato)
+        except Exception as e:
+            # Mantém o retrato anterior; o cabeçalho de idade mostra o atraso
+            logger.warning("Falha ao recarregar o retrato de alunos: %s", e)
+        await asyncio.sleep(ALUNOS_RETRATO_INTERVALO)
+
+
+@router.on_event("startup")
+async def _iniciar_retrato():
+    global _laco
+    if ALUNOS_RETRATO_INTERVALO > 0 and OM_BASE and BASIC_B64 and unidades.UNIDADES:
+        _laco = asyncio.get_running_loop().create_task(_recarregar_periodicamente())
+
+
+@router.on_event("shutdown")
+async def _encerrar_retrato():
+    if _laco is not None:
+        _laco.cancel()
+
+
+def _nao_modificado(request: Request, retrato: Retrato) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+        return "*" in etags or retrato.etag in etags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(retrato.modificado_em) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get("/", summary="Lista todos os alunos da unidade (ou de todas)")
+def listar_alunos_endpoint(request: Request, unidade: str | None = None):
+    try:
+        retrato = obter_retrato(unidade)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    headers = {
+        "ETag": retrato.etag,
+        "Last-Modified": formatdate(retrato.modificado_em, usegmt=True),
+        "Cache-Control": "no-cache",
+        CABECALHO_IDADE: str(int(time.time() - retrato.atualizado_em)),
+    }
+    if _nao_modificado(request, retrato):
+        return Response(status_code=304, headers=headers)
+    return Response(retrato.corpo, media_type="application/json", headers=headers)
+
+
+@router.get("/export", summary="Exporta os alunos da unidade (ou de todas) em NDJSON ou CSV")
+def exportar_alunos(formato: str = "ndjson", colunas: str | None = None, unidade: str | None = None):
+    """Envia os alunos à medida que as páginas chegam da OM.
+
+    ``colunas`` (ex.: ``nome,cpf,telefone``) limita os campos de cada linha.
+    Sem ``unidade``, as unidades são enviadas uma após a outra.
+    """
+    try:
+        selecionadas = unidades.selecionar(unidade)
+        linhas = itertools.chain.from_iterable(_iterar_alunos(u) for u in selecionadas)
+        padrao = COLUNAS_EXPORTACAO + ["id_unidade"] if len(selecionadas) > 1 else COLUNAS_EXPORTACAO
+        return exportar(linhas, formato, ler_colunas(colunas), "alunos", padrao)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _codificar_cursor(chave: tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(chave)).decode()
+
+
+def _decodificar_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        nome, id_aluno = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(nome), str(id_aluno)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise HTTPException(400, "Cursor inválido")
+
+
+@router.get("/busca", summary="Busca alunos por nome, CPF, telefone ou e-mail")
+def buscar_alunos(
+    nome: str | None = None,
+    cpf: str | None = None,
+    telefone: str | None = None,
+    email: str | None = None,
+    bloqueado: bool | None = None,
+    cursor: str | None = None,
+    limite: int = Query(50, ge=1, le=500),
+    unidade: str | None = None,
+):
+    """Busca no retrato em memória, ordenada por nome.
+
+    ``nome`` ignora acentos e maiúsculas e casa por prefixo de cada palavra
+    (``jos sil`` encontra "José da Silva"); CPF, telefone e e-mail precisam ser
+    exatos. Para a próxima página, repita a busca com ``cursor``. Sem
+    ``unidade``, busca em todas as unidades.
+    """
+    depois = _decodificar_cursor(cursor) if cursor else None
+    try:
+        retrato = obter_retrato(unidade)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    pagina, total, proximo = retrato.indice.buscar(
+        nome, cpf, telefone, email, bloqueado, depois, limite
+    )
+    return {
+        "alunos": pagina,
+        "total": total,
+        "cursor": _codificar_cursor(proximo) if proximo else None,
+    }
+
+
+# ──────────────────────────────────────────────────────────
+# Progresso do aluno
+# ──────────────────────────────────────────────────────────
+_progresso = estado.CacheCompartilhado("alunos:progresso", ALUNOS_PROGRESSO_TTL)
+_voo_progresso = Singleflight()
+_executor_progresso = ThreadPoolExecutor(ALUNOS_PROGRESSO_THREADS, thread_name_prefix="progresso")
+
+_CAMPOS_PERCENTUAL = ("progresso", "percentual", "porcentagem", "andamento", "progress")
+
+
+def invalidar_progresso(id_aluno) -> None:
+    """Descarta o progresso em cache (ex.: após uma nova matrícula)."""
+    _progresso.pop(str(id_aluno))
+
+
+def _om_get(caminho: str) -> dict:
+    if not OM_BASE or not BASIC_B64:
+        raise RuntimeError("Variáveis de ambiente OM não configuradas.")
+    r = requests.get(f"{OM_BASE}{caminho}", headers={"Authorization": f"Basic {BASIC_B64}"}, timeout=10)
+    if r.ok:
+        dados = orjson.loads(r.content)
+        if dados.get("status") == "true":
+            return dados
+    raise RuntimeError(f"Falha ao consultar {caminho}: HTTP {r.status_code}")
+
+
+def _primeiro(dados: dict, *chaves):
+    for chave in chaves:
+        if dados.get(chave) not in (None, ""):
+            return dados[chave]
+    return None
+
+
+def _percentual(detalhes) -> float | None:
+    if not isinstance(detalhes, dict):
+        return None
+    valor = _primeiro(detalhes, *_CAMPOS_PERCENTUAL)
+    try:
+        return float(str(valor).rstrip("%").replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def _progresso_curso(id_aluno: str, matricula: dict, nomes: dict[str, str]) -> dict:
+    contrato = _primeiro(matricula, "id_contrato", "contrato_id", "contrato")
+    curso = _primeiro(matricula, "id_curso", "curso_id", "id")
+    item = {
+        "contrato": contrato,
+        "curso": curso,
+        "nome": nomes.get(str(curso)) or _primeiro(matricula, "nome", "curso_nome", "curso"),
+    }
+    if contrato is None or curso is None:
+        item["erro"] = "Matrícula sem contrato ou curso"
+        return item
+    try:
+        detalhes = _om_get(f"/aluno/{id_aluno}/contrato/{contrato}/curso/{curso}").get("data")
+    except Exception as e:
+        item["erro"] = str(e)
+        return item
+    item["progresso"] = _percentual(detalhes)
+    item["detalhes"] = detalhes
+    return item
+
+
+def _montar_progresso(id_aluno: str) -> dict:
+    matriculas = _om_get(f"/alunos/cursos/{id_aluno}").get("data") or []
+    nomes = cursosom.nomes_por_id()
+    # Detalhes de todos os cursos em paralelo
+    cursos = list(
+        _executor_progresso.map(lambda m: _progresso_curso(id_aluno, m, nomes), matriculas)
+    )
+    ids = [int(c["curso"]) for c in cursos if str(c["curso"]).isdigit()]
+    resultado = {
+        "aluno": id_aluno,
+        "cursos": cursos,
+        "pacotes": obter_nomes_por_ids(ids),
+        "consultado_em": time.time(),
+    }
+    # Resultados parciais não ficam em cache
+    if not any("erro" in c for c in cursos):
+        _progresso.set(id_aluno, resultado)
+    return resultado
+
+
+@router.get("/{id_aluno}/progresso", summary="Cursos do aluno e o andamento em cada um")
+def progresso_aluno(id_aluno: str, atualizar: bool = False):
+    """Cursos em que o aluno está matriculado, com os detalhes de cada um.
+
+    A resposta fica em cache por ``ALUNOS_PROGRESSO_TTL`` segundos;
+    ``atualizar=true`` consulta a OM novamente.
+    """
+    if not atualizar and (em_cache := _progresso.get(id_aluno)) is not None:
+        return {**em_cache, "em_cache": True}
     try:
-        lista = _obter_todos_alunos()
-        return {"alunos": lista}
+        resultado = _voo_progresso.executar(id_aluno, _montar_progresso, id_aluno)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {**resultado, "em_cache": False}
@@ -1,32 +1,148 @@
 import os
 import logging
-import phonenumbers
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import queue
+import threading
+import time
+import uuid
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from utils import formatar_numero_whatsapp
+import normalizacao
+from notificacoes import BaldeDeFichas
+from serializacao import RotaJSON
+import estado
 try:
     from wppconnect import WppConnect
 except Exception:  # pragma: no cover - lib opcional
     WppConnect = None
 
-router = APIRouter(prefix="/whatsapp", tags=["WhatsApp"])
+router = APIRouter(prefix="/whatsapp", tags=["WhatsApp"], route_class=RotaJSON)
+
+# ─── estado da sessão (compartilhado entre os workers) ─────
+STATUS_CHAVE = "whatsapp:status"
+
+
+def obter_status() -> dict:
+    return estado.get(STATUS_CHAVE, {"state": "loading", "qr": None})
+
+
+def _definir_status(state: str, qr: str | None = None) -> None:
+    estado.set(STATUS_CHAVE, {"state": state, "qr": qr})
 
 # ─── sessão global ─────────────────────────────────
 if WppConnect:
     wpp = WppConnect(session="default", token=os.getenv("WA_TOKEN"))
-    STATUS = {"state": "loading", "qr": None}   # loading | ready
+    _definir_status("loading")   # loading | ready
 else:  # biblioteca ausente
     wpp = None
-    STATUS = {"state": "disabled", "qr": None}
+    _definir_status("disabled")
 
 if wpp:
     @wpp.onQRCode
     def on_qr(base64_qr, *_):
-        STATUS.update(state="loading", qr=base64_qr)
+        _definir_status("loading", base64_qr)
 
     @wpp.onReady
     def on_ready():
-        STATUS.update(state="ready", qr=None)
+        _definir_status("ready")
+
+# ─── fila de envio ──────────────────────────
+# Uma única thread conversa com a sessão; a fila é limitada para não acumular
+# mensagens sem fim quando a sessão está lenta.
+WPP_FILA_MAX = int(os.getenv("WPP_FILA_MAX", "1000"))
+WPP_LOTE = int(os.getenv("WPP_LOTE", "20"))
+WPP_TAXA = float(os.getenv("WPP_TAXA", "5"))
+WPP_STATUS_TTL = float(os.getenv("WPP_STATUS_TTL", "86400"))
+
+_fila: queue.Queue = queue.Queue(maxsize=WPP_FILA_MAX)
+_envios = estado.CacheCompartilhado("whatsapp:mensagem", WPP_STATUS_TTL)
+_balde = BaldeDeFichas(WPP_TAXA, WPP_LOTE)
+_enviador: threading.Thread | None = None
+_enviador_lock = threading.Lock()
+# Passagem na_fila -> enviando | cancelado, e quem espera o fim de cada mensagem
+_situacao_lock = threading.Lock()
+_concluidas: dict[str, threading.Event] = {}
+
+def _chat_id(numero: str) -> str | None:
+    """Valida o número (memoizado) e retorna o chat id, ou ``None`` se inválido."""
+    formatado = normalizacao.telefone_valido(numero)
+    return formatado + "@c.us" if formatado else None
+
+def _registrar(mid: str, situacao: str, erro: str | None = None) -> None:
+    _envios.set(mid, {"status": situacao, "erro": erro, "atualizado": time.time()})
+    if situacao in ("enviado", "falha", "cancelado"):
+        concluida = _concluidas.pop(mid, None)
+        if concluida is not None:
+            concluida.set()
+
+def _proximo_lote() -> list[tuple[str, str, str]]:
+    """Aguarda uma mensagem e leva junto as que já estiverem na fila."""
+    lote = [_fila.get()]
+    while len(lote) < WPP_LOTE:
+        try:
+            lote.append(_fila.get_nowait())
+        except queue.Empty:
+            break
+    return lote
+
+def _enviar_fila() -> None:
+    while True:
+        lote = _proximo_lote()
+        for mid, chat_id, mensagem in lote:
+            _balde.consumir()
+            with _situacao_lock:
+                if (_envios.get(mid) or {}).get("status") == "cancelado":
+                    _fila.task_done()
+                    continue
+                _registrar(mid, "enviando")
+            try:
+                wpp.sendMessage(chat_id, mensagem)
+            except Exception as e:
+                logging.exception("Erro ao enviar mensagem via WPP")
+                _registrar(mid, "falha", str(e))
+            else:
+                _registrar(mid, "enviado")
+            finally:
+                _fila.task_done()
+
+def _iniciar_enviador() -> None:
+    global _enviador
+    with _enviador_lock:
+        if _enviador is None:
+            _enviador = threading.Thread(target=_enviar_fila, name="wpp-enviador", daemon=True)
+            _enviador.start()
+
+def enfileirar(chat_id: str, mensagem: str, aguardar: bool = False) -> str:
+    """Coloca a mensagem na fila do enviador e retorna seu id.
+
+    Levanta ``queue.Full`` se a fila estiver cheia. Com ``aguardar``, o fim do
+    envio pode ser esperado com ``aguardar_envio``.
+    """
+    mid = uuid.uuid4().hex
+    if aguardar:
+        _concluidas[mid] = threading.Event()
+    _registrar(mid, "na_fila")
+    try:
+        _fila.put_nowait((mid, chat_id, mensagem))
+    except queue.Full:
+        _concluidas.pop(mid, None)
+        _envios.pop(mid)
+        raise
+    _iniciar_enviador()
+    return mid
+
+def aguardar_envio(mid: str, timeout: float) -> dict:
+    """Espera a mensagem sair da fila; se ainda não começou a ser enviada ao
+    fim do prazo, ela é cancelada (``status`` ``cancelado``)."""
+    concluida = _concluidas.get(mid)
+    if concluida is not None:
+        concluida.wait(timeout)
+    with _situacao_lock:
+        situacao = _envios.get(mid) or {"status": "falha", "erro": "situação expirada"}
+        if situacao["status"] == "na_fila":
+            _registrar(mid, "cancelado", "tempo de espera esgotado")
+            situacao = _envios.get(mid)
+    _concluidas.pop(mid, None)
+    return situacao
 
 # ─── modelos ────────────────────────────────
 class Msg(BaseModel):
@@ -37,29 +153,29 @@ class Msg(BaseModel):
 @router.get("/qr")
 def qr():
     """Retorna QR em base64; 'disabled' se lib ausente."""
-    return STATUS
+    return obter_status()
 
 @router.post("")
-async def send(msg: Msg, bg: BackgroundTasks):
+async def send(msg: Msg):
     if not wpp:
         raise HTTPException(501, "Biblioteca wppconnect indisponível")
 
-    numero_formatado = "+" + formatar_numero_whatsapp(msg.numero)
-    try:
-        p = phonenumbers.parse(numero_formatado, None)
-        if not phonenumbers.is_valid_number(p):
-            raise ValueError()
-    except Exception:
+    chat_id = _chat_id(msg.numero)
+    if not chat_id:
         raise HTTPException(422, "Número inválido (use formato +5511999999999)")
-    if STATUS["state"] != "ready":
+    if obter_status()["state"] != "ready":
         raise HTTPException(503, "Sessão WhatsApp ainda não conectada")
 
-    chat_id = numero_formatado.lstrip("+") + "@c.us"
+    try:
+        mid = enfileirar(chat_id, msg.mensagem)
+    except queue.Full:
+        raise HTTPException(429, "Fila de envio cheia, tente novamente em instantes")
+    return {"success": True, "id": mid, "status": "na_fila"}
 
-    def _worker():
-        try:
-            wpp.sendMessage(chat_id, msg.mensagem)
-        except Exception:
-            logging.exception("Erro ao enviar mensagem via WPP")
-    bg.add_task(_worker)
-    return {"success": True}
+@router.get("/status/{mid}")
+def status(mid: str):
+    """Situação de uma mensagem: na_fila | enviando | enviado | falha | cancelado."""
+    situacao = _envios.get(mid)
+    if situacao is None:
+        raise HTTPException(404, "Mensagem não encontrada")
+    return {"id": mid, **situacao}
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 from datetime import date
@@ -7,22 +8,35 @@ from typing import List
 import requests
 from fastapi import APIRouter, HTTPException, Request
 
-from utils import formatar_numero_whatsapp, parse_valor
+from utils import parse_valor
+import estado
+import normalizacao
+from cache import chamada_unica
+from rastreio import etapa
+from serializacao import RotaJSON
 from matricular import realizar_matricula
 from cursos import CURSOS_OM
 import msgasaas
+import captura
+import pagamentos
+import notificacoes
 
 # Conjunto com todos os IDs de cursos válidos, usado para validar
 # o campo `externalReference` recebido no webhook
 VALID_CURSO_IDS = {cid for ids in CURSOS_OM.values() for cid in ids}
 
-router = APIRouter(prefix="/asaas", tags=["Matrícula Assas"])
+router = APIRouter(prefix="/asaas", tags=["Matrícula Assas"], route_class=RotaJSON)
 
 ASAAS_KEY = os.getenv("ASAAS_KEY")
 ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://api.asaas.com/v3")
 
-WHATSAPP_URL = "https://whatsapptest-stij.onrender.com/send"
 SENHA_PADRAO = os.getenv("SENHA_PADRAO", "1234567")
+# Tempo (s) em que pagamentos e clientes consultados no ASAAS ficam em cache.
+# Cobre o par PAYMENT_RECEIVED/PAYMENT_CONFIRMED de um mesmo pagamento.
+ASAAS_CACHE_TTL = float(os.getenv("ASAAS_CACHE_TTL", "600"))
+
+_pagamentos = estado.CacheCompartilhado("asaas_pagamento", ASAAS_CACHE_TTL)
+_clientes = estado.CacheCompartilhado("asaas_cliente", ASAAS_CACHE_TTL)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,7 +48,12 @@ def _headers() -> dict:
     return {"Content-Type": "application/json", "access_token": ASAAS_KEY}
 
 
+@etapa("asaas_cliente")
 def _criar_ou_obter_cliente(nome: str, cpf: str, phone: str) -> str:
+    # Documento inválido nem chega ao ASAAS
+    if not normalizacao.documento_valido(cpf):
+        raise HTTPException(400, "CPF/CNPJ inválido")
+    cpf = normalizacao.cpf(cpf)
     payload = {"name": nome, "cpfCnpj": cpf, "mobilePhone": phone}
     try:
         r = requests.post(
@@ -61,6 +80,7 @@ def _criar_ou_obter_cliente(nome: str, cpf: str, phone: str) -> str:
     raise HTTPException(r.status_code, r.text)
 
 
+@etapa("asaas_cliente")
 def obter_cliente_por_cpf(cpf: str) -> str | None:
     """Retorna o ID do cliente ASAAS a partir do CPF informado."""
     try:
@@ -137,16 +157,7 @@ def _enviar_whatsapp(nome: str, phone: str, login: str, modulo: str) -> None:
         f"🍎 iOS: https://apps.apple.com/br/app/meu-app-de-cursos/id1581898914\n\n"
         f"🚀 Bons estudos! Qualquer dúvida, conte com a nossa equipe!"
     )
-    try:
-        r = requests.get(
-            WHATSAPP_URL,
-            params={"para": formatar_numero_whatsapp(phone), "mensagem": mensagem},
-            timeout=10,
-        )
-        r.raise_for_status()
-        logger.info("WhatsApp enviado para %s", phone)
-    except Exception:
-        logger.exception("Erro ao enviar mensagem via WhatsApp")
+    notificacoes.enviar_whatsapp(phone, mensagem, "boas-vindas-asaas")
 
 
 def _enviar_whatsapp_checkout(nome: str, phone: str, url: str) -> None:
@@ -157,16 +168,7 @@ def _enviar_whatsapp_checkout(nome: str, phone: str, url: str) -> None:
         "Assim que o pagamento for confirmado, enviaremos seus dados de acesso.\n\n"
         "Qualquer dúvida, estou à disposição para ajudar!"
     )
-    try:
-        r = requests.get(
-            WHATSAPP_URL,
-            params={"para": formatar_numero_whatsapp(phone), "mensagem": mensagem},
-            timeout=10,
-        )
-        r.raise_for_status()
-        logger.info("WhatsApp de checkout enviado para %s", phone)
-    except Exception:
-        logger.exception("Erro ao enviar mensagem de checkout via WhatsApp")
+    notificacoes.enviar_whatsapp(phone, mensagem, "checkout-asaas")
 
 
 def _criar_checkout(
@@ -212,12 +214,13 @@ def _criar_checkout(
         payload["redirectUrl"] = redirect_url
 
     try:
-        r = requests.post(
-            f"{ASAAS_BASE_URL}/payments",
-            json=payload,
-            headers=_headers(),
-            timeout=10,
-        )
+        with etapa("asaas_pagamento"):
+            r = requests.post(
+                f"{ASAAS_BASE_URL}/payments",
+                json=payload,
+                headers=_headers(),
+                timeout=10,
+            )
     except requests.RequestException as e:
         raise HTTPException(502, f"Erro de conexão: {e}")
 
@@ -336,12 +339,13 @@ def criar_assinatura_recorrente(dados: dict, enviar_whatsapp: bool = True):
         payload["redirectUrl"] = redirect_url
 
     try:
-        r = requests.post(
-            f"{ASAAS_BASE_URL}/subscriptions",
-            json=payload,
-            headers=_headers(),
-            timeout=10,
-        )
+        with etapa("asaas_assinatura"):
+            r = requests.post(
+                f"{ASAAS_BASE_URL}/subscriptions",
+                json=payload,
+                headers=_headers(),
+                timeout=10,
+            )
     except requests.RequestException as e:
         raise HTTPException(502, f"Erro de conexão: {e}")
 
@@ -362,16 +366,17 @@ def criar_assinatura_recorrente(dados: dict, enviar_whatsapp: bool = True):
 
     if enviar_whatsapp:
         try:
-            msgasaas.enviar_link_fatura(
-                {
-                    "nome": nome,
-                    "whatsapp": phone,
-                    "fatura_url": url,
-                    "customer": customer_id,
-                    "valor": valor,
-                    "descricao": descricao,
-                }
-            )
+            with etapa("msgasaas"):
+                msgasaas.enviar_link_fatura(
+                    {
+                        "nome": nome,
+                        "whatsapp": phone,
+                        "fatura_url": url,
+                        "customer": customer_id,
+                        "valor": valor,
+                        "descricao": descricao,
+                    }
+                )
         except Exception:
             logger.exception("Erro ao acionar msgasaas")
 
@@ -388,41 +393,103 @@ def criar_assinatura_recorrente(dados: dict, enviar_whatsapp: bool = True):
     }
 
 
+def _link_fatura(dados: dict) -> str | None:
+    return (
+        dados.get("invoiceUrl")
+        or dados.get("bankSlipUrl")
+        or dados.get("transactionReceiptUrl")
+    )
+
+
+@etapa("asaas_pagamento")
+@chamada_unica("asaas_pagamento")
+def obter_pagamento(payment_id: str) -> dict | None:
+    """Retorna o pagamento do ASAAS (com cache); ``None`` em caso de falha."""
+    cached = _pagamentos.get(payment_id)
+    if cached is not None:
+        return cached
+    try:
+        resp = requests.get(
+            f"{ASAAS_BASE_URL}/payments/{payment_id}",
+            headers=_headers(),
+            timeout=10,
+        )
+    except requests.RequestException:
+        logger.exception("Erro ao buscar detalhes do pagamento %s", payment_id)
+        return None
+    if not resp.ok:
+        return None
+    data = resp.json()
+    _pagamentos.set(payment_id, data)
+    return data
+
+
+@etapa("asaas_cliente")
+@chamada_unica("asaas_cliente")
+def obter_cliente(customer_id: str) -> dict:
+    """Retorna o cliente do ASAAS (com cache).
+
+    Levanta ``HTTPException`` com o status do ASAAS quando a consulta falha.
+    """
+    cached = _clientes.get(customer_id)
+    if cached is not None:
+        return cached
+    c = requests.get(
+        f"{ASAAS_BASE_URL}/customers/{customer_id}", headers=_headers(), timeout=10
+    )
+    if not c.ok:
+        raise HTTPException(c.status_code, c.text)
+    cust = c.json()
+    _clientes.set(customer_id, cust)
+    return cust
+
+
+async def _sem_consulta():
+    return None
+
+
 @router.post("/webhook")
 async def webhook(req: Request):
     evt = await req.json()
+    captura.registrar("/asaas/webhook", evt)
+    # Todo evento alimenta o livro local de pagamentos, inclusive os ignorados abaixo
+    await asyncio.to_thread(pagamentos.registrar_evento, evt)
     if evt.get("event") not in {"PAYMENT_RECEIVED", "PAYMENT_CONFIRMED"}:
         return {"status": "ignored"}
+    # A mensagem de boas-vindas sai ao final: acorda o gateway desde já
+    notificacoes.esperar_envios()
 
     payment = evt.get("payment", {})
-    fatura_url = (
-        payment.get("invoiceUrl")
-        or payment.get("bankSlipUrl")
-        or payment.get("transactionReceiptUrl")
-    )
-    if not fatura_url and payment.get("id"):
-        try:
-            resp = requests.get(
-                f"{ASAAS_BASE_URL}/payments/{payment['id']}",
-                headers=_headers(),
-                timeout=10,
-            )
-            if resp.ok:
-                data = resp.json()
-                fatura_url = (
-                    data.get("invoiceUrl")
-                    or data.get("bankSlipUrl")
-                    or data.get("transactionReceiptUrl")
-                )
-        except requests.RequestException:
-            logger.exception(
-                "Erro ao buscar detalhes do pagamento %s", payment.get("id")
-            )
-    customer_id = payment.get("customer") or evt.get("customer")
+    fatura_url = _link_fatura(payment)
+
+    cliente_evt = evt.get("customer")
+    if isinstance(cliente_evt, dict):
+        customer_id = payment.get("customer") or cliente_evt.get("id")
+    else:
+        customer_id = payment.get("customer") or cliente_evt
+        cliente_evt = None
     if not customer_id:
         return {"status": "ignored"}
 
-    cursos_ref = payment.get("externalReference", "")
+    # Só consulta o ASAAS pelo que o evento não trouxe; pagamento e cliente em paralelo
+    precisa_pagamento = payment.get("id") and (
+        not fatura_url or not (payment.get("description") or payment.get("externalReference"))
+    )
+    usa_cliente_evt = bool(
+        cliente_evt and cliente_evt.get("name") and cliente_evt.get("cpfCnpj")
+    )
+    pagamento_api, cust = await asyncio.gather(
+        asyncio.to_thread(obter_pagamento, payment["id"]) if precisa_pagamento else _sem_consulta(),
+        _sem_consulta() if usa_cliente_evt else asyncio.to_thread(obter_cliente, customer_id),
+    )
+    if usa_cliente_evt:
+        cust = cliente_evt
+    if pagamento_api:
+        # Campos do próprio evento têm prioridade sobre os consultados
+        payment = {**pagamento_api, **{k: v for k, v in payment.items() if v}}
+        fatura_url = fatura_url or _link_fatura(payment)
+
+    cursos_ref = payment.get("externalReference") or ""
     descricao = (payment.get("description") or "").strip()
 
     cursos_ids: List[int] = []
@@ -443,12 +510,6 @@ async def webhook(req: Request):
                 if cid in VALID_CURSO_IDS:
                     cursos_ids.append(cid)
 
-    c = requests.get(
-        f"{ASAAS_BASE_URL}/customers/{customer_id}", headers=_headers(), timeout=10
-    )
-    if not c.ok:
-        raise HTTPException(c.status_code, c.text)
-    cust = c.json()
     nome = cust.get("name")
     cpf = cust.get("cpfCnpj")
     phone = cust.get("mobilePhone") or cust.get("phone")
@@ -1,15 +1,67 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from typing import Iterator
+
 import requests
 from fastapi import APIRouter, HTTPException
 
-from asaas import _criar_ou_obter_cliente, _headers
+from asaas import _criar_ou_obter_cliente, _headers, obter_cliente
 from utils import parse_valor
+from serializacao import RespostaJSON, RotaJSON, exportar, ler_colunas
 
-router = APIRouter(prefix="/assinantes", tags=["Assinantes"])
+router = APIRouter(prefix="/assinantes", tags=["Assinantes"], route_class=RotaJSON)
 
 ASAAS_KEY = os.getenv("ASAAS_KEY")
 ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://api.asaas.com/v3")
+# Consultas simultâneas de clientes durante a exportação
+ASSINANTES_EXPORT_THREADS = int(os.getenv("ASSINANTES_EXPORT_THREADS", "8"))
+
+COLUNAS = ["nome", "numero", "valor", "curso", "vencimento"]
+
+
+def _formatar_assinante(sub: dict) -> dict:
+    """Linha de assinante a partir de uma assinatura do ASAAS."""
+    cid = sub.get("customer")
+    nome = None
+    telefone = None
+    if cid:
+        try:
+            cust = obter_cliente(cid)
+            nome = cust.get("name")
+            telefone = cust.get("mobilePhone") or cust.get("phone")
+        except (requests.RequestException, HTTPException):
+            pass
+    return {
+        "nome": nome,
+        "numero": telefone,
+        "valor": sub.get("value"),
+        "curso": sub.get("description"),
+        "vencimento": sub.get("nextDueDate"),
+    }
+
+
+def _iterar_assinantes() -> Iterator[dict]:
+    """Percorre todas as assinaturas, página a página, já formatadas.
+
+    Os clientes de cada página são consultados em paralelo.
+    """
+    headers = {"Content-Type": "application/json", "access_token": ASAAS_KEY}
+    offset, limit = 0, 100
+    with ThreadPoolExecutor(ASSINANTES_EXPORT_THREADS) as executor:
+        while True:
+            resp = requests.get(
+                f"{ASAAS_BASE_URL}/subscriptions",
+                params={"limit": limit, "offset": offset},
+                headers=headers,
+                timeout=10,
+            )
+            resp.raise_for_status()
+            dados = resp.json()
+            yield from executor.map(_formatar_assinante, dados.get("data") or [])
+            if not dados.get("hasMore"):
+                return
+            offset += limit
 
 
 @router.get("/")
@@ -30,41 +82,27 @@ def listar_assinantes():
         raise HTTPException(502, f"Erro ao obter assinaturas: {e}")
 
     dados = resp.json().get("data") or []
-    assinantes = []
-
-    for sub in dados:
-        cid = sub.get("customer")
-        valor = sub.get("value")
-        curso = sub.get("description")
-        vencimento = sub.get("nextDueDate")
-
-        nome = None
-        telefone = None
-        if cid:
-            try:
-                c = requests.get(
-                    f"{ASAAS_BASE_URL}/customers/{cid}",
-                    headers=headers,
-                    timeout=10,
-                )
-                if c.ok:
-                    cust = c.json()
-                    nome = cust.get("name")
-                    telefone = cust.get("mobilePhone") or cust.get("phone")
-            except requests.RequestException:
-                pass
-
-        assinantes.append(
-            {
-                "nome": nome,
-                "numero": telefone,
-                "valor": valor,
-                "curso": curso,
-                "vencimento": vencimento,
-            }
-        )
+    assinantes = [_formatar_assinante(sub) for sub in dados]
+
+    return RespostaJSON({"assinantes": assinantes})
+
 
-    return {"assinantes": assinantes}
+@router.get("/export")
+def exportar_assinantes(formato: str = "ndjson", colunas: str | None = None):
+    """Exporta todas as assinaturas em NDJSON ou CSV, em streaming.
+
+    ``colunas`` aceita um subconjunto de ``nome,numero,valor,curso,vencimento``.
+    """
+
+    if not ASAAS_KEY:
+        raise HTTPException(500, "ASAAS_KEY não configurada")
+
+    try:
+        return exportar(
+            _iterar_assinantes(), formato, ler_colunas(colunas, COLUNAS), "assinantes", COLUNAS
+        )
+    except requests.RequestException as e:
+        raise HTTPException(502, f"Erro ao obter assinaturas: {e}")
 
 
 @router.post("/")
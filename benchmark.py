@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""Benchmark ponta a ponta com serviços externos simulados.
+
+Sobe servidores locais que imitam a OM, o ASAAS, o gateway de WhatsApp e o
+webhook do Discord (com latência e taxa de erro configuráveis), inicia a API
+apontando ``OM_BASE``, ``ASAAS_BASE_URL``, ``WHATSAPP_URL`` e
+``DISCORD_WEBHOOK``/``DISCORD_WEBHOOK_URL`` para eles e dispara as rotas
+principais com concorrência fixa. O resultado (p50/p95/p99 e requisições por
+segundo de cada cenário) é salvo em JSON para comparação entre commits.
+
+Os arquivos da API (estado, livro de pagamentos, relatórios, certificados) vão
+para um diretório temporário. Com ``--alvo`` nenhum serviço simulado é iniciado.
+
+Uso::
+
+    python benchmark.py --concorrencia 8 --requisicoes 200 --saida bench.json
+    python benchmark.py --cenarios matricular,alunos --latencia-om 0.08
+    python benchmark.py --workers 4 --concorrencia 32
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+DIRETORIO = Path(__file__).resolve().parent
+
+
+# ──────────────────────────────────────────────────────────
+# Servidores simulados
+# ──────────────────────────────────────────────────────────
+class ServicoFalso:
+    """Servidor HTTP local com latência e injeção de erros configuráveis."""
+
+    def __init__(self, nome: str, rotas, latencia: float = 0.0, taxa_erro: float = 0.0):
+        self.nome = nome
+        self.rotas = rotas
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.chamadas = 0
+        self._lock = threading.Lock()
+        servico = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # silencia o log padrão
+                pass
+
+            def _responder(self):
+                tamanho = int(self.headers.get("Content-Length") or 0)
+                corpo = self.rfile.read(tamanho) if tamanho else b""
+                status, dados = servico.atender(self.command, self.path, corpo)
+                saida = b"" if dados is None else json.dumps(dados).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(saida)))
+                self.end_headers()
+                self.wfile.write(saida)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _responder
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.servidor.daemon_threads = True
+        # Conexões encerradas pelo cliente no fim da rodada não são erros
+        self.servidor.handle_error = lambda *args: None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.servidor.server_address[1]}"
+
+    def atender(self, metodo: str, caminho: str, corpo: bytes):
+        with self._lock:
+            self.chamadas += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.taxa_erro and random.random() < self.taxa_erro:
+            return 500, {"status": "false", "info": "erro injetado"}
+        url = urlparse(caminho)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            dados = json.loads(corpo) if corpo.startswith(b"{") else parse_qs(corpo.decode())
+        except ValueError:
+            dados = {}
+        return self.rotas(metodo, url.path.rstrip("/"), query, dados)
+
+    def iniciar(self) -> "ServicoFalso":
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        return self
+
+    def parar(self) -> None:
+        self.servidor.shutdown()
+
+
+def _rotas_om(total_alunos: int):
+    cursos = json.loads((DIRETORIO / "cursos_om.json").read_text(encoding="utf-8"))
+    contador = itertools.count(100000)
+
+    def aluno(i: int) -> dict:
+        return {
+            "id": str(i),
+            "nome": f"ALUNO {i}",
+            "usuario": str(i).zfill(8),
+            "situacao": "ativo",
+            "email": f"aluno{i}@exemplo.com",
+            "cpf": str(i).zfill(11),
+            "telefone": "(61) 99999-0000",
+            "celular": "",
+            "bloqueado": "0",
+        }
+
+    def rotas(metodo, caminho, query, dados):
+        partes = caminho.strip("/").split("/")
+        if partes[:2] == ["unidades", "token"]:
+            return 200, {"status": "true", "data": {"token": "token-benchmark"}}
+        if partes[:3] == ["alunos", "token", "check"]:
+            return 200, {"status": "true"}
+        if partes == ["alunos", "token"]:
+            return 200, {"status": "true", "data": {"token": f"aluno-{next(contador)}"}}
+        if partes[:2] == ["alunos", "total"]:
+            return 200, {"status": "true", "data": {"total": total_alunos}}
+        if partes == ["cursos"]:
+            return 200, cursos
+        if partes == ["alunos"] and metodo == "GET":
+            if "cpf" in query:
+                return 200, {"status": "true", "data": []}
+            page = int(query.get("page", 1))
+            size = int(query.get("size", 1000))
+            inicio = (page - 1) * size
+            fim = min(inicio + size, total_alunos)
+            return 200, {
+                "status": "true",
+                "data": [aluno(i) for i in range(inicio + 1, fim + 1)],
+                "pagina": {"page": page, "size": size, "total": total_alunos},
+            }
+        if partes == ["alunos"] and metodo == "POST":
+            return 200, {"status": "true", "data": {"id": str(next(contador))}}
+        if partes[:2] == ["alunos", "matricula"]:
+            return 200, {"status": "true", "data": {}}
+        if partes[0] == "alunos" and metodo in ("POST", "DELETE"):
+            return 200, {"status": "true"}
+        return 404, {"status": "false", "info": "rota não simulada"}
+
+    return rotas
+
+
+def _rotas_asaas(total_assinantes: int):
+    contador = itertools.count(1)
+
+    def cliente(cid: str) -> dict:
+        n = "".join(ch for ch in cid if ch.isdigit()) or "0"
+        return {
+            "id": cid,
+            "name": f"Cliente {n}",
+            "cpfCnpj": _cpf(int(n)),
+            "mobilePhone": "619" + n[-8:].zfill(8),
+        }
+
+    def pendentes() -> list[dict]:
+        hoje = date.today()
+        return [
+            {
+                "id": f"pay_{i}",
+                "customer": f"cus_{i}",
+                "value": 59.9,
+                "dueDate": (hoje + timedelta(days=(7, 1, 0, 3)[i % 4])).isoformat(),
+                "invoiceUrl": f"https://asaas.local/i/{i}",
+            }
+            for i in range(total_assinantes)
+        ]
+
+    def rotas(metodo, caminho, query, dados):
+        partes = caminho.strip("/").split("/")
+        if partes == ["customers"] and metodo == "POST":
+            return 200, {"id": f"cus_{next(contador)}"}
+        if partes == ["customers"]:
+            return 200, {"data": [cliente("cus_" + query.get("cpfCnpj", "0"))]}
+        if partes[0] == "customers" and len(partes) == 2:
+            return 200, cliente(partes[1])
+        if partes == ["payments"] and metodo == "POST":
+            pid = next(contador)
+            return 200, {"id": f"pay_{pid}", "invoiceUrl": f"https://asaas.local/i/{pid}"}
+        if partes == ["payments"]:
+            lista = pendentes()
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 100))
+            return 200, {
+                "data": lista[offset:offset + limit],
+                "hasMore": offset + limit < len(lista),
+            }
+        if partes[0] == "payments" and len(partes) == 2:
+            return 200, {"id": partes[1], "invoiceUrl": f"https://asaas.local/i/{partes[1]}"}
+        if partes == ["subscriptions"] and metodo == "POST":
+            sid = next(contador)
+            return 200, {"id": f"sub_{sid}", "invoiceUrl": f"https://asaas.local/s/{sid}"}
+        if partes == ["subscriptions"]:
+            return 200, {
+                "data": [
+                    {
+                        "id": f"sub_{i}",
+                        "customer": f"cus_{i}",
+                        "value": 59.9,
+                        "description": "Excel PRO",
+                        "nextDueDate": date.today().isoformat(),
+                    }
+                    for i in range(total_assinantes)
+                ]
+            }
+        if partes[0] == "subscriptions":
+            return 200, {"deleted": True}
+        return 404, {"errors": [{"description": "rota não simulada"}]}
+
+    return rotas
+
+
+def _rotas_whatsapp(metodo, caminho, query, dados):
+    return 200, {"status": "enviado"}
+
+
+def _rotas_discord(metodo, caminho, query, dados):
+    return 204, None
+
+
+# ──────────────────────────────────────────────────────────
+# Cenários
+# ──────────────────────────────────────────────────────────
+def _cpf(i: int) -> str:
+    """Gera um CPF válido (com dígitos verificadores) a partir de ``i``."""
+    base = [int(d) for d in str(100000000 + i % 800000000).zfill(9)]
+    for _ in range(2):
+        soma = sum(d * p for d, p in zip(base, range(len(base) + 1, 1, -1)))
+        base.append((soma * 10 % 11) % 10)
+    return "".join(map(str, base))
+
+
+CENARIOS = {
+    "matricular": lambda i: (
+        "POST",
+        "/matricular/",
+        {"nome": f"Aluno {i}", "whatsapp": "(61) 99999-0000", "cpf": _cpf(i), "cursos_ids": [161]},
+    ),
+    "asaas_webhook": lambda i: (
+        "POST",
+        "/asaas/webhook",
+        {
+            "event": "PAYMENT_RECEIVED",
+            "payment": {
+                "id": f"pay_{i}",
+                "customer": f"cus_{i}",
+                "description": "Excel PRO",
+                "invoiceUrl": f"https://asaas.local/i/{i}",
+            },
+        },
+    ),
+    "kiwify_webhook": lambda i: (
+        "POST",
+        "/kiwify/webhook",
+        {
+            "order": {
+                "webhook_event_type": "order_approved",
+                "Customer": {
+                    "full_name": f"Aluno {i}",
+                    "CPF": _cpf(i),
+                    "email": f"aluno{i}@exemplo.com",
+                    "mobile": "(61) 99999-0000",
+                },
+                "Product": {"product_offer_name": "Excel PRO"},
+                "Commissions": {"product_base_price": 5990},
+                "payment_method": "pix",
+            }
+        },
+    ),
+    "alunos": lambda i: ("GET", "/alunos/", None),
+    "assinantes": lambda i: ("GET", "/assinantes/", None),
+    "mensagem_cobranca": lambda i: ("POST", "/mensagem-cobranca", None),
+}
+
+# Rotas protegidas por lock sem espera: em paralelo, quase tudo seria 409
+CENARIOS_SERIAIS = {"mensagem_cobranca"}
+
+
+def _percentil(ordenados: list[float], p: float) -> float:
+    if not ordenados:
+        return 0.0
+    k = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[k]
+
+
+def executar_cenario(alvo: str, nome: str, requisicoes: int, concorrencia: int) -> dict:
+    """Dispara ``requisicoes`` chamadas do cenário com ``concorrencia`` fixa.
+
+    Respostas ``409`` (execução já em andamento) são contadas em ``conflitos``
+    e ficam fora dos erros e das latências.
+    """
+    gerar = CENARIOS[nome]
+    if nome in CENARIOS_SERIAIS:
+        concorrencia = 1
+    local = threading.local()
+    latencias: list[float] = []
+    erros = conflitos = 0
+    lock = threading.Lock()
+
+    def _uma(i: int) -> None:
+        nonlocal erros, conflitos
+        sessao = getattr(local, "sessao", None)
+        if sessao is None:
+            sessao = local.sessao = requests.Session()
+        metodo, caminho, corpo = gerar(i)
+        inicio = time.perf_counter()
+        status = None
+        try:
+            status = sessao.request(metodo, alvo + caminho, json=corpo, timeout=120).status_code
+        except requests.RequestException:
+            pass
+        dur = (time.perf_counter() - inicio) * 1000
+        with lock:
+            if status == 409:
+                conflitos += 1
+                return
+            latencias.append(dur)
+            if status is None or status >= 400:
+                erros += 1
+
+    base = random.randint(0, 10**7)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        list(pool.map(_uma, range(base, base + requisicoes)))
+    total = time.perf_counter() - inicio
+
+    ordenados = sorted(latencias)
+    return {
+        "requisicoes": requisicoes,
+        "concorrencia": concorrencia,
+        "erros": erros,
+        "conflitos": conflitos,
+        "duracao_s": round(total, 3),
+        "rps": round(requisicoes / total, 2) if total else 0.0,
+        "media_ms": round(sum(ordenados) / len(ordenados), 2) if ordenados else 0.0,
+        "p50_ms": round(_percentil(ordenados, 50), 2),
+        "p95_ms": round(_percentil(ordenados, 95), 2),
+        "p99_ms": round(_percentil(ordenados, 99), 2),
+    }
+
+
+# ──────────────────────────────────────────────────────────
+# Orquestração
+# ──────────────────────────────────────────────────────────
+def _commit_atual() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=DIRETORIO, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def _iniciar_api(porta: int, env_extra: dict, args, diretorio: str) -> subprocess.Popen:
+    try:
+        requests.get(f"http://127.0.0.1:{porta}/", timeout=1)
+        raise RuntimeError(f"Porta {porta} já está em uso; use --porta")
+    except requests.ConnectionError:
+        pass
+    env = {**os.environ, **env_extra}
+    cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(porta), "--log-level", "warning",
+        "--workers", str(args.workers),
+    ]
+    proc = subprocess.Popen(
+        cmd,
+        cwd=diretorio,
+        env={**env, "PYTHONPATH": os.pathsep.join(filter(None, [str(DIRETORIO), env.get("PYTHONPATH")]))},
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    limite = time.time() + 60
+    while time.time() < limite:
+        if proc.poll() is not None:
+            raise RuntimeError("A API encerrou durante a inicialização")
+        try:
+            if requests.get(f"http://127.0.0.1:{porta}/", timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("A API não respondeu a tempo")
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cenarios", default=",".join(CENARIOS))
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--requisicoes", type=int, default=100)
+    parser.add_argument("--alunos", type=int, default=3000, help="tamanho da base simulada na OM")
+    parser.add_argument("--assinantes", type=int, default=40, help="assinaturas simuladas no ASAAS")
+    parser.add_argument("--latencia-om", type=float, default=0.05)
+    parser.add_argument("--latencia-asaas", type=float, default=0.05)
+    parser.add_argument("--latencia-whatsapp", type=float, default=0.1)
+    parser.add_argument("--latencia-discord", type=float, default=0.05)
+    parser.add_argument(
+        "--taxa-whatsapp", type=float, default=50.0, help="WHATSAPP_TAXA da API (0 = sem limite)"
+    )
+    parser.add_argument("--erro-om", type=float, default=0.0)
+    parser.add_argument("--erro-asaas", type=float, default=0.0)
+    parser.add_argument("--erro-whatsapp", type=float, default=0.0)
+    parser.add_argument("--erro-discord", type=float, default=0.0)
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="workers do uvicorn da API")
+    parser.add_argument("--alvo", help="URL de uma instância já em execução (não sobe a API)")
+    parser.add_argument("--saida", default="benchmark.json")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Com --alvo, a instância medida já tem seus próprios serviços
+    servicos = {} if args.alvo else {
+        "om": ServicoFalso("om", _rotas_om(args.alunos), args.latencia_om, args.erro_om),
+        "asaas": ServicoFalso("asaas", _rotas_asaas(args.assinantes), args.latencia_asaas, args.erro_asaas),
+        "whatsapp": ServicoFalso("whatsapp", _rotas_whatsapp, args.latencia_whatsapp, args.erro_whatsapp),
+        "discord": ServicoFalso("discord", _rotas_discord, args.latencia_discord, args.erro_discord),
+    }
+    for s in servicos.values():
+        s.iniciar()
+
+    temporario = tempfile.TemporaryDirectory(prefix="benchmark-")
+    dados = temporario.name
+    env = {} if args.alvo else {
+        "OM_BASE": servicos["om"].url,
+        "BASIC_B64": "YmVuY2g6YmVuY2g=",
+        "UNIDADE_ID": "1",
+        "ASAAS_KEY": "benchmark",
+        "ASAAS_BASE_URL": servicos["asaas"].url,
+        "WHATSAPP_URL": servicos["whatsapp"].url + "/send",
+        "DISCORD_WEBHOOK": servicos["discord"].url + "/webhook",
+        "DISCORD_WEBHOOK_URL": servicos["discord"].url + "/webhook",
+        "WHATSAPP_TAXA": str(args.taxa_whatsapp),
+        "GOOGLE_SHEET_NAME": "",
+        "RASTREIO_LOG_LENTO": "",
+        "ESTADO_SQLITE_PATH": os.path.join(dados, "estado.db"),
+        "PAGAMENTOS_DB": os.path.join(dados, "pagamentos.db"),
+        "RELATORIOS_DIR": os.path.join(dados, "relatorios_dados"),
+        "CERTIFICADOS_DIR": os.path.join(dados, "certificados_cache"),
+        "CAPTURA_WEBHOOKS": "",
+    }
+
+    proc = None
+    alvo = args.alvo
+    try:
+        if not alvo:
+            proc = _iniciar_api(args.porta, env, args, dados)
+            alvo = f"http://127.0.0.1:{args.porta}"
+
+        resultados = {}
+        for nome in [c.strip() for c in args.cenarios.split(",") if c.strip()]:
+            if nome not in CENARIOS:
+                raise SystemExit(f"Cenário desconhecido: {nome}")
+            resultados[nome] = executar_cenario(alvo, nome, args.requisicoes, args.concorrencia)
+            r = resultados[nome]
+            print(
+                f"{nome:<18} {r['rps']:>8.1f} req/s  p50 {r['p50_ms']:>8.1f} ms  "
+                f"p95 {r['p95_ms']:>8.1f} ms  p99 {r['p99_ms']:>8.1f} ms  erros {r['erros']}"
+                + (f"  409 {r['conflitos']}" if r["conflitos"] else "")
+            )
+    finally:
+        if proc:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for s in servicos.values():
+            s.parar()
+        temporario.cleanup()
+
+    relatorio = {
+        "commit": _commit_atual(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida", "verbose")},
+        "chamadas_externas": {nome: s.chamadas for nome, s in servicos.items()},
+        "cenarios": resultados,
+    }
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"Resultado salvo em {args.saida}")
+    return relatorio
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Compara a serialização padrão do FastAPI com a de ``serializacao.py``.
+
+Para cada carga (lista de alunos, catálogo de cursos e assinantes) mede o
+tempo de ``jsonable_encoder`` + ``json.dumps`` (o que o ``JSONResponse``
+padrão faz) contra ``orjson`` e o tamanho do corpo cru, com gzip e com brotli
+(quando o pacote ``brotli`` estiver instalado).
+
+Uso::
+
+    python benchmark_serializacao.py --alunos 5000 --repeticoes 50
+"""
+
+import argparse
+import gzip
+import json
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+
+import serializacao
+
+DIRETORIO = Path(__file__).resolve().parent
+
+
+def _alunos(total: int) -> dict:
+    return {
+        "alunos": [
+            {
+                "id": str(i),
+                "nome": f"ALUNO {i}",
+                "usuario": str(i).zfill(8),
+                "situacao": "ativo",
+                "email": f"aluno{i}@exemplo.com",
+                "cpf": str(i).zfill(11),
+                "telefone": "(61) 99999-0000",
+                "celular": "",
+                "bloqueado": "0",
+            }
+            for i in range(total)
+        ]
+    }
+
+
+def _assinantes(total: int) -> dict:
+    hoje = date.today()
+    return {
+        "assinantes": [
+            {
+                "nome": f"Cliente {i}",
+                "numero": f"5561999{i:06d}",
+                "valor": 59.9,
+                "curso": "Informática Básica",
+                "vencimento": (hoje + timedelta(days=i % 30)).strftime("%d/%m/%Y"),
+            }
+            for i in range(total)
+        ]
+    }
+
+
+def _medir(funcao, repeticoes: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return (time.perf_counter() - inicio) / repeticoes * 1000
+
+
+def _padrao(dados) -> bytes:
+    # Mesmo caminho do JSONResponse padrão do FastAPI/Starlette
+    return json.dumps(
+        jsonable_encoder(dados), ensure_ascii=False, allow_nan=False, indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--alunos", type=int, default=5000)
+    parser.add_argument("--assinantes", type=int, default=2000)
+    parser.add_argument("--repeticoes", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    cargas = {
+        "alunos": _alunos(args.alunos),
+        "cursos_om": json.loads((DIRETORIO / "cursos_om.json").read_text(encoding="utf-8")),
+        "assinantes": _assinantes(args.assinantes),
+    }
+    resultado = {}
+    for nome, dados in cargas.items():
+        corpo = serializacao.dumps(dados)
+        linha = {
+            "padrao_ms": round(_medir(lambda: _padrao(dados), args.repeticoes), 2),
+            "orjson_ms": round(_medir(lambda: serializacao.dumps(dados), args.repeticoes), 2),
+            "bytes": len(corpo),
+            "gzip_bytes": len(gzip.compress(corpo, serializacao.COMPRESSAO_NIVEL_GZIP)),
+            "gzip_ms": round(_medir(lambda: serializacao.comprimir(corpo, "gzip"), args.repeticoes), 2),
+        }
+        if serializacao.brotli is not None:
+            linha["br_bytes"] = len(serializacao.comprimir(corpo, "br"))
+            linha["br_ms"] = round(_medir(lambda: serializacao.comprimir(corpo, "br"), args.repeticoes), 2)
+        resultado[nome] = linha
+        print(nome, json.dumps(linha, ensure_ascii=False))
+    return resultado
+
+
+if __name__ == "__main__":
+    main()
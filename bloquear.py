@@ -2,27 +2,26 @@ import os
 import requests
 from fastapi import APIRouter, HTTPException
 
-router = APIRouter()
+import alunos
+import unidades
+from secure import obter_token_unidade
+from serializacao import RotaJSON
+
+router = APIRouter(route_class=RotaJSON)
 
 OM_BASE = os.getenv("OM_BASE")
 BASIC_B64 = os.getenv("BASIC_B64")
-UNIDADE_ID = os.getenv("UNIDADE_ID")
 
 
-def _obter_token_unidade() -> str:
-    if not all([OM_BASE, BASIC_B64, UNIDADE_ID]):
-        raise RuntimeError("Variáveis de ambiente OM não configuradas.")
-    url = f"{OM_BASE}/unidades/token/{UNIDADE_ID}"
-    r = requests.get(url, headers={"Authorization": f"Basic {BASIC_B64}"}, timeout=8)
-    if r.ok and r.json().get("status") == "true":
-        return r.json()["data"]["token"]
-    raise RuntimeError(f"Falha ao obter token da unidade: HTTP {r.status_code}")
+def _obter_token_unidade(unidade: str | None = None) -> str:
+    return obter_token_unidade(unidade=unidade)
 
 
-def _alterar_bloqueio(id_aluno: str, bloqueado: int) -> None:
+def _alterar_bloqueio(id_aluno: str, bloqueado: int, unidade: str | None = None) -> None:
     if bloqueado not in (0, 1):
         raise ValueError("bloqueado deve ser 0 ou 1")
-    token = _obter_token_unidade()
+    unidade = unidades.resolver(unidade)
+    token = _obter_token_unidade(unidade)
     url = f"{OM_BASE}/alunos/{id_aluno}"
     payload = {"token": token, "bloqueado": str(bloqueado)}
     r = requests.post(
@@ -38,14 +37,17 @@ def _alterar_bloqueio(id_aluno: str, bloqueado: int) -> None:
         except Exception:
             pass
         if not dados or dados.get("status") == "true":
+            alunos.invalidar(unidade)
             return
     raise RuntimeError(f"Falha ao definir bloqueio: HTTP {r.status_code} | {r.text}")
 
 
 @router.post("/bloquear/{id_aluno}", summary="Define o status de bloqueio do aluno")
-def bloquear(id_aluno: str, status: int):
+def bloquear(id_aluno: str, status: int, unidade: str | None = None):
+    if unidade:
+        unidade = unidades.resolver(unidade)
     try:
-        _alterar_bloqueio(id_aluno, status)
+        _alterar_bloqueio(id_aluno, status, unidade)
         return {"message": "Status atualizado"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -54,8 +56,8 @@ def bloquear(id_aluno: str, status: int):
 if __name__ == "__main__":  # pragma: no cover - utilitário de linha de comando
     import sys
 
-    if len(sys.argv) != 3:
-        print("Uso: python bloquear.py <id_aluno> <status (0|1)>")
+    if len(sys.argv) not in (3, 4):
+        print("Uso: python bloquear.py <id_aluno> <status (0|1)> [unidade]")
         sys.exit(1)
 
     aluno_id = sys.argv[1]
@@ -66,7 +68,7 @@ if __name__ == "__main__":  # pragma: no cover - utilitário de linha de comando
         sys.exit(1)
 
     try:
-        _alterar_bloqueio(aluno_id, status_int)
+        _alterar_bloqueio(aluno_id, status_int, sys.argv[3] if len(sys.argv) == 4 else None)
         print("Status atualizado")
     except Exception as exc:  # pragma: no cover - saída simples
         print(f"Erro ao definir bloqueio: {exc}")
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Caches em memória com expiração (TTL) compartilhados pelos módulos."""
+
+import contextvars
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+
+_AUSENTE = object()
+
+
+class TTLCache:
+    """Dicionário com expiração por item e limite de tamanho (LRU).
+
+    Seguro para uso concorrente entre as threads do servidor.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._dados: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave, default=None):
+        with self._lock:
+            item = self._dados.get(chave, _AUSENTE)
+            if item is _AUSENTE:
+                return default
+            expira, _, valor = item
+            if expira < time.monotonic():
+                del self._dados[chave]
+                return default
+            self._dados.move_to_end(chave)
+            return valor
+
+    def idade(self, chave) -> float | None:
+        """Segundos desde que ``chave`` foi gravada (``None`` se ausente)."""
+        with self._lock:
+            item = self._dados.get(chave)
+            agora = time.monotonic()
+            if not item or item[0] < agora:
+                return None
+            return agora - item[1]
+
+    def set(self, chave, valor, ttl: float | None = None) -> None:
+        with self._lock:
+            agora = time.monotonic()
+            self._dados[chave] = (agora + (self.ttl if ttl is None else ttl), agora, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def pop(self, chave, default=None):
+        with self._lock:
+            item = self._dados.pop(chave, None)
+        return default if item is None else item[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dados.clear()
+
+    def __contains__(self, chave) -> bool:
+        return self.get(chave, _AUSENTE) is not _AUSENTE
+
+    def __len__(self) -> int:
+        return len(self._dados)
+
+
+class Singleflight:
+    """Chamadas idênticas simultâneas compartilham uma única execução.
+
+    A primeira thread a pedir uma chave executa a função; as demais que pedirem
+    a mesma chave enquanto ela está em andamento aguardam e recebem o mesmo
+    resultado (ou a mesma exceção).
+    """
+
+    class _Chamada:
+        __slots__ = ("evento", "resultado", "erro")
+
+        def __init__(self):
+            self.evento = threading.Event()
+            self.resultado = None
+            self.erro: BaseException | None = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chamadas: dict = {}
+
+    def executar(self, chave, funcao, *args, **kwargs):
+        with self._lock:
+            chamada = self._chamadas.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = self._chamadas[chave] = self._Chamada()
+
+        if not lider:
+            chamada.evento.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+
+        try:
+            chamada.resultado = funcao(*args, **kwargs)
+            return chamada.resultado
+        except BaseException as e:
+            chamada.erro = e
+            raise
+        finally:
+            with self._lock:
+                self._chamadas.pop(chave, None)
+            chamada.evento.set()
+
+
+# Memo por requisição: consultas repetidas dentro de um mesmo fluxo são gratuitas
+_memo: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "memo_requisicao", default=None
+)
+
+
+def chamada_unica(nome: str):
+    """Decorador para consultas de leitura (GET) a serviços externos.
+
+    - dentro de uma requisição, a mesma chamada com os mesmos argumentos é
+      executada uma única vez (memo por requisição);
+    - entre requisições concorrentes, chamadas idênticas em andamento são
+      compartilhadas (``Singleflight``).
+    """
+    voo = Singleflight()
+
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def wrapper(*args, **kwargs):
+            chave = (nome, args, tuple(sorted(kwargs.items())))
+            memo = _memo.get()
+            if memo is not None and chave in memo:
+                return memo[chave]
+            valor = voo.executar(chave, funcao, *args, **kwargs)
+            if memo is not None:
+                memo[chave] = valor
+            return valor
+
+        wrapper.sem_cache = funcao
+        return wrapper
+
+    return decorador
+
+
+def limpar_memo(nome: str | None = None) -> None:
+    """Descarta o memo da requisição corrente (todo ou apenas de ``nome``)."""
+    memo = _memo.get()
+    if memo is None:
+        return
+    for chave in [c for c in memo if nome is None or c[0] == nome]:
+        del memo[chave]
+
+
+class MemoRequisicaoMiddleware:
+    """Middleware ASGI que abre um memo vazio para cada requisição HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _memo.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _memo.reset(token)
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""Captura anonimizada e reprodução de webhooks (Kiwify e ASAAS).
+
+Quando ``CAPTURA_WEBHOOKS`` aponta para um diretório, cada payload recebido em
+``/kiwify/webhook``, ``/kiwify/`` e ``/asaas/webhook`` é anonimizado e gravado
+em ``webhooks-AAAA-MM-DD.jsonl.gz`` (uma linha JSON compacta por evento). A
+estrutura original é preservada (``order``, centavos em ``Commissions``,
+``externalReference``...), apenas nomes, documentos, contatos e endereços são
+trocados por pseudônimos estáveis. A gravação é feita por uma thread própria,
+fora do laço de eventos; ``aguardar`` espera as linhas pendentes (drenagem).
+
+O mesmo módulo reproduz um dia capturado contra uma instância em execução::
+
+    python captura.py capturas/webhooks-2025-07-01.jsonl.gz --alvo http://localhost:8000 --velocidade 10
+    python captura.py capturas/webhooks-2025-07-01.jsonl.gz --velocidade max --concorrencia 32
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CAPTURA_DIR = os.getenv("CAPTURA_WEBHOOKS")
+# Sal para os pseudônimos; mantenha fixo para que a mesma pessoa gere sempre o
+# mesmo valor anonimizado entre capturas.
+CAPTURA_SAL = os.getenv("CAPTURA_SAL", "ced-captura")
+
+_lock = threading.Lock()
+_fila: queue.Queue = queue.Queue()
+_gravador: threading.Thread | None = None
+
+_CAMPOS_CPF = {"cpf", "cpfcnpj", "doc_cpf", "cnpj"}
+_CAMPOS_NOME = {"full_name", "first_name", "name", "nome"}
+_CAMPOS_EMAIL = {"email"}
+_CAMPOS_TELEFONE = {"mobile", "mobilephone", "phone", "celular", "whatsapp", "fone", "telefone"}
+_CAMPOS_ENDERECO = {
+    "street", "number", "complement", "neighborhood", "zipcode", "address",
+    "addressnumber", "province", "postalcode", "instagram", "ip",
+}
+
+
+def _hash(valor: str) -> str:
+    return hashlib.sha256(f"{CAPTURA_SAL}:{valor}".encode()).hexdigest()
+
+
+def _digitos_hash(valor: str, n: int) -> str:
+    return str(int(_hash(valor), 16))[-n:].zfill(n)
+
+
+def _cpf_pseudonimo(valor: str) -> str:
+    """Gera um CPF válido e estável a partir do original."""
+    base = [int(d) for d in _digitos_hash(valor, 9)]
+    for _ in range(2):
+        soma = sum(d * p for d, p in zip(base, range(len(base) + 1, 1, -1)))
+        base.append((soma * 10 % 11) % 10)
+    return "".join(map(str, base))
+
+
+def _telefone_pseudonimo(valor: str) -> str:
+    """Mantém o formato e o DDD, trocando o restante dos dígitos."""
+    digitos = [c for c in valor if c.isdigit()]
+    if len(digitos) < 4:
+        return valor
+    substitutos = iter(_digitos_hash(valor, len(digitos)))
+    preservar = 4 if "".join(digitos).startswith("55") and len(digitos) > 11 else 2
+    saida, vistos = [], 0
+    for c in valor:
+        if c.isdigit():
+            saida.append(c if vistos < preservar else next(substitutos))
+            vistos += 1
+        else:
+            saida.append(c)
+    return "".join(saida)
+
+
+def _pseudonimo(k: str, valor):
+    """Pseudônimo de um valor escalar do campo ``k`` (já em minúsculas).
+
+    Números (CPF ou telefone enviados como inteiros) são tratados pelo texto e
+    voltam a ser números quando o pseudônimo só tem dígitos.
+    """
+    if isinstance(valor, bool) or not isinstance(valor, (str, int, float)) or valor == "":
+        return valor
+    texto = str(valor)
+    if k in _CAMPOS_CPF:
+        novo = _cpf_pseudonimo(texto)
+    elif k in _CAMPOS_NOME:
+        novo = f"Pessoa {_hash(texto)[:8]}"
+    elif k in _CAMPOS_EMAIL:
+        novo = f"{_hash(texto)[:12]}@exemplo.com"
+    elif k in _CAMPOS_TELEFONE:
+        novo = _telefone_pseudonimo(texto)
+    elif k in _CAMPOS_ENDERECO:
+        novo = _hash(texto)[: max(1, min(len(texto), 12))]
+    else:
+        return valor
+    if not isinstance(valor, str) and novo.isdigit():
+        return int(novo)
+    return novo
+
+
+def _anonimizar_campo(k: str, valor):
+    if isinstance(valor, dict):
+        return anonimizar(valor)
+    if isinstance(valor, list):
+        # Listas de escalares (vários telefones, e-mails...) herdam o campo
+        return [_anonimizar_campo(k, v) for v in valor]
+    return _pseudonimo(k, valor)
+
+
+def anonimizar(dados):
+    """Retorna uma cópia de ``dados`` com campos pessoais pseudonimizados."""
+    if isinstance(dados, list):
+        return [anonimizar(v) for v in dados]
+    if not isinstance(dados, dict):
+        return dados
+    return {chave: _anonimizar_campo(str(chave).lower(), valor) for chave, valor in dados.items()}
+
+
+def _gravar() -> None:
+    while True:
+        # Junta o que mais estiver na fila para escrever cada arquivo de uma vez
+        lote = [_fila.get()]
+        while True:
+            try:
+                lote.append(_fila.get_nowait())
+            except queue.Empty:
+                break
+        por_destino: dict[Path, list[str]] = {}
+        for destino, linha in lote:
+            por_destino.setdefault(destino, []).append(linha)
+        for destino, linhas in por_destino.items():
+            try:
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                with gzip.open(destino, "at", encoding="utf-8") as f:
+                    f.writelines(linha + "\n" for linha in linhas)
+            except Exception:
+                logger.exception("Erro ao gravar captura em %s", destino)
+        for _ in lote:
+            _fila.task_done()
+
+
+def registrar(rota: str, payload) -> None:
+    """Enfileira o payload anonimizado se a captura estiver habilitada.
+
+    A cópia anonimizada é feita aqui, antes de o handler seguir com o payload;
+    a compressão e a escrita no disco ficam com a thread gravadora.
+    """
+    global _gravador
+    if not CAPTURA_DIR:
+        return
+    try:
+        linha = json.dumps(
+            {"t": round(time.time(), 3), "rota": rota, "payload": anonimizar(payload)},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        destino = Path(CAPTURA_DIR) / f"webhooks-{date.today().isoformat()}.jsonl.gz"
+        with _lock:
+            if _gravador is None:
+                _gravador = threading.Thread(target=_gravar, name="captura", daemon=True)
+                _gravador.start()
+        _fila.put((destino, linha))
+    except Exception:
+        logger.exception("Erro ao capturar webhook de %s", rota)
+
+
+def aguardar(timeout: float | None = None) -> bool:
+    """Espera a gravação das capturas enfileiradas; ``False`` se o prazo acabar."""
+    fim = None if timeout is None else time.monotonic() + timeout
+    while _fila.unfinished_tasks:
+        if fim is not None and time.monotonic() >= fim:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def ler_captura(caminho: str) -> list[dict]:
+    """Lê um arquivo de captura (``.jsonl`` ou ``.jsonl.gz``) em ordem temporal."""
+    abrir = gzip.open if caminho.endswith(".gz") else open
+    with abrir(caminho, "rt", encoding="utf-8") as f:
+        eventos = [json.loads(linha) for linha in f if linha.strip()]
+    eventos.sort(key=lambda e: e["t"])
+    return eventos
+
+
+def reproduzir(
+    eventos: list[dict],
+    alvo: str,
+    velocidade: float | None = 1.0,
+    concorrencia: int = 16,
+) -> dict:
+    """Reenvia os eventos respeitando os intervalos originais.
+
+    ``velocidade`` multiplica o ritmo original (1×, 10×...). ``None`` dispara
+    tudo o mais rápido possível, limitado apenas por ``concorrencia``.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    local = threading.local()
+    lock = threading.Lock()
+    por_rota: dict[str, dict] = {}
+    latencias: list[float] = []
+
+    def _enviar(evento: dict) -> None:
+        sessao = getattr(local, "sessao", None)
+        if sessao is None:
+            sessao = local.sessao = requests.Session()
+        inicio = time.perf_counter()
+        try:
+            r = sessao.post(alvo.rstrip("/") + evento["rota"], json=evento["payload"], timeout=120)
+            status = str(r.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        dur = (time.perf_counter() - inicio) * 1000
+        with lock:
+            latencias.append(dur)
+            stats = por_rota.setdefault(evento["rota"], {"total": 0, "erros": 0, "status": {}})
+            stats["total"] += 1
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            if not status.isdigit() or int(status) >= 500:
+                stats["erros"] += 1
+
+    if not eventos:
+        return {"eventos": 0}
+
+    t0 = eventos[0]["t"]
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        for evento in eventos:
+            if velocidade:
+                atraso = (evento["t"] - t0) / velocidade - (time.perf_counter() - inicio)
+                if atraso > 0:
+                    time.sleep(atraso)
+            pool.submit(_enviar, evento)
+    duracao = time.perf_counter() - inicio
+
+    ordenados = sorted(latencias)
+
+    def _p(pct: float) -> float:
+        return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * pct / 100))], 2)
+
+    erros = sum(s["erros"] for s in por_rota.values())
+    return {
+        "eventos": len(eventos),
+        "duracao_s": round(duracao, 3),
+        "eventos_por_s": round(len(eventos) / duracao, 2) if duracao else 0.0,
+        "taxa_erro": round(erros / len(eventos), 4),
+        "p50_ms": _p(50),
+        "p95_ms": _p(95),
+        "p99_ms": _p(99),
+        "rotas": por_rota,
+    }
+
+
+if __name__ == "__main__":  # pragma: no cover - utilitário de linha de comando
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reproduz webhooks capturados.")
+    parser.add_argument("arquivo", help="arquivo webhooks-AAAA-MM-DD.jsonl.gz")
+    parser.add_argument("--alvo", default="http://localhost:8000")
+    parser.add_argument(
+        "--velocidade", default="1", help="multiplicador do ritmo original (1, 10...) ou 'max'"
+    )
+    parser.add_argument("--concorrencia", type=int, default=16)
+    parser.add_argument("--saida", help="grava o relatório em JSON")
+    args = parser.parse_args()
+
+    vel = None if args.velocidade.lower() == "max" else float(args.velocidade.rstrip("xX×"))
+    relatorio = reproduzir(ler_captura(args.arquivo), args.alvo, vel, args.concorrencia)
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    print(texto)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
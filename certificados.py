@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Download de certificados pelo domínio da API.
+
+``GET /alunos/{id}/certificado/{contrato}/{curso}`` repassa o certificado da OM
+(``/certificado/aluno/{id}/contrato/{c}/curso/{cid}``) em streaming, gravando
+uma cópia em ``CERTIFICADOS_DIR`` enquanto envia. Os downloads seguintes saem
+do disco com ``FileResponse``, sem chamar a OM.
+
+O diretório é um cache LRU limitado a ``CERTIFICADOS_MAX_BYTES``: cada acesso
+atualiza a data de modificação do arquivo e, ao gravar um novo certificado, os
+menos usados recentemente são removidos até caber no limite.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import requests
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+
+import estado
+
+router = APIRouter(prefix="/alunos", tags=["Alunos"])
+
+OM_BASE = os.getenv("OM_BASE")
+BASIC_B64 = os.getenv("BASIC_B64")
+
+CERTIFICADOS_DIR = Path(os.getenv("CERTIFICADOS_DIR", "certificados_cache"))
+CERTIFICADOS_MAX_BYTES = int(os.getenv("CERTIFICADOS_MAX_BYTES", str(500 * 1024 * 1024)))
+CERTIFICADOS_PEDACO = 64 * 1024
+
+_ID_VALIDO = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+
+logger = logging.getLogger(__name__)
+
+
+def _chave(id_aluno: str, contrato: str, curso: str) -> str:
+    for valor in (id_aluno, contrato, curso):
+        if not _ID_VALIDO.match(valor):
+            raise HTTPException(400, "Identificador inválido")
+    return f"{id_aluno}_{contrato}_{curso}"
+
+
+def _caminhos(chave: str) -> tuple[Path, Path]:
+    return CERTIFICADOS_DIR / f"{chave}.bin", CERTIFICADOS_DIR / f"{chave}.json"
+
+
+def _do_cache(chave: str) -> FileResponse | None:
+    arquivo, meta = _caminhos(chave)
+    try:
+        info = json.loads(meta.read_text(encoding="utf-8"))
+        # Marca o uso para o LRU
+        os.utime(arquivo)
+    except (FileNotFoundError, ValueError):
+        return None
+    return FileResponse(
+        arquivo,
+        media_type=info.get("tipo"),
+        filename=info.get("nome"),
+        headers={"Cache-Control": "private, max-age=86400"},
+    )
+
+
+def _limitar_cache(preservar: Path) -> None:
+    """Remove os certificados menos usados até caber em ``CERTIFICADOS_MAX_BYTES``."""
+    try:
+        with estado.lock("certificados:limpeza", ttl=60, espera=0):
+            arquivos = []
+            for entrada in os.scandir(CERTIFICADOS_DIR):
+                if entrada.name.endswith(".bin"):
+                    st = entrada.stat()
+                    arquivos.append((st.st_mtime, st.st_size, Path(entrada.path)))
+            total = sum(tamanho for _, tamanho, _ in arquivos)
+            for _, tamanho, arquivo in sorted(arquivos):
+                if total <= CERTIFICADOS_MAX_BYTES:
+                    break
+                if arquivo == preservar:
+                    continue
+                arquivo.with_suffix(".json").unlink(missing_ok=True)
+                arquivo.unlink(missing_ok=True)
+                total -= tamanho
+    except TimeoutError:
+        # Outro worker já está limpando
+        pass
+
+
+def _nome_arquivo(resp: requests.Response, chave: str) -> str:
+    disposicao = resp.headers.get("Content-Disposition", "")
+    encontrado = re.search(r'filename="?([^";]+)"?', disposicao)
+    if encontrado and encontrado.group(1).isascii():
+        return encontrado.group(1)
+    extensao = ".pdf" if "pdf" in resp.headers.get("Content-Type", "") else ""
+    return f"certificado_{chave}{extensao}"
+
+
+def _repassar(resp: requests.Response, chave: str, nome: str, tipo: str):
+    """Envia os pedaços da OM e grava a cópia; só publica o arquivo completo."""
+    CERTIFICADOS_DIR.mkdir(parents=True, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(dir=CERTIFICADOS_DIR, suffix=".tmp")
+    completo = False
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for pedaco in resp.iter_content(CERTIFICADOS_PEDACO):
+                f.write(pedaco)
+                yield pedaco
+        completo = True
+    finally:
+        resp.close()
+        if completo:
+            arquivo, meta = _caminhos(chave)
+            meta.write_text(json.dumps({"tipo": tipo, "nome": nome}), encoding="utf-8")
+            os.replace(temporario, arquivo)
+            _limitar_cache(arquivo)
+        else:
+            # Cliente desconectou ou a OM falhou no meio: descarta a cópia
+            logger.warning("Download do certificado %s interrompido", chave)
+            Path(temporario).unlink(missing_ok=True)
+
+
+@router.get(
+    "/{id_aluno}/certificado/{contrato}/{curso}",
+    summary="Certificado do aluno em um curso",
+)
+def baixar_certificado(id_aluno: str, contrato: str, curso: str):
+    chave = _chave(id_aluno, contrato, curso)
+    em_cache = _do_cache(chave)
+    if em_cache is not None:
+        return em_cache
+
+    if not OM_BASE or not BASIC_B64:
+        raise HTTPException(500, "Variáveis de ambiente OM não configuradas.")
+    try:
+        resp = requests.get(
+            f"{OM_BASE}/certificado/aluno/{id_aluno}/contrato/{contrato}/curso/{curso}",
+            headers={"Authorization": f"Basic {BASIC_B64}"},
+            stream=True,
+            timeout=30,
+        )
+    except requests.RequestException as e:
+        raise HTTPException(502, f"Erro ao obter certificado na OM: {e}")
+
+    tipo = resp.headers.get("Content-Type", "application/octet-stream")
+    if not resp.ok or tipo.startswith("application/json"):
+        # A OM responde JSON quando o certificado não está disponível
+        corpo = resp.text[:500]
+        resp.close()
+        status = 404 if resp.status_code in (200, 404) else 502
+        raise HTTPException(status, f"Certificado indisponível: {corpo}")
+
+    nome = _nome_arquivo(resp, chave)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{nome}"',
+        "Cache-Control": "private, max-age=86400",
+    }
+    # Com Content-Encoding o corpo repassado (já decodificado) tem outro tamanho
+    if resp.headers.get("Content-Length") and not resp.headers.get("Content-Encoding"):
+        headers["Content-Length"] = resp.headers["Content-Length"]
+    return StreamingResponse(_repassar(resp, chave, nome, tipo), media_type=tipo, headers=headers)
@@ -3,7 +3,9 @@ import requests
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
-router = APIRouter(prefix="/cobrar", tags=["Cobrança"])
+from serializacao import RotaJSON
+
+router = APIRouter(prefix="/cobrar", tags=["Cobrança"], route_class=RotaJSON)
 
 ASAAS_KEY = os.getenv("ASAAS_KEY")
 ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://api.asaas.com/v3")
@@ -1,7 +1,10 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 import json
 from pathlib import Path
 
+import unidades
+from serializacao import dumps
+
 router = APIRouter()
 
 # Caminho para o arquivo JSON com todos os cursos da Ouro Moderno
@@ -9,6 +12,8 @@ _JSON_PATH = Path(__file__).with_name("cursos_om.json")
 
 # Cache interno para evitar releitura do arquivo a cada requisição
 _cached_data = None
+# Resposta já serializada: o arquivo não muda enquanto o processo roda
+_cached_bytes: bytes | None = None
 
 def _load_cursos() -> dict:
     global _cached_data
@@ -18,7 +23,27 @@ def _load_cursos() -> dict:
     return _cached_data
 
 
+def nomes_por_id() -> dict[str, str]:
+    """``{id da disciplina: nome}`` pelo catálogo da OM.
+
+    Usa o arquivo ``cursos_om.json`` e completa com os catálogos das unidades e
+    os cursos carregados da API pela integração da Kiwify, se já estiverem em cache.
+    """
+    nomes = {str(c["id"]): c["nome"] for c in _load_cursos().get("data", [])}
+    for cid, nome in unidades.nomes_cursos().items():
+        nomes.setdefault(cid, nome)
+    from kiwify import cursos_om_cache  # import tardio: kiwify é pesado
+
+    for nome, ids in cursos_om_cache().items():
+        for cid in ids:
+            nomes.setdefault(str(cid), nome)
+    return nomes
+
+
 @router.get("/", summary="Lista de todos os cursos da Ouro Moderno")
 async def listar_cursos_om():
     """Retorna o conteúdo do arquivo de cursos da Ouro Moderno."""
-    return _load_cursos()
+    global _cached_bytes
+    if _cached_bytes is None:
+        _cached_bytes = dumps(_load_cursos())
+    return Response(content=_cached_bytes, media_type="application/json")
@@ -2,7 +2,10 @@ import os
 import requests
 from fastapi import APIRouter, HTTPException
 
-router = APIRouter()
+import alunos
+from serializacao import RotaJSON
+
+router = APIRouter(route_class=RotaJSON)
 
 OM_BASE = os.getenv("OM_BASE")
 BASIC_B64 = os.getenv("BASIC_B64")
@@ -20,6 +23,7 @@ def _excluir_aluno(id_aluno: str) -> None:
         except Exception:
             pass
         if not dados or dados.get("status") == "true":
+            alunos.invalidar()
             return
     raise RuntimeError(f"Falha ao excluir aluno: HTTP {r.status_code} | {r.text}")
 
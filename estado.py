@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""Estado compartilhado entre os workers do servidor.
+
+Caches, locks e contadores que precisam valer para todos os processos
+(``uvicorn --workers N``) ficam aqui em vez de variáveis globais de módulo.
+
+Backends (``ESTADO_BACKEND``):
+
+- ``sqlite`` (padrão): arquivo ``ESTADO_SQLITE_PATH`` em modo WAL, sem
+  dependências externas; serve para vários workers na mesma máquina;
+- ``redis``: ``ESTADO_REDIS_URL``; requer o pacote opcional ``redis``;
+- ``memoria``: apenas para um único processo (testes e execução local).
+
+Os valores são serializados em JSON. Chaves com ``ttl`` expiradas são apagadas
+ao serem lidas e, nos backends ``sqlite`` e ``memoria``, também por uma
+varredura feita em ``set`` a cada ``ESTADO_LIMPEZA_S`` segundos (chaves que
+nunca mais são lidas, como as de memo e de situação de mensagens).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import redis
+except Exception:  # pragma: no cover - lib opcional
+    redis = None
+
+ESTADO_BACKEND = os.getenv("ESTADO_BACKEND", "sqlite").lower()
+ESTADO_SQLITE_PATH = os.getenv("ESTADO_SQLITE_PATH", "estado.db")
+ESTADO_REDIS_URL = os.getenv("ESTADO_REDIS_URL", "redis://localhost:6379/0")
+ESTADO_PREFIXO = os.getenv("ESTADO_PREFIXO", "ced:")
+# Intervalo mínimo entre varreduras das chaves expiradas (sqlite e memoria)
+ESTADO_LIMPEZA_S = float(os.getenv("ESTADO_LIMPEZA_S", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+class EstadoMemoria:
+    """Backend em memória, restrito ao processo atual."""
+
+    def __init__(self):
+        self._kv: dict[str, tuple[str, float | None]] = {}
+        self._contadores: dict[str, int] = {}
+        self._locks: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._limpeza = time.monotonic()
+
+    def get(self, chave: str):
+        with self._lock:
+            item = self._kv.get(chave)
+            if item is None:
+                return None
+            valor, expira = item
+            if expira is not None and expira < time.time():
+                del self._kv[chave]
+                return None
+            return json.loads(valor)
+
+    def set(self, chave: str, valor, ttl: float | None = None) -> None:
+        expira = time.time() + ttl if ttl else None
+        with self._lock:
+            self._kv[chave] = (json.dumps(valor), expira)
+            if time.monotonic() - self._limpeza >= ESTADO_LIMPEZA_S:
+                self._limpeza = time.monotonic()
+                agora = time.time()
+                for k in [k for k, (_, e) in self._kv.items() if e is not None and e < agora]:
+                    del self._kv[k]
+
+    def delete(self, chave: str) -> None:
+        with self._lock:
+            self._kv.pop(chave, None)
+
+    def incr(self, chave: str, n: int = 1) -> int:
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + n
+            return self._contadores[chave]
+
+    def contador(self, chave: str) -> int:
+        with self._lock:
+            return self._contadores.get(chave, 0)
+
+    def tentar_lock(self, nome: str, dono: str, ttl: float) -> bool:
+        agora = time.time()
+        with self._lock:
+            atual = self._locks.get(nome)
+            if atual is None or atual[1] < agora or atual[0] == dono:
+                self._locks[nome] = (dono, agora + ttl)
+                return True
+            return False
+
+    def liberar_lock(self, nome: str, dono: str) -> None:
+        with self._lock:
+            if self._locks.get(nome, (None,))[0] == dono:
+                del self._locks[nome]
+
+
+class EstadoSQLite:
+    """Backend em arquivo SQLite (WAL), compartilhado pelos processos locais."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._local = threading.local()
+        self._limpeza = time.monotonic()
+        con = self._con()
+        con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS kv (
+                chave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira REAL
+            );
+            CREATE INDEX IF NOT EXISTS kv_expira ON kv (expira);
+            CREATE TABLE IF NOT EXISTS contadores (
+                chave TEXT PRIMARY KEY, valor INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS locks (
+                nome TEXT PRIMARY KEY, dono TEXT NOT NULL, expira REAL NOT NULL
+            );
+            """
+        )
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def get(self, chave: str):
+        row = self._con().execute(
+            "SELECT valor, expira FROM kv WHERE chave = ?", (chave,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self._con().execute(
+                "DELETE FROM kv WHERE chave = ? AND expira < ?", (chave, time.time())
+            )
+            return None
+        return json.loads(row[0])
+
+    def set(self, chave: str, valor, ttl: float | None = None) -> None:
+        expira = time.time() + ttl if ttl else None
+        self._con().execute(
+            "INSERT OR REPLACE INTO kv (chave, valor, expira) VALUES (?, ?, ?)",
+            (chave, json.dumps(valor), expira),
+        )
+        if time.monotonic() - self._limpeza >= ESTADO_LIMPEZA_S:
+            # Cada processo varre por conta própria; a varredura é idempotente
+            self._limpeza = time.monotonic()
+            self._con().execute("DELETE FROM kv WHERE expira < ?", (time.time(),))
+
+    def delete(self, chave: str) -> None:
+        self._con().execute("DELETE FROM kv WHERE chave = ?", (chave,))
+
+    def incr(self, chave: str, n: int = 1) -> int:
+        return self._con().execute(
+            "INSERT INTO contadores (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT(chave) DO UPDATE SET valor = valor + excluded.valor "
+            "RETURNING valor",
+            (chave, n),
+        ).fetchone()[0]
+
+    def contador(self, chave: str) -> int:
+        row = self._con().execute(
+            "SELECT valor FROM contadores WHERE chave = ?", (chave,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def tentar_lock(self, nome: str, dono: str, ttl: float) -> bool:
+        agora = time.time()
+        cur = self._con().execute(
+            "INSERT INTO locks (nome, dono, expira) VALUES (?, ?, ?) "
+            "ON CONFLICT(nome) DO UPDATE SET dono = excluded.dono, expira = excluded.expira "
+            "WHERE locks.expira < ? OR locks.dono = excluded.dono",
+            (nome, dono, agora + ttl, agora),
+        )
+        return cur.rowcount == 1
+
+    def liberar_lock(self, nome: str, dono: str) -> None:
+        self._con().execute("DELETE FROM locks WHERE nome = ? AND dono = ?", (nome, dono))
+
+
+class EstadoRedis:
+    """Backend Redis, para workers distribuídos em mais de uma máquina."""
+
+    _LIBERAR = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+    _RENOVAR = (
+        "local atual = redis.call('get', KEYS[1]) "
+        "if atual == false or atual == ARGV[1] then "
+        "redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2]) return 1 end return 0"
+    )
+
+    def __init__(self, url: str, prefixo: str):
+        if redis is None:
+            raise RuntimeError("Backend redis requer o pacote 'redis' instalado.")
+        self._r = redis.Redis.from_url(url, decode_responses=True)
+        self._p = prefixo
+
+    def get(self, chave: str):
+        valor = self._r.get(self._p + chave)
+        return None if valor is None else json.loads(valor)
+
+    def set(self, chave: str, valor, ttl: float | None = None) -> None:
+        self._r.set(self._p + chave, json.dumps(valor), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, chave: str) -> None:
+        self._r.delete(self._p + chave)
+
+    def incr(self, chave: str, n: int = 1) -> int:
+        return int(self._r.incrby(self._p + "contador:" + chave, n))
+
+    def contador(self, chave: str) -> int:
+        return int(self._r.get(self._p + "contador:" + chave) or 0)
+
+    def tentar_lock(self, nome: str, dono: str, ttl: float) -> bool:
+        return bool(
+            self._r.eval(self._RENOVAR, 1, self._p + "lock:" + nome, dono, int(ttl * 1000))
+        )
+
+    def liberar_lock(self, nome: str, dono: str) -> None:
+        self._r.eval(self._LIBERAR, 1, self._p + "lock:" + nome, dono)
+
+
+def _criar_backend():
+    if ESTADO_BACKEND == "redis":
+        return EstadoRedis(ESTADO_REDIS_URL, ESTADO_PREFIXO)
+    if ESTADO_BACKEND == "memoria":
+        return EstadoMemoria()
+    if ESTADO_BACKEND != "sqlite":
+        logger.warning("ESTADO_BACKEND '%s' desconhecido; usando sqlite", ESTADO_BACKEND)
+    return EstadoSQLite(ESTADO_SQLITE_PATH)
+
+
+backend = _criar_backend()
+
+
+# Identifica unicamente este processo (compõe o dono dos locks)
+_ID_PROCESSO = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+# ──────────────────────────────────────────────────────────
+# API de conveniência
+# ──────────────────────────────────────────────────────────
+def get(chave: str, default=None):
+    valor = backend.get(chave)
+    return default if valor is None else valor
+
+
+def set(chave: str, valor, ttl: float | None = None) -> None:  # noqa: A001
+    backend.set(chave, valor, ttl)
+
+
+def delete(chave: str) -> None:
+    backend.delete(chave)
+
+
+def incr(chave: str, n: int = 1) -> int:
+    return backend.incr(chave, n)
+
+
+def contador(chave: str) -> int:
+    return backend.contador(chave)
+
+
+@contextmanager
+def lock(nome: str, ttl: float = 60, espera: float | None = None):
+    """Lock exclusivo entre todos os workers.
+
+    ``ttl`` limita quanto tempo o lock sobrevive se o processo morrer segurando-o;
+    ``espera`` (s) é o tempo máximo para obtê-lo (``None`` = indefinido).
+    """
+    dono = f"{_ID_PROCESSO}:{threading.get_ident()}:{uuid.uuid4().hex[:6]}"
+    limite = None if espera is None else time.monotonic() + espera
+    while not backend.tentar_lock(nome, dono, ttl):
+        if limite is not None and time.monotonic() >= limite:
+            raise TimeoutError(f"Não foi possível obter o lock '{nome}'")
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        backend.liberar_lock(nome, dono)
+
+
+class CacheCompartilhado:
+    """Cache com TTL visível a todos os workers (mesma interface de ``TTLCache``)."""
+
+    def __init__(self, namespace: str, ttl: float | None):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _chave(self, chave) -> str:
+        return f"{self.namespace}:{chave}"
+
+    def get(self, chave, default=None):
+        valor = backend.get(self._chave(chave))
+        return default if valor is None else valor
+
+    def set(self, chave, valor, ttl: float | None = None) -> None:
+        backend.set(self._chave(chave), valor, self.ttl if ttl is None else ttl)
+
+    def pop(self, chave, default=None):
+        valor = self.get(chave, default)
+        backend.delete(self._chave(chave))
+        return valor
+
+    def __contains__(self, chave) -> bool:
+        return backend.get(self._chave(chave)) is not None
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Índice em memória para a busca de alunos (``GET /alunos/busca``).
+
+Construído a partir do retrato da lista de alunos (``alunos.py``) a cada
+recarga em que a lista muda:
+
+- alunos ordenados por nome normalizado (sem acentos, minúsculo) e id, que é
+  também a ordem dos resultados e a base do cursor de paginação;
+- lista ordenada de palavras dos nomes, para busca por prefixo com ``bisect``;
+- dicionários de CPF, telefone e e-mail para correspondência exata.
+"""
+
+import bisect
+import re
+import unicodedata
+
+import normalizacao
+
+_NAO_ALFANUMERICO = re.compile(r"[^0-9a-z]+")
+_CAMPOS_TELEFONE = ("telefone", "celular", "whatsapp", "fone")
+
+
+def normalizar_nome(texto: str | None) -> str:
+    """``"José  da Silva"`` -> ``"jose da silva"``."""
+    sem_acentos = unicodedata.normalize("NFKD", texto or "").encode("ASCII", "ignore").decode()
+    return _NAO_ALFANUMERICO.sub(" ", sem_acentos.lower()).strip()
+
+
+def normalizar_cpf(cpf: str | None) -> str:
+    return normalizacao.cpf(cpf)
+
+
+def normalizar_telefone(telefone: str | None) -> str:
+    formatado = normalizacao.telefone(telefone)
+    # Sem nenhum dígito sobra só o prefixo do país
+    return "" if formatado == "55" else formatado
+
+
+def normalizar_email(email: str | None) -> str:
+    return (email or "").strip().lower()
+
+
+def _bloqueado(aluno: dict) -> bool:
+    return str(aluno.get("bloqueado") or "0") not in ("0", "false", "False")
+
+
+class IndiceAlunos:
+    """Índice imutável sobre uma lista de alunos da OM."""
+
+    def __init__(self, alunos: list[dict]):
+        chaves = [(normalizar_nome(a.get("nome")), str(a.get("id") or "")) for a in alunos]
+        ordem = sorted(range(len(alunos)), key=chaves.__getitem__)
+        self.alunos = [alunos[i] for i in ordem]
+        self.chaves = [chaves[i] for i in ordem]
+        self._bloqueados = [_bloqueado(a) for a in self.alunos]
+
+        palavras = []
+        self._por_cpf: dict[str, list[int]] = {}
+        self._por_telefone: dict[str, list[int]] = {}
+        self._por_email: dict[str, list[int]] = {}
+        for pos, (aluno, (nome, _)) in enumerate(zip(self.alunos, self.chaves)):
+            palavras.extend((palavra, pos) for palavra in set(nome.split()))
+            if cpf := normalizar_cpf(aluno.get("cpf")):
+                self._por_cpf.setdefault(cpf, []).append(pos)
+            if email := normalizar_email(aluno.get("email")):
+                self._por_email.setdefault(email, []).append(pos)
+            telefones = {normalizar_telefone(aluno.get(c)) for c in _CAMPOS_TELEFONE} - {""}
+            for telefone in telefones:
+                self._por_telefone.setdefault(telefone, []).append(pos)
+        palavras.sort()
+        self._palavras = [p for p, _ in palavras]
+        self._palavras_pos = [pos for _, pos in palavras]
+
+    def __len__(self) -> int:
+        return len(self.alunos)
+
+    def _prefixo(self, termo: str) -> set[int]:
+        inicio = bisect.bisect_left(self._palavras, termo)
+        fim = bisect.bisect_left(self._palavras, termo + "\uffff", inicio)
+        return set(self._palavras_pos[inicio:fim])
+
+    def buscar(
+        self,
+        nome: str | None = None,
+        cpf: str | None = None,
+        telefone: str | None = None,
+        email: str | None = None,
+        bloqueado: bool | None = None,
+        depois: tuple[str, str] | None = None,
+        limite: int = 50,
+    ) -> tuple[list[dict], int, tuple[str, str] | None]:
+        """Alunos que atendem a todos os filtros, na ordem do índice.
+
+        ``nome``: cada palavra deve ser prefixo de uma palavra do nome.
+        ``depois``: chave do último aluno da página anterior.
+        Retorna ``(pagina, total, chave_do_ultimo_se_houver_mais)``.
+        """
+        conjuntos: list[set[int]] = []
+        for termo in normalizar_nome(nome).split():
+            conjuntos.append(self._prefixo(termo))
+        for valor, normalizar, indice in (
+            (cpf, normalizar_cpf, self._por_cpf),
+            (telefone, normalizar_telefone, self._por_telefone),
+            (email, normalizar_email, self._por_email),
+        ):
+            if valor is not None:
+                conjuntos.append(set(indice.get(normalizar(valor), ())))
+
+        if conjuntos:
+            posicoes = sorted(set.intersection(*conjuntos))
+        else:
+            posicoes = range(len(self.alunos))
+        if bloqueado is not None:
+            posicoes = [p for p in posicoes if self._bloqueados[p] == bloqueado]
+
+        total = len(posicoes)
+        inicio = 0
+        if depois is not None:
+            inicio = bisect.bisect_left(posicoes, bisect.bisect_right(self.chaves, depois))
+        pagina = posicoes[inicio : inicio + limite]
+        proximo = self.chaves[pagina[-1]] if pagina and inicio + limite < total else None
+        return [self.alunos[p] for p in pagina], total, proximo
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import requests
 import unicodedata
@@ -5,25 +6,32 @@ import difflib
 import datetime
 from dateutil.relativedelta import relativedelta
 import json
+import alunos
 import asaas
+import captura
+import estado
+import normalizacao
+import secure
+import unidades
+import notificacoes
 from utils import formatar_numero_whatsapp, parse_valor, parse_valor_centavos
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import JSONResponse
 import gspread
 from google.oauth2.service_account import Credentials
 from cursos import CURSOS_OM
+from rastreio import etapa
+from serializacao import RotaJSON
+from cache import chamada_unica
 
 # --- Roteador do FastAPI ---
-router = APIRouter()
+router = APIRouter(route_class=RotaJSON)
 
 # --- Configuração de Variáveis de Ambiente ---
 OM_BASE = os.getenv("OM_BASE")
 BASIC_B64 = os.getenv("BASIC_B64")
-# Endpoint do WhatsApp (não requer token)
-WHATSAPP_URL = "https://whatsapptest-stij.onrender.com/send"
 # Número para receber os logs via WhatsApp
 WHATSAPP_LOG_NUM = os.getenv("WHATSAPP_LOG_NUM", "556186660241")
-UNIDADE_ID = os.getenv("UNIDADE_ID")
 DISCORD_WEBHOOK = os.getenv("DISCORD_WEBHOOK")
 
 # Variáveis para credenciais do Google
@@ -33,9 +41,18 @@ GOOGLE_SHEETS_CREDENTIALS_PATH = os.getenv(
 )  # Para arquivos secretos
 GOOGLE_SHEET_NAME = os.getenv("GOOGLE_SHEET_NAME")
 
-# --- Variáveis Globais (Cache) ---
-TOKEN_UNIDADE: str | None = None
-CURSOS_OM_CACHE: dict = {}  # Cache para os cursos carregados da API
+# Timeout (s) de cada etapa executada em paralelo após a matrícula
+KIWIFY_TIMEOUTS = {
+    "whatsapp": float(os.getenv("KIWIFY_TIMEOUT_WHATSAPP", "10")),
+    "assinatura": float(os.getenv("KIWIFY_TIMEOUT_ASSINATURA", "30")),
+    "planilha": float(os.getenv("KIWIFY_TIMEOUT_PLANILHA", "30")),
+}
+
+# --- Cache compartilhado entre os workers (ver estado.py) ---
+CURSOS_OM_CHAVE = "kiwify:cursos_om"  # Cursos carregados da API: {nome: [id]}
+# Existe enquanto o catálogo acima é recente; sem ela, a inicialização o recarrega
+CURSOS_OM_ATUALIZADO_CHAVE = "kiwify:cursos_om:atualizado_em"
+KIWIFY_CURSOS_TTL = float(os.getenv("KIWIFY_CURSOS_TTL", "21600"))
 
 # --- Funções Auxiliares ---
 
@@ -44,17 +61,7 @@ def enviar_log_whatsapp(mensagem: str) -> None:
     """Envia mensagem de log via WhatsApp, ignorando tokens renovados."""
     if "Token de unidade atualizado" in mensagem:
         return
-    numero = formatar_numero_whatsapp(WHATSAPP_LOG_NUM)
-    if not numero:
-        return
-    try:
-        requests.get(
-            WHATSAPP_URL,
-            params={"para": numero, "mensagem": mensagem},
-            timeout=10,
-        )
-    except Exception as e:
-        print(f"❌ Erro ao enviar log para WhatsApp: {e}")
+    notificacoes.enviar_whatsapp(WHATSAPP_LOG_NUM, mensagem, "log-kiwify")
 
 
 def enviar_log_discord(mensagem: str) -> None:
@@ -64,33 +71,31 @@ def enviar_log_discord(mensagem: str) -> None:
         print("Discord webhook não configurado")
         return
     try:
-        requests.post(DISCORD_WEBHOOK, json={"content": mensagem}, timeout=5)
+        with etapa("discord"):
+            requests.post(DISCORD_WEBHOOK, json={"content": mensagem}, timeout=5)
     except Exception as e:
         print(f"❌ Erro ao enviar log para Discord: {e}")
 
 
-def obter_token_unidade() -> str | None:
-    """Busca e atualiza o token de autenticação da unidade."""
-    global TOKEN_UNIDADE
+def obter_token_unidade(renovar: bool = False, unidade: str | None = None) -> str | None:
+    """Token da unidade, compartilhado com os demais módulos via ``secure``."""
     try:
-        resp = requests.get(
-            f"{OM_BASE}/unidades/token/{UNIDADE_ID}",
-            headers={"Authorization": f"Basic {BASIC_B64}"},
-        )
-        dados = resp.json()
-        if resp.ok and dados.get("status") == "true":
-            TOKEN_UNIDADE = dados["data"]["token"]
-            enviar_log_discord("🔁 Token de unidade atualizado com sucesso!")
-            return TOKEN_UNIDADE
-        enviar_log_discord(f"❌ Erro ao obter token: {dados}")
+        token = secure.obter_token_unidade(renovar=renovar, unidade=unidade)
     except Exception as e:
-        enviar_log_discord(f"❌ Exceção ao obter token: {e}")
-    return None
+        enviar_log_discord(f"❌ Exceção ao obter token da unidade {unidade or ''}: {e}")
+        return None
+    if renovar:
+        enviar_log_discord(f"🔁 Token de unidade atualizado com sucesso! ({unidade or unidades.UNIDADE_PADRAO})")
+    return token
+
+
+def cursos_om_cache() -> dict:
+    """Cursos da API em cache (vazio até a primeira atualização)."""
+    return estado.get(CURSOS_OM_CHAVE, {})
 
 
 def atualizar_cache_cursos_om() -> None:
     """Busca todos os cursos da API e os armazena em cache."""
-    global CURSOS_OM_CACHE
     enviar_log_discord("🔄 Atualizando cache de cursos a partir da API...")
     try:
         resp = requests.get(
@@ -113,15 +118,22 @@ def atualizar_cache_cursos_om() -> None:
             )
             return
 
-        CURSOS_OM_CACHE = novo_cache
+        estado.set(CURSOS_OM_CHAVE, novo_cache)
+        estado.set(
+            CURSOS_OM_ATUALIZADO_CHAVE,
+            datetime.datetime.now().isoformat(),
+            ttl=KIWIFY_CURSOS_TTL,
+        )
         enviar_log_discord(
-            f"✅ Cache de cursos atualizado com sucesso. {len(CURSOS_OM_CACHE)} cursos carregados."
+            f"✅ Cache de cursos atualizado com sucesso. {len(novo_cache)} cursos carregados."
         )
 
     except Exception as e:
         enviar_log_discord(f"❌ Exceção ao atualizar cache de cursos: {e}")
 
 
+@etapa("om_busca_cpf")
+@chamada_unica("om_busca_cpf_kiwify")
 def buscar_aluno_por_cpf(cpf: str) -> str | None:
     """Busca o ID de um aluno no sistema OM pelo CPF."""
     try:
@@ -170,22 +182,19 @@ def enviar_whatsapp_chatpro(
         "Qualquer dúvida, estamos à disposição. Boa jornada de estudos! 🚀"
     )
 
-    try:
-        r = requests.get(
-            WHATSAPP_URL,
-            params={"para": numero_telefone, "mensagem": mensagem},
-            timeout=10,
-        )
-        if r.ok:
-            enviar_log_discord(
-                f"✅ WhatsApp enviado para {numero_telefone}. Resposta: {r.text}"
-            )
+    def _resultado(futuro):
+        erro = futuro.exception()
+        if erro:
+            enviar_log_discord(f"❌ Erro ao enviar WhatsApp para {numero_telefone}: {erro}")
         else:
             enviar_log_discord(
-                f"❌ Falha ao enviar WhatsApp para {numero_telefone}. HTTP {r.status_code} | {r.text}"
+                f"✅ WhatsApp enviado para {numero_telefone}. Resposta: {futuro.result().text}"
             )
-    except Exception as e:
-        enviar_log_discord(f"❌ Erro ao enviar WhatsApp para {numero_telefone}: {e}")
+
+    notificacoes.ao_concluir(
+        notificacoes.enviar_whatsapp(numero_telefone, mensagem, "boas-vindas-kiwify"),
+        _resultado,
+    )
 
 
 def _normalize(text: str) -> str:
@@ -208,14 +217,15 @@ def obter_cursos_ids(nome_plano: str):
     norm_plano = _normalize(nome_plano)
 
     # 1) Busca no cache de cursos obtidos da API
-    for key, value in CURSOS_OM_CACHE.items():
+    cursos_api = cursos_om_cache()
+    for key, value in cursos_api.items():
         if _normalize(key) == norm_plano:
             return value
 
-    nomes_norm = {_normalize(k): k for k in CURSOS_OM_CACHE}
+    nomes_norm = {_normalize(k): k for k in cursos_api}
     match = difflib.get_close_matches(norm_plano, nomes_norm.keys(), n=1, cutoff=0.8)
     if match:
-        return CURSOS_OM_CACHE[nomes_norm[match[0]]]
+        return cursos_api[nomes_norm[match[0]]]
 
     # 2) Fallback para o dicionário estático
     for key, value in CURSOS_OM.items():
@@ -235,6 +245,7 @@ def obter_cursos_ids(nome_plano: str):
     return None
 
 
+@etapa("google_sheets")
 def adicionar_aluno_planilha(dados: dict) -> None:
     """Adiciona uma nova linha com dados do aluno na Planilha Google."""
     if not GOOGLE_SHEET_NAME or (
@@ -306,24 +317,61 @@ def log_request_info(request: Request):
 router.dependencies.append(Depends(log_request_info))
 
 
-async def _process_webhook(payload: dict):
-    """Processa o payload do webhook da Kiwify."""
+async def _executar_etapa(nome: str, funcao) -> str:
+    """Executa uma etapa pós-matrícula com timeout, reportando a falha isolada."""
+    try:
+        await asyncio.wait_for(asyncio.to_thread(funcao), KIWIFY_TIMEOUTS[nome])
+        return "ok"
+    except asyncio.TimeoutError:
+        # A thread segue em segundo plano; apenas deixamos de aguardá-la
+        enviar_log_discord(
+            f"⏱️ Etapa '{nome}' excedeu {KIWIFY_TIMEOUTS[nome]:.0f}s e segue em segundo plano."
+        )
+        return "timeout"
+    except Exception as e:
+        enviar_log_discord(f"❌ ERRO NA ETAPA '{nome}': {e}")
+        return "erro"
+
+
+async def _executar_pos_matricula(etapas: dict) -> dict:
+    """Roda WhatsApp, assinatura no ASAAS e planilha ao mesmo tempo.
+
+    A latência passa a ser a da etapa mais lenta, e a falha de uma não
+    impede as demais.
+    """
+    resultados = await asyncio.gather(
+        *(_executar_etapa(nome, funcao) for nome, funcao in etapas.items())
+    )
+    return dict(zip(etapas, resultados))
+
+
+async def _process_webhook(payload: dict, unidade: str | None = None):
+    """Processa o payload do webhook da Kiwify.
+
+    ``unidade`` vem da URL configurada na Kiwify (``?unidade=``); sem ela, o
+    aluno é cadastrado na unidade padrão.
+    """
     try:
+        unidade = unidades.resolver(unidade)
         evento = payload.get("webhook_event_type")
 
         if evento == "order_refunded":
             customer = payload.get("Customer", {})
-            cpf = customer.get("CPF", "").replace(".", "").replace("-", "")
+            cpf = normalizacao.cpf(customer.get("CPF"))
             if not cpf:
                 raise HTTPException(400, "CPF não encontrado no payload de reembolso.")
+            # O aluno é buscado pelo mesmo documento (CPF ou CNPJ) usado no cadastro
+            if not normalizacao.documento_valido(cpf):
+                raise HTTPException(400, "CPF/CNPJ inválido no payload de reembolso.")
             aluno_id = buscar_aluno_por_cpf(cpf)
             if not aluno_id:
                 raise HTTPException(404, "Aluno não encontrado para o CPF informado.")
 
-            resp_exclusao = requests.delete(
-                f"{OM_BASE}/alunos/{aluno_id}",
-                headers={"Authorization": f"Basic {BASIC_B64}"},
-            )
+            with etapa("om_exclusao"):
+                resp_exclusao = requests.delete(
+                    f"{OM_BASE}/alunos/{aluno_id}",
+                    headers={"Authorization": f"Basic {BASIC_B64}"},
+                )
             if not resp_exclusao.ok:
                 enviar_log_discord(
                     f"❌ ERRO AO EXCLUIR ALUNO {aluno_id}: {resp_exclusao.text}"
@@ -332,11 +380,13 @@ async def _process_webhook(payload: dict):
                     500, f"Falha ao excluir aluno: {resp_exclusao.text}"
                 )
 
+            alunos.invalidar()
             enviar_log_discord(
                 f"✅ Conta do aluno com ID {aluno_id} (CPF: {cpf}) excluída com sucesso."
             )
             try:
-                canceladas = asaas.cancelar_assinaturas_por_cpf(cpf)
+                with etapa("asaas_cancelamento"):
+                    canceladas = asaas.cancelar_assinaturas_por_cpf(cpf)
                 enviar_log_discord(
                     f"🔔 {canceladas} assinatura(s) ASAAS cancelada(s) para o CPF {cpf}."
                 )
@@ -349,7 +399,14 @@ async def _process_webhook(payload: dict):
 
         customer = payload.get("Customer", {})
         nome = customer.get("full_name")
-        cpf = customer.get("CPF", "").replace(".", "").replace("-", "")
+        cpf = normalizacao.cpf(customer.get("CPF"))
+        # Recusa antes de qualquer chamada à OM ou ao ASAAS
+        if cpf and not normalizacao.documento_valido(cpf):
+            raise HTTPException(400, "CPF/CNPJ inválido no payload.")
+
+        # A mensagem de boas-vindas sai ao final: acorda o gateway desde já
+        notificacoes.esperar_envios()
+
         email = customer.get("email")
         celular = customer.get("mobile") or "(00) 00000-0000"
 
@@ -372,8 +429,12 @@ async def _process_webhook(payload: dict):
         if not cursos_ids:
             raise HTTPException(400, f"Plano '{plano_assinatura}' não mapeado.")
 
+        token_unidade = obter_token_unidade(unidade=unidade)
+        if not token_unidade:
+            raise HTTPException(500, f"Token da unidade {unidade} indisponível.")
+
         dados_aluno_om = {
-            "token": TOKEN_UNIDADE,
+            "token": token_unidade,
             "nome": nome,
             "data_nascimento": "2000-01-01",
             "email": email,
@@ -391,11 +452,12 @@ async def _process_webhook(payload: dict):
             "cep": customer.get("zipcode", ""),
         }
 
-        resp_cadastro = requests.post(
-            f"{OM_BASE}/alunos",
-            data=dados_aluno_om,
-            headers={"Authorization": f"Basic {BASIC_B64}"},
-        )
+        with etapa("om_cadastro"):
+            resp_cadastro = requests.post(
+                f"{OM_BASE}/alunos",
+                data=dados_aluno_om,
+                headers={"Authorization": f"Basic {BASIC_B64}"},
+            )
         aluno_response = resp_cadastro.json()
         if not resp_cadastro.ok or aluno_response.get("status") != "true":
             enviar_log_discord(f"❌ ERRO CADASTRO: {resp_cadastro.text}")
@@ -404,63 +466,72 @@ async def _process_webhook(payload: dict):
         aluno_id = aluno_response.get("data", {}).get("id")
         if not aluno_id:
             raise HTTPException(500, "ID do aluno não retornado após cadastro.")
+        alunos.invalidar(unidade)
 
         dados_matricula = {
-            "token": TOKEN_UNIDADE,
+            "token": token_unidade,
             "cursos": ",".join(map(str, cursos_ids)),
         }
-        resp_matricula = requests.post(
-            f"{OM_BASE}/alunos/matricula/{aluno_id}",
-            data=dados_matricula,
-            headers={"Authorization": f"Basic {BASIC_B64}"},
-        )
+        with etapa("om_matricula"):
+            resp_matricula = requests.post(
+                f"{OM_BASE}/alunos/matricula/{aluno_id}",
+                data=dados_matricula,
+                headers={"Authorization": f"Basic {BASIC_B64}"},
+            )
         if not resp_matricula.ok or resp_matricula.json().get("status") != "true":
             enviar_log_discord(
                 f"❌ ERRO MATRÍCULA (Aluno ID {aluno_id}): {resp_matricula.text}"
             )
             raise HTTPException(500, f"Falha ao matricular: {resp_matricula.text}")
+        alunos.invalidar_progresso(aluno_id)
+
+        proximo_mes = datetime.datetime.now() + relativedelta(months=1)
+
+        def _assinatura():
+            with etapa("asaas_assinatura"):
+                asaas.criar_assinatura_recorrente(
+                    {
+                        "nome": nome,
+                        "cpf": cpf,
+                        "whatsapp": celular,
+                        "valor": valor_plano,
+                        "descricao": plano_assinatura,
+                        "cursos_ids": cursos_ids,
+                        "dueDate": proximo_mes.strftime("%Y-%m-%d"),
+                    },
+                    enviar_whatsapp=False,
+                )
 
-        vencimento = (datetime.datetime.now() + relativedelta(months=1)).strftime(
-            "%d/%m/%Y"
-        )
-        enviar_whatsapp_chatpro(
-            nome,
-            celular,
-            plano_assinatura,
-            cpf,
-            vencimento=vencimento,
-        )
-
-        try:
-            asaas.criar_assinatura_recorrente(
-                {
-                    "nome": nome,
-                    "cpf": cpf,
-                    "whatsapp": celular,
-                    "valor": valor_plano,
-                    "descricao": plano_assinatura,
-                    "cursos_ids": cursos_ids,
-                    "dueDate": (
-                        datetime.datetime.now() + relativedelta(months=1)
-                    ).strftime("%Y-%m-%d"),
-                },
-                enviar_whatsapp=False,
-            )
-        except Exception as e:
-            enviar_log_discord(f"❌ ERRO ASSINATURA ASAAS: {e}")
-
-        adicionar_aluno_planilha(
+        # Etapas independentes após a matrícula: rodam em paralelo
+        etapas = await _executar_pos_matricula(
             {
-                "nome": nome,
-                "celular": celular,
-                "email": email,
-                "cpf": cpf,
-                "metodo_pagamento": metodo_pagamento,
-                "plano_assinatura": plano_assinatura,
+                "whatsapp": lambda: enviar_whatsapp_chatpro(
+                    nome,
+                    celular,
+                    plano_assinatura,
+                    cpf,
+                    vencimento=proximo_mes.strftime("%d/%m/%Y"),
+                ),
+                "assinatura": _assinatura,
+                "planilha": lambda: adicionar_aluno_planilha(
+                    {
+                        "nome": nome,
+                        "celular": celular,
+                        "email": email,
+                        "cpf": cpf,
+                        "metodo_pagamento": metodo_pagamento,
+                        "plano_assinatura": plano_assinatura,
+                    }
+                ),
             }
         )
 
-        return {"message": "Aluno processado com sucesso!", "aluno_id": aluno_id}
+        return {
+            "message": "Aluno processado com sucesso!",
+            "aluno_id": aluno_id,
+            "unidade": unidade,
+            "etapas": etapas,
+        }
 
     except HTTPException as http_exc:
         enviar_log_discord(
@@ -476,24 +547,40 @@ async def _process_webhook(payload: dict):
 
 
 @router.post("/webhook")
-async def webhook_kiwify(request: Request):
+async def webhook_kiwify(request: Request, unidade: str | None = None):
     payload = await request.json()
+    captura.registrar("/kiwify/webhook", payload)
     order_payload = payload.get("order", payload)
-    return await _process_webhook(order_payload)
+    return await _process_webhook(order_payload, unidade)
 
 
 @router.post("/")
-async def webhook_root(request: Request):
+async def webhook_root(request: Request, unidade: str | None = None):
     payload = await request.json()
+    captura.registrar("/kiwify/", payload)
     order_payload = payload.get("order", payload)
-    return await _process_webhook(order_payload)
+    return await _process_webhook(order_payload, unidade)
+
+
+def atualizar_token_e_cursos() -> bool:
+    """Renova o token e o catálogo de cada unidade e o cache de cursos (tarefa agendada)."""
+    tokens = unidades.em_paralelo(lambda u: obter_token_unidade(renovar=True, unidade=u))
+    atualizar_cache_cursos_om()
+    try:
+        unidades.atualizar_cursos()
+    except Exception as e:
+        enviar_log_discord(f"❌ Falha ao atualizar cursos das unidades: {e}")
+    return bool(tokens) and all(tokens.values())
 
 
 @router.get("/secure/refresh-all")
-async def secure_refresh_all():
+def secure_refresh_all():
     """Força a atualização manual do token e do cache de cursos."""
-    token_ok = obter_token_unidade()
-    atualizar_cache_cursos_om()
+    try:
+        with estado.lock("tarefa:atualizar_token_cursos", ttl=600, espera=0):
+            token_ok = atualizar_token_e_cursos()
+    except TimeoutError:
+        raise HTTPException(409, "Atualização já em andamento")
     if token_ok:
         return "🔐 Token e cache de cursos atualizados com sucesso!"
     return JSONResponse(content="❌ Falha ao atualizar token", status_code=500)
@@ -502,6 +589,19 @@ async def secure_refresh_all():
 # --- Inicialização da Aplicação ---
 @router.on_event("startup")
 async def startup_event():
-    """Executa na inicialização da aplicação."""
-    obter_token_unidade()
-    atualizar_cache_cursos_om()
+    """Executa na inicialização da aplicação.
+
+    Com vários workers, apenas o primeiro a subir consulta a OM; os demais
+    encontram tokens e cursos já no estado compartilhado. O catálogo de cursos
+    é recarregado se a última atualização tem mais de ``KIWIFY_CURSOS_TTL``
+    segundos (ele sobrevive a reinícios no estado compartilhado).
+    """
+    # O lock espera sincronamente: fora do loop de eventos
+    await asyncio.to_thread(_aquecer)
+
+
+def _aquecer() -> None:
+    with estado.lock("kiwify:aquecimento", ttl=60):
+        unidades.em_paralelo(lambda u: obter_token_unidade(unidade=u))
+        if not cursos_om_cache() or estado.get(CURSOS_OM_ATUALIZADO_CHAVE) is None:
+            atualizar_cache_cursos_om()
@@ -1,50 +1,155 @@
+import asyncio
+import hashlib
 import os
-import requests
+import secrets
+
+import httpx
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 
-router = APIRouter()
+from cache import TTLCache
+from rastreio import etapa
+from serializacao import RotaJSON
+
+router = APIRouter(route_class=RotaJSON)
 
 OM_BASE = os.getenv("OM_BASE")  # exemplo: https://meuappdecursos.com.br/ws/v2
 BASIC_B64 = os.getenv("BASIC_B64")
 
+# Limite de chamadas simultâneas à OM no fluxo de login
+LOGIN_CONCORRENCIA_OM = int(os.getenv("LOGIN_CONCORRENCIA_OM", "8"))
+# Tempo (s) em que um token emitido é reaproveitado para o mesmo usuário/senha
+LOGIN_CACHE_TTL = float(os.getenv("LOGIN_CACHE_TTL", "60"))
+# Tokens mais antigos que isso são conferidos em /alunos/token/check antes do reuso
+LOGIN_CACHE_VALIDAR_APOS = float(os.getenv("LOGIN_CACHE_VALIDAR_APOS", "10"))
+
+EAD_URL = "https://ead.cedbrasilia.com.br/index.php?pag=entrar&token={token}"
+
+# O sal é gerado por processo: a chave do cache nunca contém a senha em claro
+_SAL = secrets.token_bytes(16)
+_tokens = TTLCache(LOGIN_CACHE_TTL, maxsize=5000)
+_em_andamento: dict[tuple[str, str], asyncio.Future] = {}
+_limite_om = asyncio.Semaphore(LOGIN_CONCORRENCIA_OM)
+_cliente: httpx.AsyncClient | None = None
+
 
 class LoginData(BaseModel):
     usuario: str
     senha: str
 
 
-def _gera_url_redirecionamento(usuario: str, senha: str) -> str:
-    """Obtém o token da OM e monta a URL de redirecionamento para o EAD."""
-    if not OM_BASE or not BASIC_B64:
-        raise HTTPException(500, detail="Variáveis de ambiente OM não configuradas.")
+def _chave(usuario: str, senha: str) -> tuple[str, str]:
+    return usuario, hashlib.sha256(_SAL + senha.encode()).hexdigest()
 
-    url = f"{OM_BASE}/alunos/token"
-    headers = {"Authorization": f"Basic {BASIC_B64}"}
-    payload = {"usuario": usuario, "senha": senha}
 
-    try:
-        r = requests.post(url, headers=headers, data=payload, timeout=8)
-    except requests.RequestException as e:
-        raise HTTPException(500, detail=f"Erro de conexão: {str(e)}")
+def _cliente_om() -> httpx.AsyncClient:
+    """Cliente HTTP assíncrono com conexões reaproveitadas para a OM."""
+    global _cliente
+    if _cliente is None or _cliente.is_closed:
+        _cliente = httpx.AsyncClient(
+            base_url=OM_BASE,
+            headers={"Authorization": f"Basic {BASIC_B64}"},
+            timeout=8,
+            limits=httpx.Limits(
+                max_connections=LOGIN_CONCORRENCIA_OM,
+                max_keepalive_connections=LOGIN_CONCORRENCIA_OM,
+            ),
+        )
+    return _cliente
+
+
+async def _emitir_token(usuario: str, senha: str) -> str:
+    """Faz POST em /alunos/token respeitando o limite de concorrência."""
+    async with _limite_om:
+        try:
+            with etapa("om_token_aluno"):
+                r = await _cliente_om().post(
+                    "/alunos/token", data={"usuario": usuario, "senha": senha}
+                )
+        except httpx.HTTPError as e:
+            raise HTTPException(500, detail=f"Erro de conexão: {str(e)}")
 
-    if r.ok and r.json().get("status") == "true":
-        token = r.json()["data"]["token"]
-        return f"https://ead.cedbrasilia.com.br/index.php?pag=entrar&token={token}"
+    if r.status_code < 400 and r.json().get("status") == "true":
+        return r.json()["data"]["token"]
 
     raise HTTPException(401, detail="Usuário ou senha inválidos.")
 
 
+async def _token_valido(token: str) -> bool:
+    """Confere na OM se o token do aluno ainda é aceito."""
+    async with _limite_om:
+        try:
+            with etapa("om_token_check"):
+                r = await _cliente_om().get(f"/alunos/token/check/{token}")
+        except httpx.HTTPError:
+            return False
+    try:
+        return r.status_code < 400 and r.json().get("status") == "true"
+    except ValueError:
+        return False
+
+
+async def _obter_token_aluno(usuario: str, senha: str) -> str:
+    """Retorna o token do aluno, reaproveitando logins repetidos em poucos segundos."""
+    chave = _chave(usuario, senha)
+
+    token = _tokens.get(chave)
+    if token:
+        idade = _tokens.idade(chave) or 0.0
+        if idade < LOGIN_CACHE_VALIDAR_APOS or await _token_valido(token):
+            return token
+        _tokens.pop(chave)
+
+    # Cliques duplos simultâneos aguardam a mesma emissão
+    pendente = _em_andamento.get(chave)
+    if pendente:
+        return await asyncio.shield(pendente)
+
+    futuro = asyncio.get_running_loop().create_future()
+    _em_andamento[chave] = futuro
+    try:
+        token = await _emitir_token(usuario, senha)
+        _tokens.set(chave, token)
+        futuro.set_result(token)
+        return token
+    except Exception as e:
+        futuro.set_exception(e)
+        # Evita aviso de exceção não consumida quando ninguém mais aguardava
+        futuro.exception()
+        raise
+    except BaseException:
+        futuro.cancel()
+        raise
+    finally:
+        _em_andamento.pop(chave, None)
+
+
+async def _gera_url_redirecionamento(usuario: str, senha: str) -> str:
+    """Obtém o token da OM e monta a URL de redirecionamento para o EAD."""
+    if not OM_BASE or not BASIC_B64:
+        raise HTTPException(500, detail="Variáveis de ambiente OM não configuradas.")
+
+    token = await _obter_token_aluno(usuario, senha)
+    return EAD_URL.format(token=token)
+
+
 @router.post("/", summary="Realiza login do aluno na OM e redireciona para o EAD")
-def login(dados: LoginData):
+async def login(dados: LoginData):
     """Recebe usuário e senha por POST e redireciona para o EAD."""
-    redirect_url = _gera_url_redirecionamento(dados.usuario, dados.senha)
+    redirect_url = await _gera_url_redirecionamento(dados.usuario, dados.senha)
     return RedirectResponse(url=redirect_url, status_code=302)
 
 
 @router.get("/", summary="Realiza login do aluno na OM e redireciona para o EAD")
-def login_get(usuario: str, senha: str):
+async def login_get(usuario: str, senha: str):
     """Recebe usuário e senha por GET e redireciona para o EAD."""
-    redirect_url = _gera_url_redirecionamento(usuario, senha)
+    redirect_url = await _gera_url_redirecionamento(usuario, senha)
     return RedirectResponse(url=redirect_url, status_code=302)
+
+
+@router.on_event("shutdown")
+async def _fechar_cliente():
+    """Encerra as conexões abertas com a OM."""
+    if _cliente is not None:
+        await _cliente.aclose()
@@ -17,6 +17,16 @@ import bloquear
 import login
 import mensagemdecobranca
 import site_page
+import rastreio
+import cache
+import certificados
+import notificacoes
+import agendador
+import pagamentos
+import relatorios
+import servidor
+import unidades
+import serializacao
 from app import whatsapp
 
 
@@ -27,7 +37,8 @@ app = FastAPI(
     title="API CED – Matrícula Automática",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=serializacao.RespostaJSON,
 )
 
 # ──────────────────────────────────────────────────────────
@@ -45,16 +56,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Server-Timing",
+        rastreio.CABECALHO_CORRELACAO,
+        "ETag",
+        "Last-Modified",
+        alunos.CABECALHO_IDADE,
+    ],
 )
 
+# ──────────────────────────────────────────────────────────
+# Rastreamento por requisição (Server-Timing + log de lentidão)
+# ──────────────────────────────────────────────────────────
+app.add_middleware(serializacao.CompressaoMiddleware)
+app.add_middleware(cache.MemoRequisicaoMiddleware)
+app.add_middleware(rastreio.RastreioMiddleware)
+app.add_middleware(servidor.RequisicoesEmAndamento)
+
 # ──────────────────────────────────────────────────────────
 # Registro dos roteadores
 # ──────────────────────────────────────────────────────────
 app.include_router(cursos.router,     prefix="/cursos",     tags=["Cursos"])
 app.include_router(cursosom.router,   prefix="/cursosom",   tags=["Cursos OM"])
 app.include_router(secure.router,                        tags=["Autenticação"])
+app.include_router(unidades.router)
 app.include_router(matricular.router, prefix="/matricular", tags=["Matrícula"])
 app.include_router(alunos.router,     prefix="/alunos",     tags=["Alunos"])
+app.include_router(certificados.router)
 app.include_router(kiwify.router,     prefix="/kiwify", tags=["Kiwify"])
 app.include_router(asaas.router,  tags=["Matrícula Assas"])
 app.include_router(assinantes.router)
@@ -64,8 +92,13 @@ app.include_router(deletar.router,    tags=["Excluir Aluno"])
 app.include_router(bloquear.router,   tags=["Bloqueio"])
 app.include_router(login.router,      prefix="/login",     tags=["Login"])
 app.include_router(whatsapp.router)
+app.include_router(notificacoes.router)
 app.include_router(mensagemdecobranca.router)
+app.include_router(pagamentos.router)
+app.include_router(relatorios.router)
 app.include_router(site_page.router)
+app.include_router(servidor.router)
+app.include_router(agendador.router)
 
 
 
@@ -78,9 +111,8 @@ def health():
     return {"status": "online", "version": app.version}
 
 # ──────────────────────────────────────────────────────────
-# Execução local / Render
+# Execução local / Render (workers: SERVIDOR_WORKERS ou WEB_CONCURRENCY)
 # ──────────────────────────────────────────────────────────
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.getenv("PORT", 8000))  # Render define PORT dinamicamente
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
+    servidor.executar(port)
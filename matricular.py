@@ -1,57 +1,61 @@
+import asyncio
 import os
-import threading
 from typing import List, Tuple, Optional
 import requests
 from fastapi import APIRouter, HTTPException
 from utils import formatar_numero_whatsapp
+from rastreio import etapa
+from serializacao import RotaJSON
+from cache import chamada_unica, limpar_memo
+import alunos
+import estado
+import normalizacao
+import unidades
+from secure import obter_token_unidade
+import notificacoes
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from cursos import CURSOS_OM, obter_nomes_por_ids  # Importa o dicionário de mapeamento e utilitário
 
-router = APIRouter()
+router = APIRouter(route_class=RotaJSON)
 
 # Variáveis de ambiente para OM
 BASIC_B64 = os.getenv("BASIC_B64")
-UNIDADE_ID = os.getenv("UNIDADE_ID")
 OM_BASE = os.getenv("OM_BASE")
 
-# Endpoint do WhatsApp (não requer token)
-WHATSAPP_URL = "https://whatsapptest-stij.onrender.com/send"
 # Número para receber logs via WhatsApp
 WHATSAPP_LOG_NUM = os.getenv("WHATSAPP_LOG_NUM", "556186660241")
 
 # ** CONSTANTE DO WEBHOOK DISCORD **
-DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1377838283975036928/IgVvwyrBBWflKyXbIU9dgH4PhLwozHzrf-nJpj3w7dsZC-Ds9qN8_Toym3Tnbj-3jdU4"
+DISCORD_WEBHOOK_URL = os.getenv(
+    "DISCORD_WEBHOOK_URL",
+    "https://discord.com/api/webhooks/1377838283975036928/IgVvwyrBBWflKyXbIU9dgH4PhLwozHzrf-nJpj3w7dsZC-Ds9qN8_Toym3Tnbj-3jdU4",
+)
 
 # Prefixo para gerar CPFs sequenciais na OM
 CPF_PREFIXO = "20254158"
-cpf_lock = threading.Lock()
+# Lock entre todos os workers: dois processos nunca geram o mesmo CPF
+CPF_LOCK = "matricular:cpf"
+CPF_LOCK_TTL = 120
 
 def _log(msg: str):
     agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{agora}] {msg}")
 
-def _obter_token_unidade() -> str:
+def _obter_token_unidade(unidade: Optional[str] = None) -> str:
     """
-    Faz GET em /unidades/token/{UNIDADE_ID} para obter token da unidade na OM.
+    Token da unidade na OM (GET /unidades/token/{unidade}), com cache e
+    consulta compartilhada entre requisições simultâneas.
     """
-    if not all([OM_BASE, BASIC_B64, UNIDADE_ID]):
-        raise RuntimeError("Variáveis de ambiente OM não configuradas.")
-    url = f"{OM_BASE}/unidades/token/{UNIDADE_ID}"
-    r = requests.get(
-        url,
-        headers={"Authorization": f"Basic {BASIC_B64}"},
-        timeout=8
-    )
-    if r.ok and r.json().get("status") == "true":
-        return r.json()["data"]["token"]
-    raise RuntimeError(f"Falha ao obter token da unidade: HTTP {r.status_code}")
+    return obter_token_unidade(unidade=unidade)
 
-def _total_alunos() -> int:
+@etapa("om_total_alunos")
+def _total_alunos(unidade: Optional[str] = None) -> int:
     """
     Retorna o total de alunos cadastrados na unidade OM (para gerar CPF).
     """
-    url = f"{OM_BASE}/alunos/total/{UNIDADE_ID}"
+    unidade = unidades.resolver(unidade)
+    url = f"{OM_BASE}/alunos/total/{unidade}"
     r = requests.get(
         url,
         headers={"Authorization": f"Basic {BASIC_B64}"},
@@ -61,7 +65,7 @@ def _total_alunos() -> int:
         return int(r.json()["data"]["total"])
 
     # Fallback: busca todos que tenham CPF começando com o prefixo
-    url2 = f"{OM_BASE}/alunos?unidade_id={UNIDADE_ID}&cpf_like={CPF_PREFIXO}"
+    url2 = f"{OM_BASE}/alunos?unidade_id={unidade}&cpf_like={CPF_PREFIXO}"
     r2 = requests.get(
         url2,
         headers={"Authorization": f"Basic {BASIC_B64}"},
@@ -75,43 +79,49 @@ def _total_alunos() -> int:
 # Melhorias na geração de CPF
 CPF_MAX_RETRIES = 100  # Limite de tentativas para evitar colisões
 
-def _proximo_cpf(incremento: int = 0) -> str:
+def _proximo_cpf(incremento: int = 0, unidade: Optional[str] = None) -> str:
     """
     Gera o próximo CPF sequencial, adicionando incremento para evitar colisões.
     """
-    with cpf_lock:
+    # O lock vale para todas as unidades: o CPF identifica o login na OM
+    with estado.lock(CPF_LOCK, ttl=CPF_LOCK_TTL):
         for tentativa in range(CPF_MAX_RETRIES):
-            seq = _total_alunos() + 1 + incremento + tentativa
+            seq = _total_alunos(unidade) + 1 + incremento + tentativa
             cpf = CPF_PREFIXO + str(seq).zfill(3)
-            if not _cpf_em_uso(cpf):
+            if not _cpf_em_uso(cpf, unidade):
                 return cpf
         raise RuntimeError("Limite de tentativas para gerar CPF excedido.")
 
-def _cpf_em_uso(cpf: str) -> bool:
-    """Verifica se o CPF já está em uso na base de dados da OM."""
-    url = f"{OM_BASE}/alunos?unidade_id={UNIDADE_ID}&cpf={cpf}"
+@chamada_unica("om_alunos_cpf")
+def _alunos_por_cpf(cpf: str, unidade: Optional[str] = None) -> List[dict]:
+    """Consulta os alunos da unidade com o CPF informado.
+
+    ``_cpf_em_uso`` e ``_buscar_aluno_id_por_cpf`` compartilham esta consulta:
+    dentro de uma mesma requisição ela é feita uma única vez.
+    """
+    url = f"{OM_BASE}/alunos?unidade_id={unidades.resolver(unidade)}&cpf={cpf}"
     r = requests.get(
         url,
         headers={"Authorization": f"Basic {BASIC_B64}"},
         timeout=8,
     )
     if r.ok and r.json().get("status") == "true":
-        return len(r.json().get("data", [])) > 0
-    return False
+        return r.json().get("data", []) or []
+    return []
+
+
+@etapa("om_cpf_em_uso")
+def _cpf_em_uso(cpf: str, unidade: Optional[str] = None) -> bool:
+    """Verifica se o CPF já está em uso na base de dados da OM."""
+    return len(_alunos_por_cpf(cpf, unidades.resolver(unidade))) > 0
 
 
-def _buscar_aluno_id_por_cpf(cpf: str) -> Optional[str]:
+@etapa("om_busca_cpf")
+def _buscar_aluno_id_por_cpf(cpf: str, unidade: Optional[str] = None) -> Optional[str]:
     """Retorna o ID do aluno cujo CPF já existe na OM (ou ``None``)."""
-    url = f"{OM_BASE}/alunos?unidade_id={UNIDADE_ID}&cpf={cpf}"
-    r = requests.get(
-        url,
-        headers={"Authorization": f"Basic {BASIC_B64}"},
-        timeout=8,
-    )
-    if r.ok and r.json().get("status") == "true":
-        dados = r.json().get("data", [])
-        if dados:
-            return str(dados[0].get("id"))
+    dados = _alunos_por_cpf(cpf, unidades.resolver(unidade))
+    if dados:
+        return str(dados[0].get("id"))
     return None
 
 def _cadastrar_somente_aluno(
@@ -121,16 +131,18 @@ def _cadastrar_somente_aluno(
     token_key: str,
     senha_padrao: str = "1234567",
     cpf: Optional[str] = None,
+    unidade: Optional[str] = None,
 ) -> Tuple[str, str]:
     """
     Cadastra apenas o aluno na OM (gera e-mail dummy se não for fornecido).
     Retorna: (aluno_id, cpf).
     """
+    unidade = unidades.resolver(unidade)
     # Se não houver e-mail, cria um e-mail dummy a partir do WhatsApp
     email_validado = email or f"{whatsapp}@nao-informado.com"
 
     if cpf:
-        existente = _buscar_aluno_id_por_cpf(cpf)
+        existente = _buscar_aluno_id_por_cpf(cpf, unidade)
         if existente:
             return existente, cpf
         tentativas = 1
@@ -138,7 +150,7 @@ def _cadastrar_somente_aluno(
         tentativas = 60
 
     for tentativa in range(tentativas):
-        cpf_atual = cpf or _proximo_cpf(tentativa)
+        cpf_atual = cpf or _proximo_cpf(tentativa, unidade)
         payload = {
             "token": token_key,
             "nome": nome,
@@ -157,21 +169,25 @@ def _cadastrar_somente_aluno(
             "cep": "70000-000",
             "complemento": "",
             "numero": "0",
-            "unidade_id": UNIDADE_ID,
+            "unidade_id": unidade,
             "senha": senha_padrao,
         }
-        r = requests.post(
-            f"{OM_BASE}/alunos",
-            data=payload,
-            headers={"Authorization": f"Basic {BASIC_B64}"},
-            timeout=10
-        )
+        with etapa("om_cadastro"):
+            r = requests.post(
+                f"{OM_BASE}/alunos",
+                data=payload,
+                headers={"Authorization": f"Basic {BASIC_B64}"},
+                timeout=10
+            )
+        # O cadastro (ou a colisão de CPF) muda o resultado das consultas por CPF
+        limpar_memo("om_alunos_cpf")
         _log(
             f"[CAD] Tentativa {tentativa+1}/{tentativas} | Status {r.status_code} | Retorno OM: {r.text}"
         )
 
         if r.ok and r.json().get("status") == "true":
             aluno_id = r.json()["data"]["id"]
+            alunos.invalidar(unidade)
             return aluno_id, cpf_atual
 
         info = (r.json() or {}).get("info", "").lower()
@@ -180,6 +196,7 @@ def _cadastrar_somente_aluno(
 
     raise RuntimeError("Falha ao cadastrar o aluno")
 
+@etapa("om_matricula")
 def _matricular_aluno_om(aluno_id: str, cursos_ids: List[int], token_key: str) -> bool:
     """
     Efetua a matrícula (vincula disciplinas) para o aluno já cadastrado.
@@ -199,6 +216,8 @@ def _matricular_aluno_om(aluno_id: str, cursos_ids: List[int], token_key: str) -
         timeout=10
     )
     sucesso = r.ok and r.json().get("status") == "true"
+    if sucesso:
+        alunos.invalidar_progresso(aluno_id)
     _log(f"[MAT] {'✅' if sucesso else '❌'} Status {r.status_code} | Retorno OM: {r.text}")
     return sucesso
 
@@ -210,6 +229,7 @@ def _cadastrar_aluno_om(
     token_key: str,
     senha_padrao: str = "1234567",
     cpf: Optional[str] = None,
+    unidade: Optional[str] = None,
 ) -> Tuple[str, str]:
     """
     Cadastra aluno e, se houver cursos_ids, matricula nas disciplinas.
@@ -217,7 +237,7 @@ def _cadastrar_aluno_om(
     """
     # 1) Cadastro básico do aluno
     aluno_id, cpf_result = _cadastrar_somente_aluno(
-        nome, whatsapp, email, token_key, senha_padrao, cpf
+        nome, whatsapp, email, token_key, senha_padrao, cpf, unidade
     )
 
     # 2) Se houver cursos_ids, realiza a matrícula
@@ -269,35 +289,23 @@ def _send_whatsapp_chatpro(
         "Qualquer dúvida, estamos à disposição. Boa jornada de estudos! 🚀"
     )
 
-    # Envia a mensagem utilizando o novo endpoint
-    try:
-        r = requests.get(
-            WHATSAPP_URL,
-            params={"para": numero_telefone, "mensagem": mensagem},
-            timeout=10
-        )
-        if r.ok:
-            _log(f"[WHATSAPP] Mensagem enviada com sucesso para {numero_telefone}. Resposta: {r.text}")
+    # Enfileira a mensagem no enviador central
+    def _resultado(futuro):
+        erro = futuro.exception()
+        if erro:
+            _log(f"[WHATSAPP] Falha ao enviar mensagem para {numero_telefone}: {str(erro)}")
         else:
-            _log(f"[WHATSAPP] Falha ao enviar mensagem para {numero_telefone}. HTTP {r.status_code} | {r.text}")
-    except Exception as e:
-        _log(f"[WHATSAPP] Erro inesperado ao enviar WhatsApp para {numero_telefone}: {str(e)}")
+            _log(f"[WHATSAPP] Mensagem enviada com sucesso para {numero_telefone}. Resposta: {futuro.result().text}")
+
+    notificacoes.ao_concluir(
+        notificacoes.enviar_whatsapp(numero_telefone, mensagem, "matricula"), _resultado
+    )
 
 def _send_whatsapp_log(mensagem: str) -> None:
     """Envia mensagem de log para o WhatsApp, exceto para renovação de token."""
     if "Token de unidade atualizado" in mensagem:
         return
-    numero = formatar_numero_whatsapp(WHATSAPP_LOG_NUM)
-    if not numero:
-        return
-    try:
-        requests.get(
-            WHATSAPP_URL,
-            params={"para": numero, "mensagem": mensagem},
-            timeout=10,
-        )
-    except Exception as e:
-        _log(f"[WHATSAPP-LOG] Erro ao enviar log: {str(e)}")
+    notificacoes.enviar_whatsapp(WHATSAPP_LOG_NUM, mensagem, "log-matricula")
 
 def _send_discord_log(
     nome: str,
@@ -337,11 +345,12 @@ def _send_discord_log(
     _send_whatsapp_log(mensagem_discord)
 
     try:
-        r = requests.post(
-            DISCORD_WEBHOOK_URL,
-            json=payload,
-            timeout=10
-        )
+        with etapa("discord"):
+            r = requests.post(
+                DISCORD_WEBHOOK_URL,
+                json=payload,
+                timeout=10
+            )
         if r.ok:
             _log(f"[DISCORD] Log enviado com sucesso. Resposta: {r.text}")
         else:
@@ -359,6 +368,7 @@ async def realizar_matricula(dados: dict):
       - cursos: List[str] (opcional, nomes dos cursos conforme mapeamento em cursos.py)
       - cursos_ids: List[int] (opcional, IDs diretos, caso queira forçar)
       - fatura_url: str (opcional, link da fatura)
+      - unidade: str (opcional, id da unidade OM; padrão UNIDADE_ID)
     """
     nome = dados.get("nome")
     whatsapp = dados.get("whatsapp")
@@ -367,12 +377,20 @@ async def realizar_matricula(dados: dict):
     cursos_ids_input = dados.get("cursos_ids") or []
     fatura_url = dados.get("fatura_url") or dados.get("invoice_url")
     cpf = dados.get("cpf")
+    unidade = unidades.resolver(dados.get("unidade") or dados.get("unidade_id"))
 
     if not nome or not whatsapp:
         raise HTTPException(
             status_code=400,
             detail="Dados incompletos: 'nome' e 'whatsapp' são obrigatórios."
         )
+    if cpf:
+        cpf = normalizacao.cpf(cpf)
+        # CPFs gerados pela própria API (CPF_PREFIXO) não têm dígitos verificadores
+        if not (normalizacao.documento_valido(cpf) or cpf.startswith(CPF_PREFIXO)):
+            raise HTTPException(status_code=400, detail="CPF inválido.")
+    # O WhatsApp sai ao final do cadastro: acorda o gateway desde já
+    notificacoes.esperar_envios()
 
     cursos_ids: List[int] = []
     if cursos_ids_input:
@@ -390,16 +408,18 @@ async def realizar_matricula(dados: dict):
             cursos_ids.extend(CURSOS_OM[chave])
 
     try:
-        if cpf and _cpf_em_uso(cpf):
+        if cpf and _cpf_em_uso(cpf, unidade):
             _log(f"[MAT] CPF {cpf} já cadastrado. Pulando matrícula.")
             return {"status": "ja_matriculado", "cpf": cpf}
 
         # 1) obtém token da unidade OM
-        token_unit = _obter_token_unidade()
+        token_unit = _obter_token_unidade(unidade)
 
-        # 2) cadastra aluno e matricula
-        aluno_id, cpf = _cadastrar_aluno_om(
-            nome, whatsapp, email, cursos_ids, token_unit, cpf=cpf
+        # 2) cadastra aluno e matricula (em thread: a geração de CPF espera um
+        # lock compartilhado e não pode travar o laço de eventos)
+        aluno_id, cpf = await asyncio.to_thread(
+            _cadastrar_aluno_om,
+            nome, whatsapp, email, cursos_ids, token_unit, cpf=cpf, unidade=unidade,
         )
 
         # 3) envia mensagem automática no WhatsApp via ChatPro (agora com login e senha)
@@ -413,6 +433,7 @@ async def realizar_matricula(dados: dict):
             "status": "ok",
             "aluno_id": aluno_id,
             "cpf": cpf,
+            "unidade": unidade,
             "disciplinas_matriculadas": cursos_ids,
         }
 
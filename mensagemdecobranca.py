@@ -8,24 +8,30 @@ vencimento da fatura.
 
 import logging
 import os
-from datetime import date, datetime
+from concurrent.futures import Future, wait
+from datetime import date, datetime, timedelta
 
 import requests
 from fastapi import APIRouter, HTTPException
 
-from utils import formatar_numero_whatsapp
+import estado
+import notificacoes
+import pagamentos
+from cache import chamada_unica
 
 router = APIRouter(prefix="/mensagem-cobranca", tags=["Cobrança"])
 
 ASAAS_KEY = os.getenv("ASAAS_KEY")
 ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://api.asaas.com/v3")
-WHATSAPP_URL = "https://whatsapptest-stij.onrender.com/send"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-CACHE_CLIENTES: dict[str, tuple[str | None, str | None]] = {}
+# Nome e telefone dos clientes, compartilhados entre os workers
+CACHE_CLIENTES = estado.CacheCompartilhado(
+    "cobranca_cliente", float(os.getenv("COBRANCA_CACHE_TTL", "86400"))
+)
 
 
 def _headers() -> dict:
@@ -34,9 +40,11 @@ def _headers() -> dict:
     return {"Content-Type": "application/json", "access_token": ASAAS_KEY}
 
 
+@chamada_unica("asaas_cliente_cobranca")
 def _obter_cliente(cid: str) -> tuple[str | None, str | None]:
-    if cid in CACHE_CLIENTES:
-        return CACHE_CLIENTES[cid]
+    cached = CACHE_CLIENTES.get(cid)
+    if cached is not None:
+        return tuple(cached)
     try:
         resp = requests.get(
             f"{ASAAS_BASE_URL}/customers/{cid}", headers=_headers(), timeout=10
@@ -45,30 +53,26 @@ def _obter_cliente(cid: str) -> tuple[str | None, str | None]:
             data = resp.json()
             nome = data.get("name")
             telefone = data.get("mobilePhone") or data.get("phone")
-            CACHE_CLIENTES[cid] = (nome, telefone)
+            CACHE_CLIENTES.set(cid, [nome, telefone])
             return nome, telefone
     except requests.RequestException as e:
         logger.exception("Erro ao obter cliente %s: %s", cid, e)
     return None, None
 
 
-def _enviar_whatsapp(numero: str, mensagem: str) -> None:
-    if not numero:
-        return
-    try:
-        r = requests.get(
-            WHATSAPP_URL,
-            params={"para": formatar_numero_whatsapp(numero), "mensagem": mensagem},
-            timeout=10,
-        )
-        r.raise_for_status()
-        logger.info("Mensagem enviada para %s", numero)
-    except Exception:
-        logger.exception("Erro ao enviar WhatsApp para %s", numero)
+def _enviar_whatsapp(numero: str, mensagem: str) -> Future | None:
+    return notificacoes.enviar_whatsapp(numero, mensagem, "cobranca")
+
+
+def _listar_pagamentos_pendentes(vencimentos: list[str]) -> list[dict]:
+    """Pagamentos pendentes; do livro local quando reconciliado, senão do ASAAS."""
+    if pagamentos.atualizado():
+        return pagamentos.listar(status="PENDING", vencimentos=vencimentos)
+    return _listar_pagamentos_pendentes_api()
 
 
-def _listar_pagamentos_pendentes() -> list[dict]:
-    pagamentos: list[dict] = []
+def _listar_pagamentos_pendentes_api() -> list[dict]:
+    pendentes: list[dict] = []
     offset = 0
     limit = 100
     while True:
@@ -83,12 +87,12 @@ def _listar_pagamentos_pendentes() -> list[dict]:
         except requests.RequestException as e:
             raise HTTPException(502, f"Erro ao listar pagamentos: {e}")
         data = resp.json()
-        pagamentos.extend(data.get("data") or [])
+        pendentes.extend(data.get("data") or [])
         if data.get("hasMore"):
             offset += limit
         else:
             break
-    return pagamentos
+    return pendentes
 
 
 _DEF_MSG = (
@@ -130,10 +134,25 @@ def _montar_mensagem(dias: int, nome: str, valor: float, vencimento: str, link:
 
 @router.post("")
 def enviar_mensagens():
-    """Envia mensagens de cobrança conforme a proximidade do vencimento."""
+    """Envia mensagens de cobrança conforme a proximidade do vencimento.
+
+    Usa o mesmo lock da tarefa agendada: disparos simultâneos não duplicam o envio.
+    """
+    try:
+        with estado.lock("tarefa:cobranca", ttl=3600, espera=0):
+            return executar_cobranca()
+    except TimeoutError:
+        raise HTTPException(409, "Cobrança já em andamento")
+
+
+def executar_cobranca() -> dict:
     hoje = date.today()
     enviados = []
-    for pagamento in _listar_pagamentos_pendentes():
+    futuros = []
+    # Acorda o gateway enquanto a lista de pagamentos é consultada
+    notificacoes.esperar_envios()
+    vencimentos = [(hoje + timedelta(days=d)).isoformat() for d in (0, 1, 7)]
+    for pagamento in _listar_pagamentos_pendentes(vencimentos):
         venc = pagamento.get("dueDate")
         if not venc:
             continue
@@ -155,6 +174,11 @@ def enviar_mensagens():
             or ""
         )
         mensagem = _montar_mensagem(dias, nome, pagamento.get("value", 0), venc, link)
-        _enviar_whatsapp(telefone, mensagem)
+        futuros.append(_enviar_whatsapp(telefone, mensagem))
         enviados.append({"cliente": nome, "dias": dias, "vencimento": venc})
+
+    # As mensagens seguem em paralelo pelo enviador central; aguarda o lote
+    wait([f for f in futuros if f is not None])
+    for item, futuro in zip(enviados, futuros):
+        item["entregue"] = futuro is not None and futuro.exception() is None
     return {"enviados": enviados}
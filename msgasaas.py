@@ -8,13 +8,13 @@ from datetime import date
 import requests
 from fastapi import APIRouter, HTTPException
 
-from utils import formatar_numero_whatsapp
+import notificacoes
+from serializacao import RotaJSON
 
-router = APIRouter(prefix="/msgasaas", tags=["Mensagem ASAAS"])
+router = APIRouter(prefix="/msgasaas", tags=["Mensagem ASAAS"], route_class=RotaJSON)
 
 ASAAS_KEY = os.getenv("ASAAS_KEY")
 ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://api.asaas.com/v3")
-WHATSAPP_URL = "https://whatsapptest-stij.onrender.com/send"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -61,16 +61,7 @@ def _enviar_whatsapp(nome: str, phone: str, url: str) -> None:
         f"Segue o link para pagamento do seu curso: {url}\n\n"
         "Qualquer dúvida estamos à disposição."
     )
-    try:
-        r = requests.get(
-            WHATSAPP_URL,
-            params={"para": formatar_numero_whatsapp(phone), "mensagem": mensagem},
-            timeout=10,
-        )
-        r.raise_for_status()
-        logger.info("Mensagem enviada para %s", phone)
-    except Exception:
-        logger.exception("Erro ao enviar mensagem via WhatsApp")
+    notificacoes.enviar_whatsapp(phone, mensagem, "fatura")
 
 
 @router.post("")
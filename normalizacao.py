@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Normalização e validação de telefones, CPFs e CNPJs.
+
+Todas as funções de item único são memoizadas (``NORMALIZACAO_CACHE``
+entradas): os mesmos números aparecem em vários fluxos (matrícula, cobrança,
+WhatsApp) e a validação com ``phonenumbers`` é cara. As versões em lote
+(``telefones``, ``cpfs``) removem repetições antes de normalizar, para as
+rotinas que processam milhares de registros.
+
+A validação de CPF/CNPJ é local (dígitos verificadores): documentos inválidos
+são recusados antes de qualquer chamada à OM ou ao ASAAS.
+"""
+
+import functools
+import os
+from typing import Iterable
+
+import phonenumbers
+
+NORMALIZACAO_CACHE = int(os.getenv("NORMALIZACAO_CACHE", "100000"))
+
+_memo = functools.lru_cache(maxsize=NORMALIZACAO_CACHE)
+
+
+def _digitos(valor) -> str:
+    return "".join(filter(str.isdigit, str(valor or "")))
+
+
+# ──────────────────────────────────────────────────────────
+# Telefones
+# ──────────────────────────────────────────────────────────
+@_memo
+def telefone(numero: str | None) -> str:
+    """Telefone no formato usado no WhatsApp: ``55`` + DDD + 8 dígitos.
+
+    Remove caracteres não numéricos, o prefixo ``55`` já presente e o nono
+    dígito logo após o DDD.
+    """
+    digitos = _digitos(numero)
+    if digitos.startswith("55"):
+        digitos = digitos[2:]
+    if len(digitos) >= 11 and digitos[2] == "9":
+        digitos = digitos[:2] + digitos[3:]
+    return "55" + digitos
+
+
+@_memo
+def telefone_valido(numero: str | None) -> str | None:
+    """``telefone(numero)`` se for um número válido (``phonenumbers``), senão ``None``.
+
+    A validação usa os dígitos originais, com o nono dígito: sem ele nenhum
+    celular brasileiro atual é válido. Números já no formato do WhatsApp
+    (celular sem o nono dígito) são conferidos com o nono dígito de volta.
+    """
+    digitos = _digitos(numero)
+    nacional = digitos[2:] if digitos.startswith("55") and len(digitos) >= 12 else digitos
+    candidatos = [nacional]
+    if len(nacional) == 10 and nacional[2] in "6789":
+        candidatos.append(nacional[:2] + "9" + nacional[2:])
+    for candidato in candidatos:
+        try:
+            p = phonenumbers.parse("+55" + candidato, None)
+        except phonenumbers.NumberParseException:
+            continue
+        if phonenumbers.is_valid_number(p):
+            return telefone(numero)
+    return None
+
+
+def telefones(numeros: Iterable[str | None], validar: bool = False) -> list[str | None]:
+    """Normaliza vários telefones de uma vez, na mesma ordem da entrada."""
+    numeros = list(numeros)
+    funcao = telefone_valido if validar else telefone
+    unicos = {n: funcao(n) for n in set(numeros)}
+    return [unicos[n] for n in numeros]
+
+
+# ──────────────────────────────────────────────────────────
+# CPF / CNPJ
+# ──────────────────────────────────────────────────────────
+def _digito_verificador(digitos: str, pesos: range | list[int]) -> str:
+    resto = sum(int(d) * p for d, p in zip(digitos, pesos)) % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+
+@_memo
+def cpf(valor: str | None) -> str:
+    """Apenas os dígitos do CPF (``"123.456.789-09"`` -> ``"12345678909"``)."""
+    return _digitos(valor)
+
+
+@_memo
+def cpf_valido(valor: str | None) -> bool:
+    """Confere tamanho e dígitos verificadores do CPF."""
+    d = cpf(valor)
+    if len(d) != 11 or d == d[0] * 11:
+        return False
+    return (
+        _digito_verificador(d[:9], range(10, 1, -1)) == d[9]
+        and _digito_verificador(d[:10], range(11, 1, -1)) == d[10]
+    )
+
+
+_PESOS_CNPJ = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+
+
+@_memo
+def cnpj_valido(valor: str | None) -> bool:
+    """Confere tamanho e dígitos verificadores do CNPJ."""
+    d = _digitos(valor)
+    if len(d) != 14 or d == d[0] * 14:
+        return False
+    return (
+        _digito_verificador(d[:12], _PESOS_CNPJ) == d[12]
+        and _digito_verificador(d[:13], [6] + _PESOS_CNPJ) == d[13]
+    )
+
+
+def documento_valido(valor: str | None) -> bool:
+    """CPF ou CNPJ válido (o ASAAS aceita os dois em ``cpfCnpj``)."""
+    return cpf_valido(valor) or cnpj_valido(valor)
+
+
+def cpfs(valores: Iterable[str | None]) -> list[str | None]:
+    """CPFs normalizados em lote; ``None`` para os inválidos."""
+    valores = list(valores)
+    unicos = {v: (cpf(v) if cpf_valido(v) else None) for v in set(valores)}
+    return [unicos[v] for v in valores]
@@ -0,0 +1,718 @@
+# -*- coding: utf-8 -*-
+"""Envio centralizado de mensagens pelo gateway de WhatsApp.
+
+Todos os módulos enfileiram suas mensagens aqui em vez de chamar o gateway
+diretamente. Um balde de fichas (``WHATSAPP_TAXA`` mensagens por segundo, com
+rajada de ``WHATSAPP_RAJADA``) limita o ritmo global e ``WHATSAPP_FAIXAS``
+threads enviam em paralelo. Cada destinatário é sempre atendido pela mesma
+faixa, o que preserva a ordem das mensagens de uma mesma pessoa.
+
+Antes de entrar na faixa, as mensagens de um destinatário ficam retidas por
+``WHATSAPP_JANELA_AGRUPAMENTO`` segundos: textos repetidos ou equivalentes (que
+trazem o mesmo link) são descartados e o restante segue em um único envio.
+
+A entrega passa pelo ``Gateway``, que conhece os canais disponíveis
+(``WHATSAPP_CANAIS``: gateway HTTP e sessão wppconnect), mede latência e falhas
+de cada um e usa sempre o mais rápido entre os saudáveis, passando para o
+próximo quando um envio falha sem chegar ao canal. Se o canal pode ter recebido
+a mensagem (timeout de leitura, conexão perdida após o envio), o erro é
+repassado: reenviar por outro canal duplicaria a mensagem.
+
+O gateway HTTP hiberna quando fica ocioso (Render). Enquanto há envios
+previstos, um aquecedor o mantém acordado e o acorda antes da primeira mensagem
+após um período parado; o timeout de cada envio se adapta à latência medida com
+a instância acordada e ao tempo de partida a frio.
+"""
+
+import abc
+import logging
+import os
+import heapq
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+from fastapi import APIRouter
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib.parse import urlsplit
+
+import estado
+from utils import formatar_numero_whatsapp
+
+router = APIRouter(prefix="/notificacoes", tags=["Notificações"])
+
+WHATSAPP_URL = os.getenv("WHATSAPP_URL", "https://whatsapptest-stij.onrender.com/send")
+WHATSAPP_TAXA = float(os.getenv("WHATSAPP_TAXA", "5"))
+WHATSAPP_RAJADA = int(os.getenv("WHATSAPP_RAJADA", "5"))
+WHATSAPP_FAIXAS = int(os.getenv("WHATSAPP_FAIXAS", "4"))
+WHATSAPP_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", "10"))
+WHATSAPP_JANELA_AGRUPAMENTO = float(os.getenv("WHATSAPP_JANELA_AGRUPAMENTO", "3"))
+# Canais em ordem de preferência (usada enquanto ainda não há medições)
+WHATSAPP_CANAIS = os.getenv("WHATSAPP_CANAIS", "http,wpp")
+# "post" envia a mensagem no corpo JSON; "get" mantém a query string antiga
+WHATSAPP_METODO = os.getenv("WHATSAPP_METODO", "post").lower()
+# Falhas seguidas que tiram um canal de uso por WHATSAPP_PAUSA_CANAL segundos
+WHATSAPP_FALHAS_CANAL = int(os.getenv("WHATSAPP_FALHAS_CANAL", "3"))
+WHATSAPP_PAUSA_CANAL = float(os.getenv("WHATSAPP_PAUSA_CANAL", "60"))
+# Sem contato com o gateway por mais que isso, consideramos a instância dormindo
+WHATSAPP_OCIOSO_S = float(os.getenv("WHATSAPP_OCIOSO_S", "600"))
+# Timeout mínimo com a instância acordada e limite enquanto ela ainda está acordando
+WHATSAPP_TIMEOUT_MIN = float(os.getenv("WHATSAPP_TIMEOUT_MIN", "5"))
+WHATSAPP_TIMEOUT_FRIO = float(os.getenv("WHATSAPP_TIMEOUT_FRIO", "60"))
+# Por quanto tempo após um envio (ou aviso de envio) o gateway é mantido acordado
+WHATSAPP_AQUECER_JANELA = float(os.getenv("WHATSAPP_AQUECER_JANELA", "1800"))
+WHATSAPP_PING_INTERVALO = float(os.getenv("WHATSAPP_PING_INTERVALO", "240"))
+WHATSAPP_PING_URL = os.getenv("WHATSAPP_PING_URL", "")
+
+_SEPARADOR = "\n\n➖➖➖\n\n"
+
+logger = logging.getLogger(__name__)
+
+
+class BaldeDeFichas:
+    """Limitador de taxa do tipo *token bucket*, seguro entre threads."""
+
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa = taxa
+        self.capacidade = max(1, capacidade)
+        self._fichas = float(self.capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumir(self) -> None:
+        """Bloqueia até haver uma ficha disponível e a consome."""
+        if self.taxa <= 0:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(
+                    self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa
+                )
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.taxa
+            time.sleep(espera)
+
+
+def _normalizar_texto(texto: str) -> str:
+    return " ".join(texto.split()).lower()
+
+
+def mesclar_mensagens(mensagens: list[str]) -> str:
+    """Une as mensagens de um destinatário descartando repetições.
+
+    Apenas textos idênticos (ignorando espaços e caixa) são unidos, mantendo a
+    primeira ocorrência; mensagens diferentes seguem todas, mesmo que
+    compartilhem links (ex.: boas-vindas de dois alunos com logins distintos).
+    """
+    vistos, mantidos = set(), []
+    for texto in mensagens:
+        if not texto or not texto.strip():
+            continue
+        norm = _normalizar_texto(texto)
+        if norm in vistos:
+            continue
+        vistos.add(norm)
+        mantidos.append(texto.strip())
+    return _SEPARADOR.join(mantidos)
+
+
+@dataclass
+class Entrega:
+    """Resultado de um envio bem-sucedido."""
+
+    canal: str
+    text: str
+    latencia_ms: float
+
+
+class Canal(abc.ABC):
+    """Canal de entrega com medição de saúde e latência (média móvel)."""
+
+    nome = ""
+
+    def __init__(self):
+        self.latencia_ms: float | None = None
+        self.falhas_seguidas = 0
+        self.pausado_ate = 0.0
+        self.enviados = 0
+        self.falhas = 0
+        self._lock = threading.Lock()
+
+    def disponivel(self) -> bool:
+        return True
+
+    def frio(self) -> bool:
+        """Indica se o canal pode estar hibernando."""
+        return False
+
+    def aquecer(self, ocioso_por: float = 0.0) -> None:
+        """Acorda o canal, se ele hiberna quando ocioso."""
+
+    def saudavel(self) -> bool:
+        return self.pausado_ate <= time.monotonic()
+
+    @abc.abstractmethod
+    def _enviar(self, numero: str, mensagem: str) -> str:
+        """Entrega a mensagem e retorna a resposta do canal."""
+
+    def enviar(self, numero: str, mensagem: str) -> Entrega:
+        inicio = time.perf_counter()
+        try:
+            texto = self._enviar(numero, mensagem)
+        except Exception:
+            with self._lock:
+                self.falhas += 1
+                self.falhas_seguidas += 1
+                if self.falhas_seguidas >= WHATSAPP_FALHAS_CANAL:
+                    self.pausado_ate = time.monotonic() + WHATSAPP_PAUSA_CANAL
+            raise
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.enviados += 1
+            self.falhas_seguidas = 0
+            self.pausado_ate = 0.0
+            self.latencia_ms = ms if self.latencia_ms is None else 0.8 * self.latencia_ms + 0.2 * ms
+        return Entrega(self.nome, texto, round(ms, 1))
+
+    def estatisticas(self) -> dict:
+        return {
+            "disponivel": self.disponivel(),
+            "saudavel": self.saudavel(),
+            "latencia_ms": None if self.latencia_ms is None else round(self.latencia_ms, 1),
+            "enviados": self.enviados,
+            "falhas": self.falhas,
+        }
+
+
+class CanalHTTP(Canal):
+    """Gateway HTTP, com conexões reaproveitadas entre as faixas.
+
+    O timeout de cada chamada é adaptativo: com a instância acordada, algumas
+    vezes a latência típica (limitado a ``timeout``); após um período ocioso,
+    o tempo de partida a frio já observado (limitado a ``WHATSAPP_TIMEOUT_FRIO``,
+    que também é o valor usado enquanto não há medição).
+    """
+
+    nome = "http"
+
+    def __init__(self, url: str, timeout: float, metodo: str = "post", conexoes: int = 4):
+        super().__init__()
+        self.url = url
+        self.timeout = timeout
+        self.metodo = metodo
+        self.ping_url = WHATSAPP_PING_URL or self._raiz(url)
+        self.partida_fria_ms: float | None = None
+        self._ultimo_contato: float | None = None
+        self._aquecendo = threading.Lock()
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, conexoes))
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+
+    @staticmethod
+    def _raiz(url: str) -> str:
+        partes = urlsplit(url or "")
+        return f"{partes.scheme}://{partes.netloc}/" if partes.netloc else ""
+
+    def disponivel(self) -> bool:
+        return bool(self.url)
+
+    def frio(self) -> bool:
+        return (
+            self._ultimo_contato is None
+            or time.monotonic() - self._ultimo_contato > WHATSAPP_OCIOSO_S
+        )
+
+    def timeout_atual(self) -> float:
+        if self.frio():
+            if self.partida_fria_ms is None:
+                return WHATSAPP_TIMEOUT_FRIO
+            fria = 1.5 * self.partida_fria_ms / 1000
+            return min(WHATSAPP_TIMEOUT_FRIO, max(self.timeout, fria))
+        if self.latencia_ms is None:
+            return self.timeout
+        return min(self.timeout, max(WHATSAPP_TIMEOUT_MIN, 4 * self.latencia_ms / 1000))
+
+    def _chamar(self, funcao, *args, **kwargs) -> requests.Response:
+        """Executa a chamada registrando o contato e, se frio, a partida a frio."""
+        frio = self.frio()
+        inicio = time.perf_counter()
+        try:
+            r = funcao(*args, timeout=self.timeout_atual(), **kwargs)
+        except requests.Timeout:
+            if frio:
+                # A instância ainda não acordou: a partida leva pelo menos isso
+                ms = (time.perf_counter() - inicio) * 1000
+                with self._lock:
+                    self.partida_fria_ms = max(self.partida_fria_ms or 0.0, ms)
+            raise
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self._ultimo_contato = time.monotonic()
+            if frio:
+                self.partida_fria_ms = (
+                    ms if self.partida_fria_ms is None else 0.5 * self.partida_fria_ms + 0.5 * ms
+                )
+        return r
+
+    def aquecer(self, ocioso_por: float = 0.0) -> None:
+        """Faz um GET leve na raiz do gateway; qualquer resposta indica acordado.
+
+        Com ``ocioso_por``, só pinga se não houve contato nesse intervalo.
+        """
+        ultimo = self._ultimo_contato
+        if ultimo is not None and time.monotonic() - ultimo < ocioso_por:
+            return
+        if not self.ping_url or not self._aquecendo.acquire(blocking=False):
+            return
+        try:
+            self._chamar(self.sessao.get, self.ping_url)
+        except requests.RequestException as e:
+            logger.info("Gateway de WhatsApp não respondeu ao aquecimento: %s", e)
+        finally:
+            self._aquecendo.release()
+
+    def enviar(self, numero: str, mensagem: str) -> Entrega:
+        # Se a instância está sendo acordada, espera o aquecimento terminar
+        with self._aquecendo:
+            pass
+        return super().enviar(numero, mensagem)
+
+    def _enviar(self, numero: str, mensagem: str) -> str:
+        dados = {"para": numero, "mensagem": mensagem}
+        if self.metodo == "get":
+            r = self._chamar(self.sessao.get, self.url, params=dados)
+        else:
+            r = self._chamar(self.sessao.post, self.url, json=dados)
+        r.raise_for_status()
+        return r.text
+
+    def estatisticas(self) -> dict:
+        return {
+            **super().estatisticas(),
+            "frio": self.frio(),
+            "timeout_s": round(self.timeout_atual(), 1),
+            "partida_fria_ms": None if self.partida_fria_ms is None else round(self.partida_fria_ms, 1),
+        }
+
+
+class CanalWpp(Canal):
+    """Sessão wppconnect mantida por ``app.whatsapp``.
+
+    A mensagem entra na fila única de ``app.whatsapp`` (a mesma de
+    ``POST /whatsapp``) e o canal espera sua conclusão por até ``timeout``
+    segundos. Se ao fim do prazo ela ainda não começou a ser enviada, é
+    cancelada e pode seguir por outro canal; se já estava em envio, o resultado
+    é incerto (``TimeoutError``).
+    """
+
+    nome = "wpp"
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def _sessao(self):
+        from app import whatsapp  # evita import circular (app.whatsapp usa este módulo)
+
+        return whatsapp
+
+    def disponivel(self) -> bool:
+        whatsapp = self._sessao()
+        return whatsapp.wpp is not None and whatsapp.obter_status()["state"] == "ready"
+
+    def _enviar(self, numero: str, mensagem: str) -> str:
+        whatsapp = self._sessao()
+        chat_id = whatsapp._chat_id(numero)
+        if not chat_id:
+            raise ValueError(f"Número inválido para o WhatsApp: {numero}")
+        try:
+            mid = whatsapp.enfileirar(chat_id, mensagem, aguardar=True)
+        except queue.Full:
+            raise RuntimeError("Fila da sessão wppconnect cheia") from None
+        situacao = whatsapp.aguardar_envio(mid, self.timeout)
+        if situacao["status"] == "enviado":
+            return mid
+        if situacao["status"] == "enviando":
+            raise TimeoutError(f"Envio {mid} pela sessão wppconnect sem confirmação")
+        raise RuntimeError(
+            f"Envio {mid} pela sessão wppconnect: {situacao['status']} ({situacao.get('erro')})"
+        )
+
+
+def entrega_incerta(erro: Exception) -> bool:
+    """Indica se o canal pode ter recebido a mensagem apesar do erro.
+
+    Timeout de leitura ou conexão perdida depois do envio: a mensagem pode ter
+    saído. Falhas ao conectar e respostas de erro do canal não entregaram nada.
+    """
+    if isinstance(erro, (requests.ReadTimeout, TimeoutError)):
+        return True
+    if isinstance(erro, requests.ConnectionError) and not isinstance(erro, requests.ConnectTimeout):
+        motivo = getattr(erro.args[0] if erro.args else None, "reason", None)
+        return not isinstance(motivo, NewConnectionError)
+    return False
+
+
+class Gateway:
+    """Escolhe o canal de entrega pela saúde e latência medidas."""
+
+    def __init__(self, canais: list[Canal]):
+        self.canais = canais
+
+    def ordenados(self) -> list[Canal]:
+        """Canais disponíveis, saudáveis primeiro e, entre eles, os mais rápidos.
+
+        Canais ainda sem medição são tentados na ordem de preferência, antes
+        dos já medidos, para que todos passem a ter latência conhecida.
+        """
+        disponiveis = [c for c in self.canais if c.disponivel()]
+        preferencia = {id(c): i for i, c in enumerate(self.canais)}
+        return sorted(
+            disponiveis,
+            key=lambda c: (
+                not c.saudavel(),
+                c.latencia_ms is not None,
+                c.latencia_ms or 0.0,
+                preferencia[id(c)],
+            ),
+        )
+
+    def enviar(self, numero: str, mensagem: str) -> Entrega:
+        erro: Exception | None = None
+        for canal in self.ordenados():
+            try:
+                return canal.enviar(numero, mensagem)
+            except Exception as e:
+                logger.warning("Canal %s falhou para %s: %s", canal.nome, numero, e)
+                if entrega_incerta(e):
+                    # Sem failover: o outro canal poderia entregar em duplicidade
+                    raise
+                erro = e
+        raise erro or RuntimeError("Nenhum canal de WhatsApp disponível")
+
+    def estatisticas(self) -> dict:
+        return {c.nome: c.estatisticas() for c in self.canais}
+
+
+class Aquecedor:
+    """Mantém os canais acordados apenas enquanto há envios previstos.
+
+    ``esperar(segundos)`` estende a janela de envios previstos e, se algum canal
+    estiver frio, dispara o aquecimento imediatamente (em segundo plano). Dentro
+    da janela, os canais são pingados a cada ``intervalo`` segundos; fora dela a
+    thread apenas dorme e o gateway pode hibernar.
+    """
+
+    def __init__(self, canais: list[Canal], intervalo: float):
+        self.canais = canais
+        self.intervalo = intervalo
+        self._ate = 0.0
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._aquecimento: threading.Thread | None = None
+
+    def esperar(self, segundos: float) -> None:
+        with self._cond:
+            self._ate = max(self._ate, time.monotonic() + segundos)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._executar, name="whatsapp-aquecedor", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+            # Chamadas simultâneas compartilham o aquecimento em andamento
+            em_andamento = self._aquecimento is not None and self._aquecimento.is_alive()
+            if not em_andamento and any(c.frio() for c in self.canais):
+                self._aquecimento = threading.Thread(
+                    target=self._aquecer_todos, name="whatsapp-aquecimento", daemon=True
+                )
+                self._aquecimento.start()
+
+    def _aquecer_todos(self, ocioso_por: float = 0.0) -> None:
+        for canal in self.canais:
+            canal.aquecer(ocioso_por)
+
+    def _executar(self) -> None:
+        while True:
+            with self._cond:
+                while self._ate <= time.monotonic():
+                    self._cond.wait()
+            self._aquecer_todos(self.intervalo)
+            time.sleep(self.intervalo)
+
+
+def _criar_canais(url: str, timeout: float, conexoes: int) -> list[Canal]:
+    fabricas = {
+        "http": lambda: CanalHTTP(url, timeout, WHATSAPP_METODO, conexoes),
+        "wpp": lambda: CanalWpp(timeout),
+    }
+    canais = []
+    for nome in WHATSAPP_CANAIS.split(","):
+        nome = nome.strip()
+        if nome in fabricas:
+            canais.append(fabricas[nome]())
+        elif nome:
+            logger.warning("Canal de WhatsApp desconhecido: %s", nome)
+    return canais
+
+
+@dataclass
+class Envio:
+    numero: str
+    mensagem: str
+    origem: str = ""
+    futuro: Future = field(default_factory=Future)
+    criado: float = field(default_factory=time.monotonic)
+
+
+class EnviadorWhatsApp:
+    """Fila com faixas paralelas e ritmo controlado para o ``Gateway``."""
+
+    def __init__(
+        self,
+        url: str,
+        taxa: float,
+        rajada: int,
+        faixas: int,
+        timeout: float,
+        janela: float = 0.0,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.janela = janela
+        self.gateway = Gateway(_criar_canais(url, timeout, faixas))
+        self.aquecedor = Aquecedor(self.gateway.canais, WHATSAPP_PING_INTERVALO)
+        self._grupos: dict[str, list[Envio]] = {}
+        self._prazos: list[tuple[float, str]] = []
+        # Mensagens já retiradas de _grupos que ainda não chegaram a uma faixa
+        self._em_transito = 0
+        self._cond = threading.Condition()
+        self.balde = BaldeDeFichas(taxa, rajada)
+        self.faixas = max(1, faixas)
+        self._filas = [queue.Queue() for _ in range(self.faixas)]
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._concluidos: deque[float] = deque()
+        self._stats = {"enfileirados": 0, "enviados": 0, "falhas": 0, "agrupadas": 0}
+        self._primeiro: float | None = None
+        self._ultimo: float | None = None
+
+    # ── ciclo de vida ────────────────────────────────
+    def _iniciar(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i, fila in enumerate(self._filas):
+                t = threading.Thread(
+                    target=self._trabalhar, args=(fila,), name=f"whatsapp-faixa-{i}", daemon=True
+                )
+                t.start()
+                self._threads.append(t)
+            if self.janela > 0:
+                t = threading.Thread(target=self._agrupar, name="whatsapp-agrupador", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _faixa(self, numero: str) -> queue.Queue:
+        return self._filas[zlib.crc32(numero.encode()) % self.faixas]
+
+    # ── envio ────────────────────────────────────────
+    def enviar(self, numero: str, mensagem: str, origem: str = "") -> Future:
+        """Enfileira a mensagem e retorna um ``Future`` com a resposta do gateway."""
+        envio = Envio(formatar_numero_whatsapp(numero), mensagem, origem)
+        self._iniciar()
+        self.aquecedor.esperar(WHATSAPP_AQUECER_JANELA)
+        with self._lock:
+            self._stats["enfileirados"] += 1
+        estado.incr("whatsapp:enfileirados")
+        if self.janela <= 0:
+            self._faixa(envio.numero).put(envio)
+            return envio.futuro
+        with self._cond:
+            grupo = self._grupos.get(envio.numero)
+            if grupo is None:
+                self._grupos[envio.numero] = [envio]
+                heapq.heappush(self._prazos, (time.monotonic() + self.janela, envio.numero))
+                self._cond.notify()
+            else:
+                grupo.append(envio)
+        return envio.futuro
+
+    def _agrupar(self) -> None:
+        """Libera para as faixas os grupos cuja janela de espera terminou.
+
+        ``_combinar`` roda fora de ``_cond`` (ele usa ``_lock`` e grava no
+        estado compartilhado); ``_em_transito`` mantém o grupo visível para
+        ``pendentes()`` até ele entrar na faixa.
+        """
+        while True:
+            with self._cond:
+                while not self._prazos or self._prazos[0][0] > time.monotonic():
+                    espera = self._prazos[0][0] - time.monotonic() if self._prazos else None
+                    self._cond.wait(espera)
+                _, numero = heapq.heappop(self._prazos)
+                grupo = self._grupos.pop(numero, [])
+                self._em_transito += len(grupo)
+            if not grupo:
+                continue
+            try:
+                self._faixa(numero).put(self._combinar(grupo))
+            finally:
+                with self._cond:
+                    self._em_transito -= len(grupo)
+
+    def _combinar(self, grupo: list[Envio]) -> Envio:
+        """Transforma as mensagens retidas de um destinatário em um único envio."""
+        if len(grupo) == 1:
+            return grupo[0]
+        origens = ",".join(dict.fromkeys(e.origem for e in grupo if e.origem))
+        combinado = Envio(
+            grupo[0].numero,
+            mesclar_mensagens([e.mensagem for e in grupo]),
+            origens,
+            criado=grupo[0].criado,
+        )
+        with self._lock:
+            self._stats["agrupadas"] += len(grupo) - 1
+        estado.incr("whatsapp:agrupadas", len(grupo) - 1)
+
+        def _propagar(f: Future) -> None:
+            for e in grupo:
+                if f.exception():
+                    e.futuro.set_exception(f.exception())
+                else:
+                    e.futuro.set_result(f.result())
+
+        combinado.futuro.add_done_callback(_propagar)
+        logger.info(
+            "%s mensagens para %s agrupadas em um envio (%s)", len(grupo), combinado.numero, origens
+        )
+        return combinado
+
+    def _trabalhar(self, fila: queue.Queue) -> None:
+        while True:
+            envio = fila.get()
+            try:
+                self.balde.consumir()
+                self._despachar(envio)
+            finally:
+                fila.task_done()
+
+    def _despachar(self, envio: Envio) -> None:
+        try:
+            entrega = self.gateway.enviar(envio.numero, envio.mensagem)
+        except Exception as e:
+            self._registrar(False)
+            logger.warning(
+                "Falha ao enviar WhatsApp (%s) para %s: %s", envio.origem, envio.numero, e
+            )
+            envio.futuro.set_exception(e)
+            return
+        self._registrar(True)
+        logger.info(
+            "WhatsApp (%s) enviado para %s via %s em %s ms",
+            envio.origem, envio.numero, entrega.canal, entrega.latencia_ms,
+        )
+        envio.futuro.set_result(entrega)
+
+    def _registrar(self, sucesso: bool) -> None:
+        agora = time.monotonic()
+        chave = "enviados" if sucesso else "falhas"
+        estado.incr(f"whatsapp:{chave}")
+        with self._lock:
+            self._stats[chave] += 1
+            self._concluidos.append(agora)
+            while self._concluidos and self._concluidos[0] < agora - 60:
+                self._concluidos.popleft()
+            if self._primeiro is None:
+                self._primeiro = agora
+            self._ultimo = agora
+
+    # ── observabilidade ──────────────────────────────
+    def pendentes(self) -> int:
+        with self._cond:
+            retidas = sum(len(g) for g in self._grupos.values()) + self._em_transito
+        return retidas + sum(f.unfinished_tasks for f in self._filas)
+
+    def aguardar(self, timeout: float | None = None) -> bool:
+        """Espera as filas esvaziarem. Retorna ``False`` se o tempo acabar."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self.pendentes():
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def estatisticas(self) -> dict:
+        # pendentes() usa _cond: nunca é chamado com _lock adquirido
+        pendentes = self.pendentes()
+        agora = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            recentes = [t for t in self._concluidos if t >= agora - 60]
+            janela = (self._ultimo or 0) - (self._primeiro or 0)
+        concluidos = stats["enviados"] + stats["falhas"]
+        return {
+            **stats,
+            "pendentes": pendentes,
+            "faixas": self.faixas,
+            "taxa_configurada": self.balde.taxa,
+            "msgs_por_s_ultimo_minuto": round(len(recentes) / 60, 3),
+            "msgs_por_s_media": round(concluidos / janela, 3) if janela > 0 else None,
+            "canais": self.gateway.estatisticas(),
+            # Totais somando todos os workers desde a criação do estado
+            "todos_os_workers": {k: estado.contador(f"whatsapp:{k}") for k in stats},
+        }
+
+
+enviador = EnviadorWhatsApp(
+    WHATSAPP_URL,
+    WHATSAPP_TAXA,
+    WHATSAPP_RAJADA,
+    WHATSAPP_FAIXAS,
+    WHATSAPP_TIMEOUT,
+    WHATSAPP_JANELA_AGRUPAMENTO,
+)
+
+# Executa os callbacks de conclusão fora das faixas de envio
+_callbacks = ThreadPoolExecutor(max_workers=2, thread_name_prefix="whatsapp-callback")
+
+
+def enviar_whatsapp(numero: str, mensagem: str, origem: str = "") -> Future | None:
+    """Enfileira uma mensagem de WhatsApp; ignora números vazios."""
+    if not numero or not formatar_numero_whatsapp(numero).removeprefix("55"):
+        return None
+    return enviador.enviar(numero, mensagem, origem)
+
+
+def esperar_envios(segundos: float = WHATSAPP_AQUECER_JANELA) -> None:
+    """Avisa que mensagens devem sair em breve: acorda o gateway se preciso.
+
+    Chamado no início dos fluxos que terminam enviando WhatsApp (webhooks,
+    matrícula, cobrança), para que a partida a frio ocorra em paralelo ao
+    processamento e não no envio.
+    """
+    enviador.aquecedor.esperar(segundos)
+
+
+def ao_concluir(futuro: Future | None, funcao) -> None:
+    """Agenda ``funcao(futuro)`` para quando o envio terminar, sem ocupar a faixa."""
+    if futuro is not None:
+        futuro.add_done_callback(lambda f: _callbacks.submit(funcao, f))
+
+
+@router.get("/whatsapp", summary="Estatísticas do envio de WhatsApp")
+def estatisticas_whatsapp():
+    """Mensagens enfileiradas, agrupadas, enviadas, falhas e taxa alcançada."""
+    return enviador.estatisticas()
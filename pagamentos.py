@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""Livro-caixa local dos pagamentos do ASAAS.
+
+Todo evento recebido em ``/asaas/webhook`` (criado, alterado, vencido,
+recebido, estornado, removido…) é anexado à tabela ``eventos`` e projetado na
+tabela ``pagamentos``, indexada por pagamento, cliente, assinatura e
+vencimento. Eventos que chegam fora de ordem (``dateCreated`` anterior ao do
+último projetado) não sobrescrevem a projeção, e um pagamento quitado nunca
+volta a ficar em aberto, exceto por ``PAYMENT_RECEIVED_IN_CASH_UNDONE``. A reconciliação contra ``GET /payments`` (tarefa do ``agendador``)
+corrige eventos perdidos.
+
+Enquanto a última reconciliação tiver menos de ``PAGAMENTOS_VALIDADE_S``
+segundos, a cobrança e os relatórios leem daqui em vez de paginar a API.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import requests
+from fastapi import APIRouter, HTTPException
+
+import estado
+
+router = APIRouter(prefix="/pagamentos", tags=["Pagamentos"])
+
+ASAAS_KEY = os.getenv("ASAAS_KEY")
+ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://api.asaas.com/v3")
+
+PAGAMENTOS_DB = os.getenv("PAGAMENTOS_DB", "pagamentos.db")
+# Idade máxima da última reconciliação para que o livro seja usado nas consultas
+PAGAMENTOS_VALIDADE_S = float(os.getenv("PAGAMENTOS_VALIDADE_S", "86400"))
+
+_CHAVE_RECONCILIACAO = "pagamentos:ultima_reconciliacao"
+
+_QUITADOS = {"RECEIVED", "CONFIRMED", "RECEIVED_IN_CASH"}
+_EM_ABERTO = {"PENDING", "OVERDUE", "AWAITING_RISK_ANALYSIS"}
+# Único evento que desfaz legitimamente uma quitação
+_DESFAZ_QUITACAO = "PAYMENT_RECEIVED_IN_CASH_UNDONE"
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _con() -> sqlite3.Connection:
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(PAGAMENTOS_DB, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS eventos (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                evento_id TEXT UNIQUE,
+                evento TEXT NOT NULL,
+                pagamento_id TEXT,
+                recebido_em REAL NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS eventos_pagamento ON eventos (pagamento_id, seq);
+
+            CREATE TABLE IF NOT EXISTS pagamentos (
+                id TEXT PRIMARY KEY,
+                cliente TEXT,
+                assinatura TEXT,
+                status TEXT,
+                valor REAL,
+                vencimento TEXT,
+                removido INTEGER NOT NULL DEFAULT 0,
+                atualizado_em REAL NOT NULL,
+                dados TEXT NOT NULL,
+                evento_em TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pagamentos_cliente ON pagamentos (cliente);
+            CREATE INDEX IF NOT EXISTS pagamentos_assinatura ON pagamentos (assinatura);
+            CREATE INDEX IF NOT EXISTS pagamentos_vencimento ON pagamentos (vencimento, status);
+            """
+        )
+        colunas = {r["name"] for r in con.execute("PRAGMA table_info(pagamentos)")}
+        if "evento_em" not in colunas:  # livros criados antes da coluna
+            con.execute("ALTER TABLE pagamentos ADD COLUMN evento_em TEXT")
+        _local.con = con
+    return con
+
+
+def _projetar(
+    con: sqlite3.Connection,
+    pagamento: dict,
+    removido: bool = False,
+    evento: str = "",
+    evento_em: str | None = None,
+) -> bool:
+    """Atualiza a projeção do pagamento; ``False`` se o evento foi ignorado.
+
+    ``evento_em`` é o ``dateCreated`` do evento (``AAAA-MM-DD HH:MM:SS``). Um
+    evento mais antigo que o último projetado não sobrescreve a projeção.
+    """
+    removido = removido or bool(pagamento.get("deleted"))
+    atual = con.execute(
+        "SELECT status, evento_em FROM pagamentos WHERE id = ?", (pagamento["id"],)
+    ).fetchone()
+    if atual is not None:
+        if evento_em and atual["evento_em"] and evento_em < atual["evento_em"]:
+            return False
+        if (
+            not removido
+            and atual["status"] in _QUITADOS
+            and pagamento.get("status") in _EM_ABERTO
+            and evento != _DESFAZ_QUITACAO
+        ):
+            logger.warning(
+                "Pagamento %s quitado: %s com status %s ignorado",
+                pagamento["id"], evento or "evento", pagamento.get("status"),
+            )
+            return False
+        evento_em = max(filter(None, (evento_em, atual["evento_em"])), default=None)
+    con.execute(
+        """
+        INSERT INTO pagamentos
+            (id, cliente, assinatura, status, valor, vencimento, removido, atualizado_em, dados,
+             evento_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            cliente = excluded.cliente, assinatura = excluded.assinatura,
+            status = excluded.status, valor = excluded.valor,
+            vencimento = excluded.vencimento, removido = excluded.removido,
+            atualizado_em = excluded.atualizado_em, dados = excluded.dados,
+            evento_em = excluded.evento_em
+        """,
+        (
+            pagamento["id"],
+            pagamento.get("customer"),
+            pagamento.get("subscription"),
+            pagamento.get("status"),
+            pagamento.get("value"),
+            pagamento.get("dueDate"),
+            int(removido),
+            time.time(),
+            json.dumps(pagamento, ensure_ascii=False),
+            evento_em,
+        ),
+    )
+    return True
+
+
+def registrar_evento(evt: dict) -> bool:
+    """Anexa um evento do webhook ao livro e atualiza a projeção do pagamento.
+
+    Eventos repetidos (mesmo ``id``) são ignorados. Sem ``id``, o evento é
+    identificado pelo tipo, pelo pagamento e pelo conteúdo do pagamento, para
+    que duas alterações distintas com o mesmo status não se confundam. Retorna
+    ``True`` se o evento era novo.
+    """
+    pagamento = evt.get("payment") or {}
+    pagamento_id = pagamento.get("id")
+    evento_id = evt.get("id")
+    if not evento_id:
+        conteudo = json.dumps(pagamento, sort_keys=True, ensure_ascii=False).encode()
+        evento_id = f"{evt.get('event')}:{pagamento_id}:{hashlib.sha256(conteudo).hexdigest()[:16]}"
+    con = _con()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        cur = con.execute(
+            "INSERT OR IGNORE INTO eventos (evento_id, evento, pagamento_id, recebido_em, payload)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (evento_id, evt.get("event") or "", pagamento_id, time.time(),
+             json.dumps(evt, ensure_ascii=False)),
+        )
+        novo = cur.rowcount == 1
+        if novo and pagamento_id:
+            _projetar(
+                con,
+                pagamento,
+                removido=evt.get("event") == "PAYMENT_DELETED",
+                evento=evt.get("event") or "",
+                evento_em=evt.get("dateCreated"),
+            )
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return novo
+
+
+# ──────────────────────────────────────────────────────────
+# Reconciliação
+# ──────────────────────────────────────────────────────────
+def _paginar_pagamentos():
+    headers = {"Content-Type": "application/json", "access_token": ASAAS_KEY}
+    offset, limit = 0, 100
+    while True:
+        resp = requests.get(
+            f"{ASAAS_BASE_URL}/payments",
+            params={"limit": limit, "offset": offset},
+            headers=headers,
+            timeout=30,
+        )
+        resp.raise_for_status()
+        dados = resp.json()
+        yield from dados.get("data") or []
+        if not dados.get("hasMore"):
+            return
+        offset += limit
+
+
+def _consultar_pagamento(pagamento_id: str) -> dict | None:
+    """``GET /payments/{id}``; ``None`` se o ASAAS não conhece mais o pagamento."""
+    resp = requests.get(
+        f"{ASAAS_BASE_URL}/payments/{pagamento_id}",
+        headers={"Content-Type": "application/json", "access_token": ASAAS_KEY},
+        timeout=30,
+    )
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _corrigir(pagamento: dict, inicio: float) -> None:
+    registrar_evento(
+        {
+            "id": f"reconciliacao:{pagamento['id']}:{inicio:.0f}",
+            "event": "RECONCILIACAO",
+            "payment": pagamento,
+        }
+    )
+
+
+def reconciliar() -> dict:
+    """Confere o livro contra ``GET /payments`` e corrige divergências.
+
+    Cada divergência entra no livro como evento ``RECONCILIACAO``, preservando
+    o histórico de como o estado local foi corrigido. Pagamentos em aberto no
+    livro que não vieram na listagem são consultados um a um em
+    ``GET /payments/{id}``; os que o ASAAS não conhece mais (404) são marcados
+    como removidos.
+    """
+    if not ASAAS_KEY:
+        raise RuntimeError("ASAAS_KEY não configurada")
+    inicio = time.time()
+    lidos = corrigidos = removidos = 0
+    con = _con()
+    vistos = set()
+    for pagamento in _paginar_pagamentos():
+        lidos += 1
+        vistos.add(pagamento["id"])
+        row = con.execute(
+            "SELECT status, valor, vencimento, removido FROM pagamentos WHERE id = ?",
+            (pagamento["id"],),
+        ).fetchone()
+        atual = (
+            pagamento.get("status"),
+            pagamento.get("value"),
+            pagamento.get("dueDate"),
+            int(bool(pagamento.get("deleted"))),
+        )
+        if row is not None and tuple(row) == atual:
+            continue
+        corrigidos += 1
+        _corrigir(pagamento, inicio)
+
+    # Pagamentos removidos no ASAAS somem da listagem sem deixar rastro nela
+    ausentes = [
+        (r["id"], r["dados"])
+        for r in con.execute("SELECT id, dados FROM pagamentos WHERE removido = 0")
+        if r["id"] not in vistos
+    ]
+    for pagamento_id, dados in ausentes:
+        pagamento = _consultar_pagamento(pagamento_id)
+        if pagamento is None:
+            pagamento = {**json.loads(dados), "deleted": True}
+        elif not pagamento.get("deleted") and json.loads(dados) == pagamento:
+            continue
+        corrigidos += 1
+        removidos += int(bool(pagamento.get("deleted")))
+        _corrigir(pagamento, inicio)
+
+    resumo = {"lidos": lidos, "corrigidos": corrigidos, "removidos": removidos, "em": inicio}
+    estado.set(_CHAVE_RECONCILIACAO, resumo)
+    logger.info(
+        "Reconciliação de pagamentos: %s lidos, %s corrigidos (%s removidos)",
+        lidos, corrigidos, removidos,
+    )
+    return resumo
+
+
+def atualizado() -> bool:
+    """Indica se o livro foi reconciliado há pouco e pode substituir a API."""
+    ultima = estado.get(_CHAVE_RECONCILIACAO)
+    return bool(ultima) and time.time() - ultima["em"] < PAGAMENTOS_VALIDADE_S
+
+
+# ──────────────────────────────────────────────────────────
+# Consultas
+# ──────────────────────────────────────────────────────────
+def listar(
+    status: str | None = None,
+    cliente: str | None = None,
+    assinatura: str | None = None,
+    vencimentos: list[str] | None = None,
+    vencimento_de: str | None = None,
+    vencimento_ate: str | None = None,
+) -> list[dict]:
+    """Pagamentos (no formato do ASAAS) que atendem aos filtros."""
+    filtros, params = ["removido = 0"], []
+    for coluna, valor in (("status", status), ("cliente", cliente), ("assinatura", assinatura)):
+        if valor:
+            filtros.append(f"{coluna} = ?")
+            params.append(valor)
+    if vencimentos:
+        filtros.append(f"vencimento IN ({','.join('?' * len(vencimentos))})")
+        params.extend(vencimentos)
+    if vencimento_de:
+        filtros.append("vencimento >= ?")
+        params.append(vencimento_de)
+    if vencimento_ate:
+        filtros.append("vencimento <= ?")
+        params.append(vencimento_ate)
+    rows = _con().execute(
+        f"SELECT dados FROM pagamentos WHERE {' AND '.join(filtros)} ORDER BY vencimento",
+        params,
+    )
+    return [json.loads(r["dados"]) for r in rows]
+
+
+def resumo(vencimento_de: str, vencimento_ate: str) -> dict:
+    """Quantidade e soma dos valores por status em um período de vencimento."""
+    rows = _con().execute(
+        "SELECT status, COUNT(*) AS quantidade, COALESCE(SUM(valor), 0) AS total"
+        " FROM pagamentos WHERE removido = 0 AND vencimento BETWEEN ? AND ?"
+        " GROUP BY status",
+        (vencimento_de, vencimento_ate),
+    )
+    return {r["status"]: {"quantidade": r["quantidade"], "total": r["total"]} for r in rows}
+
+
+def eventos(pagamento_id: str) -> list[dict]:
+    rows = _con().execute(
+        "SELECT evento, recebido_em, payload FROM eventos WHERE pagamento_id = ? ORDER BY seq",
+        (pagamento_id,),
+    )
+    return [
+        {"evento": r["evento"], "recebido_em": r["recebido_em"], "payload": json.loads(r["payload"])}
+        for r in rows
+    ]
+
+
+# ──────────────────────────────────────────────────────────
+# Rotas
+# ──────────────────────────────────────────────────────────
+@router.get("", summary="Pagamentos do livro local")
+def listar_pagamentos(
+    status: str | None = None,
+    cliente: str | None = None,
+    assinatura: str | None = None,
+    vencimento_de: str | None = None,
+    vencimento_ate: str | None = None,
+):
+    return {
+        "atualizado": atualizado(),
+        "pagamentos": listar(status, cliente, assinatura, None, vencimento_de, vencimento_ate),
+    }
+
+
+@router.get("/resumo", summary="Totais por status no período de vencimento")
+def resumo_pagamentos(vencimento_de: str | None = None, vencimento_ate: str | None = None):
+    hoje = date.today()
+    de = vencimento_de or hoje.replace(day=1).isoformat()
+    ate = vencimento_ate or hoje.isoformat()
+    return {"vencimento_de": de, "vencimento_ate": ate, "status": resumo(de, ate)}
+
+
+@router.get("/{pagamento_id}/eventos", summary="Histórico de eventos de um pagamento")
+def eventos_pagamento(pagamento_id: str):
+    historico = eventos(pagamento_id)
+    if not historico:
+        raise HTTPException(404, "Pagamento não encontrado no livro")
+    return {"id": pagamento_id, "eventos": historico}
+
+
+@router.post("/reconciliar", summary="Reconcilia o livro com o ASAAS")
+def reconciliar_pagamentos():
+    try:
+        with estado.lock("tarefa:reconciliar_pagamentos", ttl=1800, espera=0):
+            return reconciliar()
+    except TimeoutError:
+        raise HTTPException(409, "Reconciliação já em andamento")
+    except requests.RequestException as e:
+        raise HTTPException(502, f"Erro ao consultar pagamentos no ASAAS: {e}")
+    except RuntimeError as e:
+        raise HTTPException(500, str(e))
+
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Rastreamento leve das etapas de cada requisição.
+
+Cada requisição recebe um identificador de correlação e uma lista de etapas
+(``spans``) com a duração de cada chamada externa relevante (token da OM,
+cadastro, matrícula, WhatsApp, Discord, Google Sheets...). O resumo é
+devolvido no cabeçalho ``Server-Timing`` e, quando a requisição ultrapassa
+``RASTREIO_LIMITE_LENTO_MS``, o detalhamento completo é gravado no log de
+requisições lentas. A gravação passa por um ``QueueHandler``: o arquivo é
+escrito por uma thread do ``logging``, fora do laço de eventos.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LIMITE_LENTO_MS = float(os.getenv("RASTREIO_LIMITE_LENTO_MS", "3000"))
+LOG_LENTO_PATH = os.getenv("RASTREIO_LOG_LENTO", "requisicoes_lentas.log")
+
+CABECALHO_CORRELACAO = "X-Correlation-ID"
+
+_log_lock = threading.Lock()
+_log_lento: logging.Logger | None = None
+
+
+def _logger_lento() -> logging.Logger:
+    """Logger do arquivo de requisições lentas, gravado em segundo plano."""
+    global _log_lento
+    with _log_lock:
+        if _log_lento is None:
+            arquivo = logging.FileHandler(LOG_LENTO_PATH, encoding="utf-8", delay=True)
+            arquivo.setFormatter(logging.Formatter("%(message)s"))
+            fila: queue.Queue = queue.Queue()
+            ouvinte = logging.handlers.QueueListener(fila, arquivo)
+            ouvinte.start()
+            atexit.register(ouvinte.stop)
+            log = logging.getLogger(f"{__name__}.lentas")
+            log.propagate = False
+            log.setLevel(logging.INFO)
+            log.addHandler(logging.handlers.QueueHandler(fila))
+            _log_lento = log
+        return _log_lento
+
+
+class Rastreio:
+    """Agrupa as etapas medidas durante uma requisição."""
+
+    def __init__(self, correlacao_id: str | None = None):
+        self.id = correlacao_id or uuid.uuid4().hex
+        self.inicio = time.perf_counter()
+        self.etapas: list[dict] = []
+        self._lock = threading.Lock()
+
+    def registrar(self, nome: str, inicio: float, duracao_ms: float, erro: bool) -> None:
+        with self._lock:
+            self.etapas.append(
+                {
+                    "nome": nome,
+                    "inicio_ms": round((inicio - self.inicio) * 1000, 1),
+                    "dur_ms": round(duracao_ms, 1),
+                    "erro": erro,
+                }
+            )
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.inicio) * 1000
+
+    def server_timing(self) -> str:
+        """Monta o valor do cabeçalho ``Server-Timing`` somando etapas repetidas."""
+        with self._lock:
+            agregadas: dict[str, list[float]] = {}
+            for etapa_ in self.etapas:
+                soma = agregadas.setdefault(etapa_["nome"], [0.0, 0])
+                soma[0] += etapa_["dur_ms"]
+                soma[1] += 1
+        partes = []
+        for nome, (dur, qtd) in agregadas.items():
+            item = f"{nome};dur={dur:.1f}"
+            if qtd > 1:
+                item += f';desc="x{qtd}"'
+            partes.append(item)
+        partes.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(partes)
+
+
+_atual: contextvars.ContextVar[Rastreio | None] = contextvars.ContextVar(
+    "rastreio_atual", default=None
+)
+
+
+def atual() -> Rastreio | None:
+    """Retorna o rastreio da requisição corrente (ou ``None``)."""
+    return _atual.get()
+
+
+def correlacao_id() -> str | None:
+    r = _atual.get()
+    return r.id if r else None
+
+
+@contextmanager
+def etapa(nome: str):
+    """Mede uma etapa da requisição corrente.
+
+    Pode ser usado como ``with etapa("om_token"):`` ou como decorador. Fora de
+    uma requisição rastreada não faz nada além de executar o bloco.
+    """
+    r = _atual.get()
+    if r is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    erro = False
+    try:
+        yield
+    except BaseException:
+        erro = True
+        raise
+    finally:
+        r.registrar(nome, inicio, (time.perf_counter() - inicio) * 1000, erro)
+
+
+def _gravar_lenta(r: Rastreio, metodo: str, caminho: str, status: int | None) -> None:
+    registro = {
+        "quando": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "id": r.id,
+        "metodo": metodo,
+        "caminho": caminho,
+        "status": status,
+        "total_ms": round(r.total_ms(), 1),
+        "etapas": r.etapas,
+    }
+    logger.warning(
+        "Requisição lenta %s %s (%s ms) id=%s",
+        metodo,
+        caminho,
+        registro["total_ms"],
+        r.id,
+    )
+    if LOG_LENTO_PATH:
+        _logger_lento().info(json.dumps(registro, ensure_ascii=False))
+
+
+class RastreioMiddleware:
+    """Middleware ASGI que abre um rastreio por requisição HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recebido = None
+        for chave, valor in scope.get("headers", []):
+            if chave.decode("latin-1").lower() in ("x-correlation-id", "x-request-id"):
+                recebido = valor.decode("latin-1")[:64]
+                break
+
+        r = Rastreio(recebido)
+        token = _atual.set(r)
+        status: int | None = None
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", r.server_timing().encode("latin-1")))
+                headers.append((CABECALHO_CORRELACAO.lower().encode(), r.id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _atual.reset(token)
+            if r.total_ms() >= LIMITE_LENTO_MS:
+                _gravar_lenta(r, scope.get("method", ""), scope.get("path", ""), status)
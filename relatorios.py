@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""Relatórios de atividade dos alunos a partir dos relatórios da OM.
+
+A ingestão (tarefa ``ingerir_relatorios`` do ``agendador`` ou
+``POST /relatorios/ingerir``) busca ``/relatorio/alunos_atividade`` e
+``/relatorio/alunos_log`` de forma incremental: cada relatório guarda a data
+até onde já foi lido (marca d'água) e a próxima execução busca apenas desse dia
+em diante, substituindo as linhas do dia da marca, que podia estar incompleto.
+O período é buscado em janelas de ``RELATORIOS_JANELA_DIAS`` dias; se uma
+janela passar de ``RELATORIOS_MAX_PAGINAS`` páginas, a ingestão para nela e a
+marca fica no primeiro dia dessa janela, para a próxima execução continuar dali.
+
+Os dados ficam em ``RELATORIOS_DIR/<relatorio>.npz``, uma coluna ``numpy`` por
+campo (aluno, curso, momento e ação codificada em um vocabulário), e as
+consultas (inativos, engajamento por curso, distribuição do último acesso) são
+agregações vetorizadas sobre essas colunas, sem chamar a OM.
+
+Os campos de cada linha são lidos do primeiro nome conhecido presente
+(``_CAMPOS``); linhas sem aluno ou sem data são descartadas.
+
+Cada unidade tem suas tabelas (``<relatorio>_<unidade>.npz``), ingeridas em
+paralelo. As consultas sem ``unidade`` juntam as colunas de todas as unidades.
+"""
+
+import logging
+import os
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import orjson
+import requests
+from fastapi import APIRouter, HTTPException, Query
+
+import alunos
+import cursosom
+import estado
+import unidades
+
+router = APIRouter(prefix="/relatorios", tags=["Relatórios"])
+
+OM_BASE = os.getenv("OM_BASE")
+BASIC_B64 = os.getenv("BASIC_B64")
+
+RELATORIOS_DIR = Path(os.getenv("RELATORIOS_DIR", "relatorios_dados"))
+# Dias buscados na primeira ingestão de cada relatório
+RELATORIOS_INICIO_DIAS = int(os.getenv("RELATORIOS_INICIO_DIAS", "365"))
+RELATORIOS_MAX_PAGINAS = int(os.getenv("RELATORIOS_MAX_PAGINAS", "1000"))
+# Dias de cada consulta à OM durante a ingestão
+RELATORIOS_JANELA_DIAS = max(1, int(os.getenv("RELATORIOS_JANELA_DIAS", "31")))
+
+RELATORIOS = {
+    "atividade": "/relatorio/alunos_atividade",
+    "log": "/relatorio/alunos_log",
+}
+
+_CAMPOS = {
+    "aluno": ("id_aluno", "aluno_id", "idaluno"),
+    "curso": ("id_curso", "curso_id", "idcurso", "id_disciplina"),
+    "momento": ("data_hora", "datahora", "data_atividade", "data_acesso", "data", "created_at"),
+    "acao": ("acao", "atividade", "descricao", "tipo", "log"),
+}
+
+# Faixas de dias sem acesso: [0, 2), [2, 8), ... ; a última é aberta
+_FAIXAS = (0, 2, 8, 15, 31, 61, 91)
+_ROTULOS = ("0-1", "2-7", "8-14", "15-30", "31-60", "61-90", "90+")
+
+logger = logging.getLogger(__name__)
+
+
+# ──────────────────────────────────────────────────────────
+# Armazenamento em colunas
+# ──────────────────────────────────────────────────────────
+class Tabela:
+    """Colunas de um relatório; ``acao`` é um índice em ``vocabulario``."""
+
+    def __init__(self, nome: str, colunas: dict | None = None, vocabulario=None, marca: str = ""):
+        self.nome = nome
+        self.colunas = colunas or {
+            "aluno": np.empty(0, np.int64),
+            "curso": np.empty(0, np.int64),
+            "momento": np.empty(0, "datetime64[s]"),
+            "acao": np.empty(0, np.int32),
+        }
+        self.vocabulario: list[str] = list(vocabulario or [])
+        self.marca = marca
+
+    def __len__(self) -> int:
+        return len(self.colunas["aluno"])
+
+    @property
+    def caminho(self) -> Path:
+        return RELATORIOS_DIR / f"{self.nome}.npz"
+
+    def salvar(self) -> None:
+        RELATORIOS_DIR.mkdir(parents=True, exist_ok=True)
+        temporario = self.caminho.with_suffix(".tmp")
+        with open(temporario, "wb") as f:
+            np.savez_compressed(
+                f,
+                **self.colunas,
+                vocabulario=np.array(self.vocabulario, dtype=str),
+                marca=np.array(self.marca),
+            )
+        # Os outros workers só enxergam o arquivo completo
+        os.replace(temporario, self.caminho)
+
+    @classmethod
+    def carregar(cls, nome: str) -> "Tabela":
+        tabela = cls(nome)
+        if not tabela.caminho.exists():
+            return tabela
+        with np.load(tabela.caminho, allow_pickle=False) as dados:
+            colunas = {c: dados[c] for c in tabela.colunas}
+            return cls(nome, colunas, dados["vocabulario"].tolist(), str(dados["marca"]))
+
+
+_tabelas: dict[str, tuple[int, Tabela]] = {}
+
+
+def tabela(nome: str, unidade: str | None = None) -> Tabela:
+    """Tabela do relatório na unidade, relida do disco quando outro worker a atualiza."""
+    unidade = unidades.resolver(unidade)
+    chave = f"{nome}_{unidade}"
+    caminho = RELATORIOS_DIR / f"{chave}.npz"
+    try:
+        versao = caminho.stat().st_mtime_ns
+    except FileNotFoundError:
+        versao = 0
+    if versao == 0 and unidade == unidades.UNIDADE_PADRAO:
+        # Arquivo de antes das várias unidades: passa a ser o da unidade padrão
+        try:
+            os.replace(RELATORIOS_DIR / f"{nome}.npz", caminho)
+            versao = caminho.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+    atual = _tabelas.get(chave)
+    if atual is None or atual[0] != versao:
+        atual = (versao, Tabela.carregar(chave))
+        _tabelas[chave] = atual
+    return atual[1]
+
+
+def _colunas(nome: str, unidade: str | None = None) -> dict:
+    """Colunas do relatório na unidade, ou de todas juntas (lidas em paralelo)."""
+    selecionadas = unidades.selecionar(unidade)
+    tabelas = list(unidades.em_paralelo(lambda u: tabela(nome, u), selecionadas).values())
+    if len(tabelas) == 1:
+        return tabelas[0].colunas
+    return {c: np.concatenate([t.colunas[c] for t in tabelas]) for c in tabelas[0].colunas}
+
+
+# ──────────────────────────────────────────────────────────
+# Ingestão
+# ──────────────────────────────────────────────────────────
+def _campo(linha: dict, nome: str):
+    for chave in _CAMPOS[nome]:
+        valor = linha.get(chave)
+        if valor not in (None, ""):
+            return valor
+    return None
+
+
+def _momento(valor) -> np.datetime64 | None:
+    texto = str(valor or "").strip()
+    if "/" in texto[:10]:
+        # dd/mm/aaaa[ hh:mm:ss] -> aaaa-mm-dd[ hh:mm:ss]
+        dia, mes, resto = texto.split("/", 2)
+        texto = f"{resto[:4]}-{mes}-{dia}{resto[4:]}"
+    try:
+        return np.datetime64(texto.replace(" ", "T")[:19], "s")
+    except ValueError:
+        return None
+
+
+def _inteiro(valor) -> int | None:
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _buscar(caminho: str, data_inicial: date, data_final: date, unidade: str) -> list | None:
+    """Todas as linhas do período; ``None`` se passar de ``RELATORIOS_MAX_PAGINAS`` páginas."""
+    if not OM_BASE or not BASIC_B64:
+        raise RuntimeError("Variáveis de ambiente OM não configuradas.")
+    todas = []
+    for page in range(1, RELATORIOS_MAX_PAGINAS + 1):
+        r = requests.get(
+            f"{OM_BASE}{caminho}",
+            params={
+                "data_inicial": data_inicial.isoformat(),
+                "data_final": data_final.isoformat(),
+                "id_unidade": unidade,
+                "page": page,
+            },
+            headers={"Authorization": f"Basic {BASIC_B64}"},
+            timeout=30,
+        )
+        if not r.ok:
+            raise RuntimeError(f"Falha ao obter {caminho}: HTTP {r.status_code}")
+        dados = orjson.loads(r.content)
+        linhas = dados.get("data") or []
+        if not isinstance(linhas, list) or not linhas:
+            return todas
+        todas.extend(linhas)
+        pagina = dados.get("pagina") or {}
+        if not pagina or page * int(pagina.get("size") or len(linhas)) >= int(pagina.get("total") or 0):
+            return todas
+    return None
+
+
+def ingerir(nome: str, hoje: date | None = None, unidade: str | None = None) -> dict:
+    """Busca o relatório ``nome`` da unidade desde a marca d'água e grava a tabela.
+
+    A marca só avança até o fim da última janela buscada por inteiro; se nem a
+    primeira janela couber em ``RELATORIOS_MAX_PAGINAS`` páginas, levanta
+    ``RuntimeError`` sem alterar a tabela.
+    """
+    hoje = hoje or date.today()
+    unidade = unidades.resolver(unidade)
+    atual = tabela(nome, unidade)
+    inicio = date.fromisoformat(atual.marca) if atual.marca else hoje - timedelta(RELATORIOS_INICIO_DIAS)
+
+    vocabulario = list(atual.vocabulario)
+    codigos = {acao: i for i, acao in enumerate(vocabulario)}
+    ids_alunos, cursos, momentos, acoes = [], [], [], []
+    descartadas = 0
+    marca, de = hoje, inicio
+    while de <= hoje:
+        ate = min(de + timedelta(RELATORIOS_JANELA_DIAS - 1), hoje)
+        linhas = _buscar(RELATORIOS[nome], de, ate, unidade)
+        if linhas is None:
+            if de == inicio:
+                raise RuntimeError(
+                    f"{RELATORIOS[nome]}: mais de {RELATORIOS_MAX_PAGINAS} páginas entre"
+                    f" {de.isoformat()} e {ate.isoformat()} (unidade {unidade})"
+                )
+            logger.warning(
+                "%s: limite de %s páginas atingido entre %s e %s; marca fica em %s",
+                RELATORIOS[nome], RELATORIOS_MAX_PAGINAS, de, ate, de,
+            )
+            marca = de
+            break
+        de = ate + timedelta(1)
+        for linha in linhas:
+            aluno = _inteiro(_campo(linha, "aluno"))
+            momento = _momento(_campo(linha, "momento"))
+            if aluno is None or momento is None:
+                descartadas += 1
+                continue
+            acao = _campo(linha, "acao")
+            if acao is not None and (acao := str(acao)) not in codigos:
+                codigos[acao] = len(vocabulario)
+                vocabulario.append(acao)
+            ids_alunos.append(aluno)
+            cursos.append(_inteiro(_campo(linha, "curso")) or -1)
+            momentos.append(momento)
+            acoes.append(-1 if acao is None else codigos[acao])
+
+    # Linhas do dia da marca em diante foram buscadas de novo, até a nova marca
+    # se a busca parou antes de hoje
+    manter = atual.colunas["momento"] < np.datetime64(inicio, "s")
+    if marca < hoje:
+        manter |= atual.colunas["momento"] >= np.datetime64(marca, "s")
+    colunas = {
+        "aluno": np.concatenate([atual.colunas["aluno"][manter], np.array(ids_alunos, np.int64)]),
+        "curso": np.concatenate([atual.colunas["curso"][manter], np.array(cursos, np.int64)]),
+        "momento": np.concatenate(
+            [atual.colunas["momento"][manter], np.array(momentos, "datetime64[s]")]
+        ),
+        "acao": np.concatenate([atual.colunas["acao"][manter], np.array(acoes, np.int32)]),
+    }
+    ordem = np.argsort(colunas["momento"], kind="stable")
+    nova = Tabela(atual.nome, {c: v[ordem] for c, v in colunas.items()}, vocabulario, marca.isoformat())
+    nova.salvar()
+    return {"linhas_novas": len(ids_alunos), "descartadas": descartadas, "total": len(nova), "marca": nova.marca}
+
+
+def ingerir_todos() -> dict:
+    """Ingere os relatórios de todas as unidades em paralelo; resumo por unidade."""
+    inicio = time.time()
+    resumo = unidades.em_paralelo(
+        lambda u: {nome: ingerir(nome, unidade=u) for nome in RELATORIOS}
+    )
+    estado.set("relatorios:ultima_ingestao", {"em": inicio, "resumo": resumo})
+    logger.info("Ingestão de relatórios: %s", resumo)
+    return resumo
+
+
+# ──────────────────────────────────────────────────────────
+# Agregações
+# ──────────────────────────────────────────────────────────
+def _ultimos_por_grupo(grupos: np.ndarray, momentos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Para cada valor distinto de ``grupos``, o maior ``momento``."""
+    if not len(grupos):
+        return grupos, momentos
+    ordem = np.lexsort((momentos, grupos))
+    grupos, momentos = grupos[ordem], momentos[ordem]
+    fim = np.append(np.flatnonzero(np.diff(grupos)), len(grupos) - 1)
+    return grupos[fim], momentos[fim]
+
+
+def ultimos_acessos(unidade: str | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """``(ids, último momento)`` por aluno, somando os dois relatórios."""
+    colunas = [_colunas(nome, unidade) for nome in RELATORIOS]
+    return _ultimos_por_grupo(
+        np.concatenate([c["aluno"] for c in colunas]),
+        np.concatenate([c["momento"] for c in colunas]),
+    )
+
+
+def _dias_sem_acesso(ultimos: np.ndarray, hoje: date) -> np.ndarray:
+    return (np.datetime64(hoje, "D") - ultimos.astype("datetime64[D]")).astype(np.int64)
+
+
+def _roster(unidade: str | None = None) -> list[dict]:
+    try:
+        return alunos.obter_retrato(unidade).alunos
+    except Exception as e:
+        logger.warning("Lista de alunos indisponível para os relatórios: %s", e)
+        return []
+
+
+def inativos(
+    dias: int,
+    incluir_bloqueados: bool = False,
+    hoje: date | None = None,
+    unidade: str | None = None,
+) -> list[dict]:
+    """Alunos da unidade (ou de todas) sem acesso há ``dias`` dias ou mais (ou nunca)."""
+    hoje = hoje or date.today()
+    ids, ultimos = ultimos_acessos(unidade)
+    roster = [
+        a for a in _roster(unidade)
+        if incluir_bloqueados or str(a.get("bloqueado") or "0") in ("0", "false")
+    ]
+    ids_roster = np.array([_inteiro(a.get("id")) or -1 for a in roster], np.int64)
+    # Posição de cada aluno da lista entre os que têm acesso registrado
+    pos = np.minimum(np.searchsorted(ids, ids_roster), max(len(ids) - 1, 0))
+    encontrado = ids[pos] == ids_roster if len(ids) else np.zeros(len(roster), bool)
+    sem_acesso = np.full(len(roster), np.iinfo(np.int64).max)
+    sem_acesso[encontrado] = _dias_sem_acesso(ultimos[pos[encontrado]], hoje)
+    selecionados = np.flatnonzero(sem_acesso >= dias)
+    selecionados = selecionados[np.argsort(-sem_acesso[selecionados], kind="stable")]
+    return [
+        {
+            "id": roster[i].get("id"),
+            "nome": roster[i].get("nome"),
+            "id_unidade": roster[i].get("id_unidade"),
+            "ultimo_acesso": str(ultimos[pos[i]]) if encontrado[i] else None,
+            "dias_sem_acesso": int(sem_acesso[i]) if encontrado[i] else None,
+        }
+        for i in selecionados
+    ]
+
+
+def engajamento(
+    de: date | None = None, ate: date | None = None, unidade: str | None = None
+) -> list[dict]:
+    """Atividades, alunos distintos e última atividade por curso no período."""
+    colunas = _colunas("atividade", unidade)
+    mascara = colunas["curso"] >= 0
+    if de:
+        mascara &= colunas["momento"] >= np.datetime64(de, "s")
+    if ate:
+        mascara &= colunas["momento"] < np.datetime64(ate + timedelta(1), "s")
+    cursos, ids_alunos, momentos = (colunas[c][mascara] for c in ("curso", "aluno", "momento"))
+    if not len(cursos):
+        return []
+    ids, atividades = np.unique(cursos, return_counts=True)
+    # Pares (curso, aluno) distintos, codificados em um único inteiro
+    pares = np.unique((cursos << 32) | (ids_alunos & 0xFFFFFFFF))
+    _, distintos = np.unique(pares >> 32, return_counts=True)
+    _, ultimas = _ultimos_por_grupo(cursos, momentos)
+    nomes = cursosom.nomes_por_id()
+    resultado = [
+        {
+            "id": int(cid),
+            "nome": nomes.get(str(cid)),
+            "atividades": int(n),
+            "alunos": int(d),
+            "ultima_atividade": str(u),
+        }
+        for cid, n, d, u in zip(ids, atividades, distintos, ultimas)
+    ]
+    resultado.sort(key=lambda c: c["atividades"], reverse=True)
+    return resultado
+
+
+def distribuicao_ultimo_acesso(hoje: date | None = None, unidade: str | None = None) -> dict:
+    """Quantidade de alunos por faixa de dias desde o último acesso."""
+    hoje = hoje or date.today()
+    ids, ultimos = ultimos_acessos(unidade)
+    contagem, _ = np.histogram(_dias_sem_acesso(ultimos, hoje), bins=[*_FAIXAS, np.inf])
+    resultado = dict(zip(_ROTULOS, (int(c) for c in contagem)))
+    roster = _roster(unidade)
+    if roster:
+        ids_roster = np.array([_inteiro(a.get("id")) or -1 for a in roster], np.int64)
+        resultado["nunca"] = int(np.count_nonzero(~np.isin(ids_roster, ids)))
+    return resultado
+
+
+# ──────────────────────────────────────────────────────────
+# Rotas
+# ──────────────────────────────────────────────────────────
+def _situacao_tabela(t: Tabela) -> dict:
+    return {
+        "linhas": len(t),
+        "marca": t.marca or None,
+        "bytes": t.caminho.stat().st_size if t.caminho.exists() else 0,
+    }
+
+
+@router.get("", summary="Situação dos dados de relatórios")
+def situacao():
+    return {
+        "tabelas": {
+            u: {nome: _situacao_tabela(tabela(nome, u)) for nome in RELATORIOS}
+            for u in unidades.UNIDADES
+        },
+        "ultima_ingestao": estado.get("relatorios:ultima_ingestao"),
+    }
+
+
+@router.post("/ingerir", summary="Busca na OM os relatórios desde a última ingestão")
+def ingerir_relatorios():
+    try:
+        with estado.lock("tarefa:ingerir_relatorios", ttl=1800, espera=0):
+            return ingerir_todos()
+    except TimeoutError:
+        raise HTTPException(409, "Ingestão já em andamento")
+    except requests.RequestException as e:
+        raise HTTPException(502, f"Erro ao consultar relatórios na OM: {e}")
+    except RuntimeError as e:
+        raise HTTPException(500, str(e))
+
+
+@router.get("/inativos", summary="Alunos sem acesso há N dias")
+def listar_inativos(
+    dias: int = Query(30, ge=0), incluir_bloqueados: bool = False, unidade: str | None = None
+):
+    lista = inativos(dias, incluir_bloqueados, unidade=unidade)
+    return {"dias": dias, "total": len(lista), "alunos": lista}
+
+
+@router.get("/engajamento", summary="Engajamento por curso")
+def engajamento_por_curso(
+    de: date | None = None, ate: date | None = None, unidade: str | None = None
+):
+    return {"de": de, "ate": ate, "cursos": engajamento(de, ate, unidade)}
+
+
+@router.get("/ultimo_acesso", summary="Distribuição dos dias desde o último acesso")
+def ultimo_acesso(unidade: str | None = None):
+    return distribuicao_ultimo_acesso(unidade=unidade)
@@ -3,26 +3,65 @@ import os
 import requests
 from fastapi import APIRouter, HTTPException
 
+import estado
+import unidades
+from cache import chamada_unica, limpar_memo
+from rastreio import etapa
+
 router = APIRouter()
 
 OM_BASE = os.getenv("OM_BASE")
 BASIC_B64 = os.getenv("BASIC_B64")
-UNIDADE_ID = os.getenv("UNIDADE_ID")
+
+# Tempo (s) em que o token da unidade é reaproveitado entre requisições
+OM_TOKEN_TTL = float(os.getenv("OM_TOKEN_TTL", "300"))
+
+# Compartilhado entre os workers: um único token por unidade para todo o servidor
+_tokens = estado.CacheCompartilhado("om_token_unidade", OM_TOKEN_TTL)
+
+
+@chamada_unica("om_token_unidade")
+def _buscar_token_unidade(unidade_id: str) -> str:
+    url = f"{OM_BASE}/unidades/token/{unidade_id}"
+    headers = {"Authorization": f"Basic {BASIC_B64}"}
+    r = requests.get(url, headers=headers, timeout=8)
+    if r.ok and r.json().get("status") == "true":
+        return r.json()["data"]["token"]
+    raise RuntimeError(f"Falha ao obter token da unidade: HTTP {r.status_code} | {r.text}")
+
+
+@etapa("om_token")
+def obter_token_unidade(renovar: bool = False, unidade: str | None = None) -> str:
+    """Token da unidade na OM, compartilhado por matrícula, bloqueio e afins.
+
+    Chamadas simultâneas compartilham a mesma consulta e o token de cada
+    unidade fica em cache por ``OM_TOKEN_TTL`` segundos (``renovar=True`` força
+    nova consulta). Sem ``unidade``, usa a unidade padrão.
+    """
+    if not all([OM_BASE, BASIC_B64, unidades.UNIDADES]):
+        raise RuntimeError("Variáveis de ambiente OM não configuradas.")
+    unidade = unidades.resolver(unidade)
+    if not renovar:
+        token = _tokens.get(unidade)
+        if token:
+            return token
+    else:
+        # Nova consulta mesmo que a requisição já tenha obtido um token
+        limpar_memo("om_token_unidade")
+    token = _buscar_token_unidade(unidade)
+    _tokens.set(unidade, token)
+    return token
+
 
 @router.head("/secure", summary="Obtem token da unidade")
-def obter_token():
-    if not all([OM_BASE, BASIC_B64, UNIDADE_ID]):
+def obter_token(unidade: str | None = None):
+    if not all([OM_BASE, BASIC_B64, unidades.UNIDADES]):
         raise HTTPException(500, detail="Variáveis de ambiente não configuradas corretamente.")
-    
-    try:
-        url = f"{OM_BASE}/unidades/token/{UNIDADE_ID}"
-        headers = {"Authorization": f"Basic {BASIC_B64}"}
-        r = requests.get(url, headers=headers, timeout=8)
-
-        if r.ok and r.json().get("status") == "true":
-            return {"token": r.json()["data"]["token"]}
-        else:
-            raise HTTPException(status_code=400, detail="Falha ao obter token: " + r.text)
+    unidade = unidades.resolver(unidade)
 
+    try:
+        return {"token": obter_token_unidade(renovar=True, unidade=unidade)}
     except requests.RequestException as e:
         raise HTTPException(500, detail=f"Erro de conexão: {str(e)}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
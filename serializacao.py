@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""Serialização rápida (orjson) e compressão das respostas.
+
+- ``RespostaJSON``: classe de resposta padrão da aplicação, com orjson;
+- ``RotaJSON``: classe de rota que lê o corpo das requisições com orjson
+  (usada pelos roteadores que recebem JSON, como os webhooks);
+- ``CompressaoMiddleware``: comprime respostas grandes com brotli (se o pacote
+  ``brotli`` estiver instalado) ou gzip, conforme o ``Accept-Encoding``;
+- ``exportar``: resposta em streaming (NDJSON ou CSV) para as rotas de
+  exportação, gerada à medida que as páginas chegam da API de origem.
+"""
+
+import csv
+import gzip
+import io
+import itertools
+import logging
+import os
+from typing import Iterable, Iterator
+
+import orjson
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+
+try:
+    import brotli
+except Exception:  # pragma: no cover - lib opcional
+    brotli = None
+
+# Respostas menores que isso (bytes) seguem sem compressão
+COMPRESSAO_MINIMO = int(os.getenv("COMPRESSAO_MINIMO", "1024"))
+COMPRESSAO_NIVEL_GZIP = int(os.getenv("COMPRESSAO_NIVEL_GZIP", "6"))
+COMPRESSAO_NIVEL_BROTLI = int(os.getenv("COMPRESSAO_NIVEL_BROTLI", "4"))
+# Tamanho aproximado de cada pedaço enviado nas exportações
+EXPORTACAO_PEDACO = int(os.getenv("EXPORTACAO_PEDACO", "65536"))
+
+_TIPOS_COMPRIMIVEIS = ("application/json", "text/", "application/x-ndjson", "text/csv")
+_OPCOES = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+logger = logging.getLogger(__name__)
+
+
+def dumps(dados) -> bytes:
+    return orjson.dumps(dados, option=_OPCOES)
+
+
+class RespostaJSON(JSONResponse):
+    """``JSONResponse`` serializada com orjson."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class _RequisicaoJSON(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            try:
+                self._json = orjson.loads(await self.body())
+            except orjson.JSONDecodeError as e:
+                raise HTTPException(400, f"JSON inválido: {e}")
+        return self._json
+
+
+class RotaJSON(APIRoute):
+    """Rota cujo corpo JSON é lido com orjson (inclusive ``await request.json()``)."""
+
+    def get_route_handler(self):
+        original = super().get_route_handler()
+
+        async def handler(request: Request):
+            return await original(_RequisicaoJSON(request.scope, request.receive))
+
+        return handler
+
+
+# ──────────────────────────────────────────────────────────
+# Compressão
+# ──────────────────────────────────────────────────────────
+def escolher_codificacao(accept_encoding: str) -> str | None:
+    """``br`` ou ``gzip`` conforme o cabeçalho ``Accept-Encoding`` do cliente."""
+    aceitas = {}
+    for item in accept_encoding.lower().split(","):
+        nome, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        aceitas[nome.strip()] = q
+    if brotli is not None and aceitas.get("br", 0) > 0:
+        return "br"
+    if aceitas.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def comprimir(corpo: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=COMPRESSAO_NIVEL_BROTLI)
+    return gzip.compress(corpo, compresslevel=COMPRESSAO_NIVEL_GZIP)
+
+
+def _etag_fraco(headers: list) -> list:
+    """Cabeçalhos com o ``ETag`` forte trocado pela versão fraca (``W/"..."``)."""
+    return [
+        (k, b"W/" + v if k.lower() == b"etag" and not v.startswith(b"W/") else v)
+        for k, v in headers
+    ]
+
+
+class CompressaoMiddleware:
+    """Middleware ASGI que comprime respostas grandes de corpo único.
+
+    Respostas em streaming (vários pedaços) passam sem alteração. Ao comprimir,
+    o ``ETag`` forte da resposta vira fraco (``W/``): os bytes enviados não são
+    mais os que ele identifica.
+    """
+
+    def __init__(self, app, minimo: int = COMPRESSAO_MINIMO):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cabecalhos = dict(scope.get("headers") or [])
+        codificacao = escolher_codificacao(cabecalhos.get(b"accept-encoding", b"").decode("latin-1"))
+        if codificacao is None:
+            await self.app(scope, receive, send)
+            return
+
+        inicio = None
+        repassando = False
+
+        async def enviar(mensagem):
+            nonlocal inicio, repassando
+            if mensagem["type"] == "http.response.start":
+                inicio = mensagem
+                return
+            if repassando:
+                await send(mensagem)
+                return
+            if mensagem["type"] != "http.response.body":
+                # Ex.: ``http.response.pathsend`` de um ``FileResponse``
+                repassando = True
+                await send(inicio)
+                await send(mensagem)
+                return
+            corpo = mensagem.get("body", b"")
+            if mensagem.get("more_body") or not self._comprimivel(inicio, corpo):
+                repassando = True
+                await send(inicio)
+                await send(mensagem)
+                return
+            comprimido = comprimir(corpo, codificacao)
+            vary = [v for k, v in inicio["headers"] if k.lower() == b"vary"]
+            headers = [
+                (k, v)
+                for k, v in _etag_fraco(inicio["headers"])
+                if k.lower() not in (b"content-length", b"vary")
+            ]
+            headers += [
+                (b"content-encoding", codificacao.encode()),
+                (b"content-length", str(len(comprimido)).encode()),
+                (b"vary", b", ".join(vary + [b"Accept-Encoding"])),
+            ]
+            await send({**inicio, "headers": headers})
+            await send({"type": "http.response.body", "body": comprimido})
+
+        await self.app(scope, receive, enviar)
+
+    def _comprimivel(self, inicio, corpo: bytes) -> bool:
+        if len(corpo) < self.minimo or inicio["status"] in (204, 304):
+            return False
+        headers = {k.lower(): v for k, v in inicio["headers"]}
+        if b"content-encoding" in headers:
+            return False
+        tipo = headers.get(b"content-type", b"").decode("latin-1")
+        return tipo.startswith(_TIPOS_COMPRIMIVEIS)
+
+
+# ──────────────────────────────────────────────────────────
+# Exportação em streaming
+# ──────────────────────────────────────────────────────────
+FORMATOS_EXPORTACAO = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def ler_colunas(parametro: str | None, permitidas: Iterable[str] | None = None) -> list[str] | None:
+    """Converte ``"nome,cpf"`` em lista, validando contra ``permitidas``."""
+    if not parametro:
+        return None
+    colunas = [c.strip() for c in parametro.split(",") if c.strip()]
+    if permitidas is not None:
+        desconhecidas = [c for c in colunas if c not in permitidas]
+        if desconhecidas:
+            raise HTTPException(400, f"Colunas desconhecidas: {', '.join(desconhecidas)}")
+    return colunas or None
+
+
+def _linhas_ndjson(linhas: Iterable[dict], colunas: list[str] | None) -> Iterator[bytes]:
+    for linha in linhas:
+        if colunas:
+            linha = {c: linha.get(c) for c in colunas}
+        yield orjson.dumps(linha, option=_OPCOES | orjson.OPT_APPEND_NEWLINE)
+
+
+def _linhas_csv(linhas: Iterable[dict], colunas: list[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    # BOM para que planilhas reconheçam o UTF-8 (acentos nos nomes)
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    for linha in linhas:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerow(["" if linha.get(c) is None else linha.get(c) for c in colunas])
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _agrupar(partes: Iterator[bytes], tamanho: int) -> Iterator[bytes]:
+    """Envia a primeira parte logo e junta as demais em pedaços de ~``tamanho``."""
+    primeira = next(partes, None)
+    if primeira is None:
+        return
+    yield primeira
+    lote, acumulado = [], 0
+    for parte in partes:
+        lote.append(parte)
+        acumulado += len(parte)
+        if acumulado >= tamanho:
+            yield b"".join(lote)
+            lote, acumulado = [], 0
+    if lote:
+        yield b"".join(lote)
+
+
+def exportar(
+    linhas: Iterator[dict],
+    formato: str,
+    colunas: list[str] | None,
+    nome_arquivo: str,
+    colunas_padrao: list[str] | None = None,
+) -> StreamingResponse:
+    """Resposta em streaming com ``linhas`` em NDJSON ou CSV.
+
+    A primeira linha é lida antes de responder, para que falhas de
+    configuração ou da API de origem ainda virem um erro HTTP; depois disso o
+    corpo é gerado sob demanda, com memória constante.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise HTTPException(400, f"Formato inválido: use {' ou '.join(FORMATOS_EXPORTACAO)}")
+    primeira = next(linhas, None)
+    todas = linhas if primeira is None else itertools.chain([primeira], linhas)
+    if formato == "csv":
+        colunas = colunas or colunas_padrao or (list(primeira) if primeira else [])
+        partes = _linhas_csv(todas, colunas)
+    else:
+        partes = _linhas_ndjson(todas, colunas)
+
+    def corpo() -> Iterator[bytes]:
+        try:
+            yield from _agrupar(partes, EXPORTACAO_PEDACO)
+        except Exception:
+            # Cabeçalhos já enviados: só resta interromper a resposta
+            logger.exception("Exportação %s interrompida", nome_arquivo)
+            raise
+
+    return StreamingResponse(
+        corpo(),
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nome_arquivo}.{formato}"'},
+    )
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Ciclo de vida do servidor em produção.
+
+- ``SERVIDOR_WORKERS`` processos (padrão: ``WEB_CONCURRENCY`` ou ``1``);
+- cada worker aquece os caches de token, catálogo e clientes antes de aceitar
+  requisições;
+- no desligamento, os webhooks em andamento e os WhatsApps pendentes são
+  concluídos (até ``SERVIDOR_DRENAGEM_S`` segundos) em vez de descartados.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+import asaas
+import captura
+import cursosom
+import estado
+import notificacoes
+import secure
+import unidades
+
+router = APIRouter(tags=["Status"])
+
+SERVIDOR_WORKERS = int(os.getenv("SERVIDOR_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+SERVIDOR_DRENAGEM_S = float(os.getenv("SERVIDOR_DRENAGEM_S", "30"))
+# Clientes do ASAAS (das assinaturas) carregados no cache ao iniciar; 0 desativa
+AQUECIMENTO_CLIENTES_MAX = int(os.getenv("AQUECIMENTO_CLIENTES_MAX", "200"))
+
+logger = logging.getLogger(__name__)
+
+_situacao = {"fase": "iniciando", "em_andamento": 0, "aquecimento_ms": None}
+
+
+class RequisicoesEmAndamento:
+    """Middleware ASGI que conta as requisições HTTP em andamento no worker."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        _situacao["em_andamento"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _situacao["em_andamento"] -= 1
+
+
+# ──────────────────────────────────────────────────────────
+# Aquecimento
+# ──────────────────────────────────────────────────────────
+def _aquecer_clientes() -> int:
+    """Carrega no cache os clientes das assinaturas ativas do ASAAS."""
+    if AQUECIMENTO_CLIENTES_MAX <= 0 or not asaas.ASAAS_KEY:
+        return 0
+    resp = requests.get(
+        f"{asaas.ASAAS_BASE_URL}/subscriptions",
+        headers=asaas._headers(),
+        params={"status": "ACTIVE", "limit": 100},
+        timeout=10,
+    )
+    resp.raise_for_status()
+    ids = list(
+        dict.fromkeys(s["customer"] for s in resp.json().get("data") or [] if s.get("customer"))
+    )[:AQUECIMENTO_CLIENTES_MAX]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(asaas.obter_cliente, ids))
+    return len(ids)
+
+
+def aquecer() -> dict:
+    """Preenche os caches usados pelos fluxos principais.
+
+    Roda sob um lock entre workers: o primeiro consulta os serviços externos e
+    os demais encontram os dados já no estado compartilhado. Falhas são apenas
+    registradas; o worker sobe mesmo sem cache.
+    """
+    resumo = {}
+    etapas = {
+        "token": lambda: len(unidades.em_paralelo(lambda u: secure.obter_token_unidade(unidade=u))),
+        "cursos": lambda: len(cursosom._load_cursos()),
+        "clientes": _aquecer_clientes,
+    }
+    with estado.lock("servidor:aquecimento", ttl=120):
+        for nome, funcao in etapas.items():
+            try:
+                resumo[nome] = funcao()
+            except Exception as e:
+                logger.warning("Aquecimento de %s falhou: %s", nome, e)
+                resumo[nome] = None
+    return resumo
+
+
+# ──────────────────────────────────────────────────────────
+# Drenagem
+# ──────────────────────────────────────────────────────────
+async def drenar(limite_s: float = SERVIDOR_DRENAGEM_S) -> bool:
+    """Espera as requisições em andamento, os envios de WhatsApp e as capturas pendentes."""
+    fim = time.monotonic() + limite_s
+    while _situacao["em_andamento"] > 0 and time.monotonic() < fim:
+        await asyncio.sleep(0.05)
+    restante = max(0.0, fim - time.monotonic())
+    enviados = await asyncio.to_thread(notificacoes.enviador.aguardar, restante)
+    await asyncio.to_thread(captura.aguardar, max(0.0, fim - time.monotonic()))
+    ok = enviados and _situacao["em_andamento"] == 0
+    if not ok:
+        logger.warning(
+            "Drenagem incompleta: %s requisição(ões) e %s WhatsApp(s) pendentes",
+            _situacao["em_andamento"],
+            notificacoes.enviador.pendentes(),
+        )
+    return ok
+
+
+@router.on_event("startup")
+async def _iniciar():
+    inicio = time.perf_counter()
+    resumo = await asyncio.to_thread(aquecer)
+    _situacao["aquecimento_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    _situacao["fase"] = "pronto"
+    logger.info("Worker %s pronto em %s ms: %s", os.getpid(), _situacao["aquecimento_ms"], resumo)
+
+
+@router.on_event("shutdown")
+async def _encerrar():
+    _situacao["fase"] = "drenando"
+    await drenar()
+    _situacao["fase"] = "encerrado"
+
+
+@router.get("/pronto", summary="Prontidão do worker")
+def pronto():
+    """200 quando o worker terminou o aquecimento; 503 ao iniciar ou drenar."""
+    corpo = {**_situacao, "pid": os.getpid(), "whatsapp_pendentes": notificacoes.enviador.pendentes()}
+    return JSONResponse(corpo, status_code=200 if _situacao["fase"] == "pronto" else 503)
+
+
+def executar(porta: int, workers: int = SERVIDOR_WORKERS) -> None:
+    """Sobe o uvicorn em modo de produção."""
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=porta,
+        workers=workers,
+        reload=False,
+        timeout_graceful_shutdown=int(SERVIDOR_DRENAGEM_S),
+    )
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+os.environ.setdefault("ESTADO_BACKEND", "memoria")
+os.environ.setdefault("WHATSAPP_CANAIS", "")
+
+import estado  # noqa: E402
+import notificacoes  # noqa: E402
+
+
+class GatewayFalso:
+    canais = []
+
+    def enviar(self, numero, mensagem):
+        return notificacoes.Entrega("falso", "ok", 0.0)
+
+    def estatisticas(self):
+        # Alarga a janela em que estatisticas() segura o lock das contagens
+        time.sleep(0.01)
+        return {}
+
+
+def test_estatisticas_durante_agrupamento_nao_trava(monkeypatch):
+    incr = estado.incr
+
+    def incr_lento(chave, n=1):
+        # Alarga a janela de _combinar (gravação no estado compartilhado)
+        time.sleep(0.01)
+        return incr(chave, n)
+
+    monkeypatch.setattr(estado, "incr", incr_lento)
+    enviador = notificacoes.EnviadorWhatsApp("", 1000, 1000, 2, 1, janela=0.2)
+    enviador.gateway = GatewayFalso()
+
+    parar = threading.Event()
+    entregues = []
+
+    def consultar():
+        while not parar.is_set():
+            enviador.estatisticas()
+
+    def enfileirar():
+        futuros = [
+            enviador.enviar(f"6199990{rodada:04d}", f"mensagem {i}")
+            for rodada in range(20)
+            for i in range(3)
+        ]
+        entregues.extend(f.result().text for f in futuros)
+
+    # Em threads à parte: com o travamento, até enviar() fica bloqueado
+    threads = [threading.Thread(target=consultar, daemon=True) for _ in range(2)]
+    threads.append(threading.Thread(target=enfileirar, daemon=True))
+    for t in threads:
+        t.start()
+    threads[-1].join(timeout=15)
+    parar.set()
+    for t in threads:
+        t.join(timeout=5)
+        assert not t.is_alive(), "estatisticas() e o agrupamento travaram"
+    assert entregues == ["ok"] * 60
+    assert enviador.estatisticas()["agrupadas"] == 40
+
+
+def test_mesclar_mantem_mensagens_com_os_mesmos_links():
+    modelo = "Bem-vindo(a)! Login: {} Senha: {}\nAcesse https://ead.exemplo.com/login"
+    ana = modelo.format("ana", "123")
+    bia = modelo.format("bia", "456")
+    assert notificacoes.mesclar_mensagens([ana, bia]) == ana + notificacoes._SEPARADOR + bia
+    assert notificacoes.mesclar_mensagens([ana, "  " + ana.upper() + " "]) == ana
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Unidades da OM atendidas por este servidor.
+
+``UNIDADES`` (ids separados por vírgula) lista as unidades; sem ela vale apenas
+``UNIDADE_ID``, como antes. ``UNIDADE_ID`` (ou a primeira de ``UNIDADES``) é a
+unidade padrão, usada quando a requisição não informa ``unidade``.
+
+O token (``secure``), o retrato de alunos, as tabelas de relatórios e o
+catálogo de cursos (``/unidades/cursos/{id}`` na OM) são mantidos por unidade.
+Listagens e relatórios sem ``unidade`` (ou com ``unidade=todas``) consultam
+todas as unidades em paralelo com ``em_paralelo``.
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import orjson
+import requests
+from fastapi import APIRouter, HTTPException
+
+import estado
+from cache import chamada_unica
+
+router = APIRouter(prefix="/unidades", tags=["Unidades"])
+
+OM_BASE = os.getenv("OM_BASE")
+BASIC_B64 = os.getenv("BASIC_B64")
+
+UNIDADE_PADRAO = os.getenv("UNIDADE_ID") or None
+UNIDADES: list[str] = list(
+    dict.fromkeys(
+        u.strip()
+        for u in [UNIDADE_PADRAO or "", *os.getenv("UNIDADES", "").split(",")]
+        if u.strip()
+    )
+)
+if UNIDADE_PADRAO is None and UNIDADES:
+    UNIDADE_PADRAO = UNIDADES[0]
+
+# Valor de ``unidade`` que seleciona todas as unidades
+TODAS = "todas"
+
+# Consultas simultâneas às unidades e validade do catálogo de cursos (s)
+UNIDADES_THREADS = int(os.getenv("UNIDADES_THREADS", "8"))
+UNIDADES_CURSOS_TTL = float(os.getenv("UNIDADES_CURSOS_TTL", "3600"))
+
+_local = threading.local()
+
+
+def _marcar_thread() -> None:
+    _local.no_pool = True
+
+
+_executor = ThreadPoolExecutor(
+    UNIDADES_THREADS, thread_name_prefix="unidade", initializer=_marcar_thread
+)
+
+
+def resolver(unidade: str | None = None) -> str:
+    """Unidade informada, ou a padrão; 404 se não for atendida por este servidor."""
+    if not unidade:
+        if not UNIDADE_PADRAO:
+            raise RuntimeError("Variáveis de ambiente OM não configuradas.")
+        return UNIDADE_PADRAO
+    unidade = str(unidade)
+    if unidade not in UNIDADES:
+        raise HTTPException(404, f"Unidade {unidade} não configurada")
+    return unidade
+
+
+def selecionar(unidade: str | None = None) -> list[str]:
+    """Unidades de uma listagem: todas sem ``unidade`` (ou com ``todas``)."""
+    if not unidade or unidade == TODAS:
+        return list(UNIDADES)
+    return [resolver(unidade)]
+
+
+def em_paralelo(funcao, unidades: list[str] | None = None) -> dict:
+    """``{unidade: funcao(unidade)}`` para cada unidade, consultadas em paralelo.
+
+    Espera todas terminarem e, se alguma falhar, levanta o primeiro erro. Com
+    uma unidade só, ou de dentro de outra chamada em paralelo, roda em
+    sequência na própria thread (o pool nunca espera por si mesmo).
+    """
+    unidades = list(UNIDADES if unidades is None else unidades)
+    if len(unidades) <= 1 or getattr(_local, "no_pool", False):
+        return {u: funcao(u) for u in unidades}
+    # Cada tarefa leva o contexto da requisição (rastreio e memo)
+    futuros = {
+        u: _executor.submit(contextvars.copy_context().run, funcao, u) for u in unidades
+    }
+    wait(futuros.values())
+    for futuro in futuros.values():
+        if futuro.exception() is not None:
+            raise futuro.exception()
+    return {u: futuro.result() for u, futuro in futuros.items()}
+
+
+# ──────────────────────────────────────────────────────────
+# Catálogo de cursos por unidade
+# ──────────────────────────────────────────────────────────
+_cursos = estado.CacheCompartilhado("unidades:cursos", UNIDADES_CURSOS_TTL)
+
+
+@chamada_unica("om_cursos_unidade")
+def _buscar_cursos(unidade: str) -> list:
+    if not OM_BASE or not BASIC_B64:
+        raise RuntimeError("Variáveis de ambiente OM não configuradas.")
+    r = requests.get(
+        f"{OM_BASE}/unidades/cursos/{unidade}",
+        headers={"Authorization": f"Basic {BASIC_B64}"},
+        timeout=10,
+    )
+    if r.ok:
+        dados = orjson.loads(r.content)
+        if dados.get("status") == "true":
+            return dados.get("data") or []
+    raise RuntimeError(f"Falha ao obter cursos da unidade {unidade}: HTTP {r.status_code}")
+
+
+def cursos(unidade: str | None = None, renovar: bool = False) -> list:
+    """Cursos da unidade na OM, em cache por ``UNIDADES_CURSOS_TTL`` segundos."""
+    unidade = resolver(unidade)
+    if not renovar:
+        em_cache = _cursos.get(unidade)
+        if em_cache is not None:
+            return em_cache
+    lista = _buscar_cursos(unidade)
+    _cursos.set(unidade, lista)
+    return lista
+
+
+def atualizar_cursos() -> dict:
+    """Recarrega o catálogo de todas as unidades; ``{unidade: quantidade}``."""
+    return {u: len(c) for u, c in em_paralelo(lambda u: cursos(u, renovar=True)).items()}
+
+
+def nomes_cursos() -> dict[str, str]:
+    """``{id: nome}`` dos catálogos já em cache, sem consultar a OM."""
+    nomes = {}
+    for unidade in UNIDADES:
+        for curso in _cursos.get(unidade) or []:
+            if isinstance(curso, dict) and curso.get("id") is not None and curso.get("nome"):
+                nomes.setdefault(str(curso["id"]), curso["nome"])
+    return nomes
+
+
+# ──────────────────────────────────────────────────────────
+# Rotas
+# ──────────────────────────────────────────────────────────
+@router.get("", summary="Unidades atendidas por este servidor")
+def listar_unidades():
+    return {"unidades": UNIDADES, "padrao": UNIDADE_PADRAO}
+
+
+@router.get("/cursos", summary="Catálogo de cursos de todas as unidades")
+def cursos_todas_unidades(atualizar: bool = False):
+    try:
+        return {"unidades": em_paralelo(lambda u: cursos(u, renovar=atualizar))}
+    except requests.RequestException as e:
+        raise HTTPException(502, f"Erro ao consultar cursos na OM: {e}")
+    except RuntimeError as e:
+        raise HTTPException(502, str(e))
+
+
+@router.get("/{unidade}/cursos", summary="Catálogo de cursos da unidade")
+def cursos_da_unidade(unidade: str, atualizar: bool = False):
+    unidade = resolver(unidade)
+    try:
+        return {"unidade": unidade, "cursos": cursos(unidade, renovar=atualizar)}
+    except requests.RequestException as e:
+        raise HTTPException(502, f"Erro ao consultar cursos na OM: {e}")
+    except RuntimeError as e:
+        raise HTTPException(502, str(e))